@@ -0,0 +1,114 @@
+"""
+memory and time of scoring a large candidate set in BestMatch
+
+'statement per candidate' is how candidates used to be scored: every row is loaded as a model
+instance and a conversation.Statement is built for each candidate above the minimum similarity,
+then the list is sorted and cut to the number of answers.
+'record per candidate' is how BestMatch scores them now: the rows are loaded as StatementRecord
+tuples and a Statement is only built for the answers that are returned.
+
+Example:
+
+python benchmarks/bench_candidates.py --statements 20000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.storage import SQLStorage  # noqa: E402
+from chatbot.conversation import Statement  # noqa: E402
+from chatbot.comparison import levenshtein_distance  # noqa: E402
+from chatbot.constants import MINIMUM_SIMILARITY_THRESHOLD, MAXIMUM_SIMILARITY_THRESHOLD, \
+    NUMBER_OF_ANSWERS  # noqa: E402
+
+
+WORDS = ['早上', '晚上', '中午', '吃', '喝', '鸡蛋', '牛奶', '水果', '面包', '对', '身体', '好吗', '怎么样', '可以', '每天']
+
+
+def random_question(random_):
+    return ''.join(random_.choice(WORDS) for _ in range(random_.randint(4, 8)))
+
+
+def to_statement(input_statement, statement, similarity):
+    return Statement(
+        id=statement.id,
+        question=input_statement,
+        reference_question=statement.question,
+        confidence=similarity,
+        answer=statement.answer,
+        category=statement.category,
+        type=statement.type,
+        parameters=statement.parameters,
+        extractor=statement.extractor
+    )
+
+
+def statement_per_candidate(storage, input_statement):
+    all_result = []
+    for statement in storage.all('statement'):
+        similarity = levenshtein_distance.compare(input_statement, statement.question)
+        if similarity >= MINIMUM_SIMILARITY_THRESHOLD:
+            all_result.append(to_statement(input_statement, statement, similarity))
+        if similarity >= MAXIMUM_SIMILARITY_THRESHOLD:
+            return [all_result[-1]]
+    all_result.sort(key=lambda s: s.confidence, reverse=True)
+    return all_result[:NUMBER_OF_ANSWERS]
+
+
+def record_per_candidate(storage, input_statement):
+    all_record = storage.all_statement_records()
+    all_most_similar = levenshtein_distance.most_similar(
+        input_statement,
+        [record.question for record in all_record],
+        NUMBER_OF_ANSWERS,
+        minimum_similarity=MINIMUM_SIMILARITY_THRESHOLD,
+        maximum_similarity=MAXIMUM_SIMILARITY_THRESHOLD
+    )
+    return [to_statement(input_statement, all_record[index], similarity) for index, similarity in all_most_similar]
+
+
+def measure(function, storage, input_statement):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(storage, input_statement)
+    elapsed_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed_time, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='memory and time of scoring a large candidate set')
+    parser.add_argument('--statements', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random_ = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(os.path.join(directory, 'bench.sqlite3')))
+        all_question = list(dict.fromkeys(random_question(random_) for _ in range(args.statements)))
+        storage.create_statements([
+            ({'question': question, 'answer': 'answer of {}'.format(question)}, []) for question in all_question
+        ])
+        input_statement = '每天早上喝一杯热牛奶好不好'
+
+        print('{} candidates'.format(len(all_question)))
+        all_answer = []
+        for function in (statement_per_candidate, record_per_candidate):
+            result, elapsed_time, peak = measure(function, storage, input_statement)
+            all_answer.append([(s.id, s.confidence) for s in result])
+            print('  {:<24}{:>9.1f} ms  peak {:>9.1f} KiB'.format(
+                function.__name__.replace('_', ' '), elapsed_time * 1000, peak / 1024
+            ))
+        print('  same answers: {}'.format(sorted(all_answer[0]) == sorted(all_answer[1])))
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+import time and first request latency of the chatbot
+
+Each measurement runs in a new interpreter, so nothing is already imported or loaded.
+
+Example:
+
+python benchmarks/bench_import.py --repeat 5 --jieba-cache-dir /tmp/chatbot-jieba
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+
+PROJECT_DIR_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_CODE = '''
+import json, time
+start = time.perf_counter()
+import chatbot.chatbot
+print(json.dumps({'import': time.perf_counter() - start}))
+'''
+
+FIRST_REQUEST_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+from chatbot.chatbot import ChatBot
+from chatbot.storage import SQLStorage
+import_time = time.perf_counter() - start
+
+start = time.perf_counter()
+bot = ChatBot('bench', storage=SQLStorage(database_uri=sys.argv[1]))
+initialize_time = time.perf_counter() - start
+
+warmup_time = 0
+if sys.argv[2] == 'warmup':
+    start = time.perf_counter()
+    bot.warmup()
+    warmup_time = time.perf_counter() - start
+
+all_request_time = []
+for _ in range(2):
+    start = time.perf_counter()
+    bot.get_response('早上吃鸡蛋对身体好不好')
+    all_request_time.append(time.perf_counter() - start)
+
+print(json.dumps({
+    'import': import_time,
+    'initialize': initialize_time,
+    'warmup': warmup_time,
+    'first_request': all_request_time[0],
+    'second_request': all_request_time[1],
+}))
+'''
+
+LEARN_CODE = '''
+import sys
+from chatbot.chatbot import ChatBot
+from chatbot.storage import SQLStorage
+bot = ChatBot('bench', storage=SQLStorage(database_uri=sys.argv[1]))
+bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+bot.learn('今天天气怎么样', '晴天')
+'''
+
+
+def run(code, *args, environment=None):
+    output = subprocess.check_output(
+        [sys.executable, '-c', code] + list(args),
+        cwd=PROJECT_DIR_PATH,
+        env=environment,
+        stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def report(name, all_result):
+    print(name)
+    for key in all_result[0]:
+        values = [result[key] * 1000 for result in all_result]
+        print('  {:<16}median {:>9.1f} ms  min {:>9.1f} ms'.format(key, statistics.median(values), min(values)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import time and first request latency of the chatbot')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--jieba-cache-dir', default=None, help='where jieba keeps the cache of its dictionary')
+    args = parser.parse_args()
+
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = PROJECT_DIR_PATH + os.pathsep + environment.get('PYTHONPATH', '')
+    if args.jieba_cache_dir:
+        environment['CHATBOT_JIEBA_CACHE_DIR'] = args.jieba_cache_dir
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = 'sqlite:///{}'.format(os.path.join(directory, 'bench.sqlite3'))
+        subprocess.check_call(
+            [sys.executable, '-c', LEARN_CODE, database_uri],
+            cwd=PROJECT_DIR_PATH,
+            env=environment,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        report('import chatbot.chatbot', [run(IMPORT_CODE, environment=environment) for _ in range(args.repeat)])
+        report('first request', [
+            run(FIRST_REQUEST_CODE, database_uri, 'cold', environment=environment) for _ in range(args.repeat)
+        ])
+        report('first request after warmup', [
+            run(FIRST_REQUEST_CODE, database_uri, 'warmup', environment=environment) for _ in range(args.repeat)
+        ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from .utils import logger
+from .models import access_log_table_name
+
+
+class AccessLogRecorder:
+    """
+    Record which statement was used to answer a question.
+
+    This recorder writes each access log to the storage immediately.
+
+    :param storage: storage model
+    """
+
+    def __init__(self, storage, **kwargs):
+        self.storage = storage
+
+        # logger
+        self.logger = kwargs.get('logger', logger)
+
+    def record(self, statement_id):
+        self.storage.create(model_name=access_log_table_name, **self.new_access_log(statement_id))
+
+    @staticmethod
+    def new_access_log(statement_id):
+        """
+        Return the access log of the statement, its access time is the time of the call in UTC,
+        the same time base as the server default of the column.
+        """
+        return {'statement_id': statement_id, 'access_time': datetime.now(timezone.utc)}
+
+    def flush(self):
+        """
+        Write the access logs that have not been written yet.
+        """
+        pass
+
+    def close(self):
+        """
+        Write the remaining access logs and release the resources of the recorder.
+        """
+        self.flush()
+
+
+class BufferedAccessLogRecorder(AccessLogRecorder):
+    """
+    Buffer the access logs in memory, a background thread writes them to the storage in batches,
+    either when batch_size logs are buffered or every flush_interval seconds.
+    The access time of a log is the time it is recorded, not the time it is written.
+
+    :param int batch_size: the number of logs that triggers a write
+    :param float flush_interval: the maximum number of seconds a log stays in the buffer
+    :param int max_buffer_size: the maximum number of logs kept in memory
+    :param str overflow_policy: what to do with a log when the buffer is full,
+        'drop': the log is lost and the request never waits,
+        'block': the request waits until the background thread makes room
+    :param bool retry_failed_batch: put a batch back into the buffer when writing it fails,
+        otherwise the batch is lost
+    :param bool flush_at_exit: write the buffer when the interpreter exits
+    """
+
+    def __init__(self, storage, **kwargs):
+        super().__init__(storage, **kwargs)
+        self.batch_size = kwargs.get('batch_size', 100)
+        self.flush_interval = kwargs.get('flush_interval', 1.0)
+        self.max_buffer_size = kwargs.get('max_buffer_size', 10000)
+        self.overflow_policy = kwargs.get('overflow_policy', 'drop')
+        self.retry_failed_batch = kwargs.get('retry_failed_batch', True)
+
+        # the number of access logs that were lost
+        self.dropped_count = 0
+
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        # serializes writes, so flush() returns only after the logs taken by the thread are written
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='access-log-recorder', daemon=True)
+        self._thread.start()
+
+        self._flush_at_exit = kwargs.get('flush_at_exit', True)
+        if self._flush_at_exit:
+            atexit.register(self.close)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def record(self, statement_id):
+        with self._condition:
+            if self._closed:
+                super().record(statement_id)
+                return
+
+            while len(self._buffer) >= self.max_buffer_size:
+                if self.overflow_policy == 'block':
+                    self._condition.notify_all()
+                    self._condition.wait()
+                    if self._closed:
+                        super().record(statement_id)
+                        return
+                else:
+                    self.dropped_count += 1
+                    self.logger.warning('the access log buffer is full, the access log of the statement {} '
+                                        'is dropped'.format(statement_id))
+                    return
+
+            self._buffer.append(self.new_access_log(statement_id))
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+
+    def _take_batch(self):
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        self._condition.notify_all()
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.storage.create_many(access_log_table_name, batch)
+        except Exception as e:
+            self.logger.error('writing {} access logs failed, {}'.format(len(batch), e))
+            with self._condition:
+                if self.retry_failed_batch and not self._closed and \
+                        len(self._buffer) + len(batch) <= self.max_buffer_size:
+                    self._buffer.extendleft(reversed(batch))
+                else:
+                    self.dropped_count += len(batch)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._buffer) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed:
+                    return
+
+            with self._write_lock:
+                with self._condition:
+                    batch = self._take_batch()
+                if batch:
+                    if not self._write(batch):
+                        # wait for the next interval before retrying
+                        time.sleep(self.flush_interval)
+
+    def flush(self):
+        with self._write_lock:
+            while True:
+                with self._condition:
+                    batch = self._take_batch()
+                if not batch or not self._write(batch):
+                    return
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        # the recorder and its storage no longer have to live until the interpreter exits
+        if self._flush_at_exit:
+            atexit.unregister(self.close)
+        self._thread.join()
+        self.flush()
@@ -1,12 +1,15 @@
-from .utils import logger, initialize_class, get_features, validate_class, import_module, get_object_path
+import asyncio
+import functools
+from .utils import logger, initialize_class, validate_class, import_module, get_object_path
 from .extractor import Extractor
-from .comparison import levenshtein_distance
+from .comparison import levenshtein_distance, get_comparator
 from .exceptions import MethodNotImplementedError, ExtractDataError
 from .constants import MAXIMUM_SIMILARITY_THRESHOLD, MINIMUM_SIMILARITY_THRESHOLD, NUMBER_OF_ANSWERS
-from .storage import SQLStorage
+from .storage import SQLStorage, AsyncSQLStorage
 from .conversation import Statement
-from .models import statement_table_name, tag_table_name, tag_association_statement_table_name
-from .tokenizer import jieba_segment as segment
+from .models import statement_table_name
+from .analysis import AnalyzedStatement
+from .index import TagIndex
 
 
 class LogicAdapter:
@@ -29,9 +32,9 @@ class LogicAdapter:
     """
 
     def __init__(self, **kwargs):
-        storage = kwargs.get('storage', SQLStorage())
+        storage = kwargs.get('storage', None)
 
-        # initialize storage class
+        # initialize storage class, the default storage is only created when it is used
         if isinstance(storage, str) or isinstance(storage, dict):
             self.storage = initialize_class(storage)
         else:
@@ -71,6 +74,63 @@ class LogicAdapter:
         """
         return True
 
+    @staticmethod
+    def get_analyzed_statement(statement, **kwargs):
+        """
+        Return the analyzed statement shared by the chatbot, the statement is
+        analyzed here when the adapter is used on its own.
+
+        :rtype: AnalyzedStatement
+        """
+        analyzed_statement = kwargs.get('analyzed_statement')
+        if analyzed_statement is None or analyzed_statement.text != statement:
+            analyzed_statement = AnalyzedStatement(statement)
+        return analyzed_statement
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            self._storage = SQLStorage()
+        return self._storage
+
+    @storage.setter
+    def storage(self, storage):
+        self._storage = storage
+
+    def prefetch(self, all_input):
+        """
+        Called by the chatbot with the inputs of a batch before they are processed one by one,
+        adapters can load the data that the whole batch needs at once here.
+
+        :param list all_input: list of (input statement, keyword arguments of process) tuple
+        :return: passed to process as the prefetched keyword argument, None by default
+        """
+        return None
+
+    def initialize(self):
+        """
+        Called once by the chatbot before the first statement is processed.
+        Adapters that keep in-memory data derived from the storage build it here.
+        """
+        pass
+
+    def learned(self, record, features):
+        """
+        Called by the chatbot after a statement has been learned.
+
+        :param StatementRecord record: the statement that was written to the storage
+        :param list features: keywords of the statement question
+        """
+        pass
+
+    def forgot(self, record):
+        """
+        Called by the chatbot after a statement has been removed from the storage.
+
+        :param StatementRecord record: the statement that was removed
+        """
+        pass
+
     def process(self, statement, **kwargs):
         """
         Override this method and implement your logic for selecting a response to an input statement.
@@ -89,6 +149,28 @@ class LogicAdapter:
         """
         raise MethodNotImplementedError()
 
+    async def acan_process(self, statement, executor=None, **kwargs):
+        """
+        The asyncio version of can_process, by default can_process runs on the executor,
+        adapters whose check is cheap can override it to answer without leaving the event loop.
+
+        :param executor: the executor of the blocking work, None is the default executor of the event loop
+        :rtype: bool
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(self.can_process, statement, **kwargs))
+
+    async def aprocess(self, statement, executor=None, **kwargs):
+        """
+        The asyncio version of process, by default process runs on the executor,
+        so the segmentation and the comparison of the statements do not block the event loop.
+
+        :param executor: the executor of the blocking work, None is the default executor of the event loop
+        :return list:
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(self.process, statement, **kwargs))
+
     def get_default_response(self, statement):
         """
         This method is called when a logic adapter is unable to generate any
@@ -133,83 +215,354 @@ class BestMatch(LogicAdapter):
         self.using_full_library_scan = kwargs.get('using_full_library_scan', False)
 
         # comparator
-        self.comparator = kwargs.get('comparator', levenshtein_distance)
+        self.comparator = get_comparator(kwargs.get('comparator', levenshtein_distance))
+
+        # in-process tag index, when it is set the candidate statements are looked up
+        # without hitting the database, eg: 'chatbot.index.TagIndex',
+        # 'chatbot.index.BM25Index' also ranks them so only the best ones are compared
+        tag_index = kwargs.get('tag_index', None)
+        if isinstance(tag_index, str) or isinstance(tag_index, dict):
+            self.tag_index = initialize_class(tag_index, logger=self.logger)
+        else:
+            self.tag_index = tag_index
+
+        # only compare the candidate_limit statements that share the most keywords with the input,
+        # None compares all statements that share at least one keyword
+        self.candidate_limit = kwargs.get('candidate_limit', None)
+
+        # locality sensitive hashing index over the questions, when it is set the statements
+        # with no keyword in common are looked up in it instead of scanning the full library,
+        # eg: 'chatbot.index.MinHashLSHIndex'
+        lsh_index = kwargs.get('lsh_index', None)
+        if isinstance(lsh_index, str) or isinstance(lsh_index, dict):
+            self.lsh_index = initialize_class(lsh_index, logger=self.logger)
+        else:
+            self.lsh_index = lsh_index
+
+        # look up the candidate statements in the full text index of the storage first,
+        # the storage must be created with full_text_search=True
+        self.use_full_text_search = kwargs.get('use_full_text_search', False)
+
+        # when the request has a deadline, the candidates are compared in batches of this size
+        # and the best ones of the batches compared so far are returned when the time runs out
+        self.score_batch_size = kwargs.get('score_batch_size', 1000)
 
     def can_process(self, statement, **kwargs):
         return not kwargs.get('context', {}).get('domain')
 
-    def process(self, input_statement, **kwargs):
-        features = get_features(input_statement)
-        if features:
-            self.logger.info('the keyword of the "{}" statement is "{}"'.format(
-                input_statement, ','.join(['{}'.format(f) for f in features]))
+    async def acan_process(self, statement, executor=None, **kwargs):
+        return self.can_process(statement, **kwargs)
+
+    def initialize(self):
+        if self.tag_index is not None:
+            self.tag_index.build(self.storage)
+        if self.lsh_index is not None:
+            self.lsh_index.build(self.storage)
+        self.comparator.initialize(self.storage)
+
+    def learned(self, record, features):
+        if self.tag_index is not None:
+            self.tag_index.add(record, features)
+        if self.lsh_index is not None:
+            self.lsh_index.add(record)
+        self.comparator.learned(record.question)
+
+    def forgot(self, record):
+        if self.tag_index is not None:
+            self.tag_index.remove(record.id)
+        if self.lsh_index is not None:
+            self.lsh_index.remove(record.id)
+        self.comparator.forgot(record.question)
+
+    def prefetch(self, all_input):
+        """
+        Load the candidates of all inputs with one query, they are kept in a tag index
+        that only holds the statements associated with the features of the inputs.
+        With candidate_limit, only the candidate_limit statements of each input are loaded,
+        so each input is compared with the same statements as by get_response.
+        """
+        if self.tag_index is not None:
+            return None
+
+        all_feature = {}
+        all_input_features = []
+        for input_statement, kwargs in all_input:
+            if self.can_process(input_statement, **kwargs):
+                features = self.get_analyzed_statement(input_statement, **kwargs).features
+                all_feature.update(dict.fromkeys(features))
+                all_input_features.append(features)
+        if not all_feature:
+            return None
+
+        tag_index = TagIndex(logger=self.logger)
+        for record, tag_names in self.storage.filter_tagged_by_tags(
+            all_feature, limit=self.candidate_limit, all_group=all_input_features
+        ):
+            tag_index.add(record, tag_names)
+        self.logger.info('prefetched "{}" statements for "{}" inputs'.format(len(tag_index), len(all_input)))
+        return tag_index
+
+    def search_by_features(self, features, prefetched=None, with_features=False):
+        """
+        Return the statements associated with at least one of the features,
+        at most candidate_limit statements.
+
+        :param bool with_features: return (statement, StatementFeatureRecord) tuples, the stored features
+            are loaded together with the statements, the feature is None when it is not at hand
+        """
+        index = self.tag_index if self.tag_index is not None else prefetched
+        if index is not None:
+            return self._without_stored_features(index.search(features, limit=self.candidate_limit), with_features)
+
+        return self.storage.filter_by_tags(features, limit=self.candidate_limit, with_features=with_features)
+
+    async def asearch_by_features(self, features, storage, prefetched=None, with_features=False):
+        """
+        The asyncio version of search_by_features, the storage is queried through the AsyncSQLStorage.
+        """
+        index = self.tag_index if self.tag_index is not None else prefetched
+        if index is not None:
+            return self._without_stored_features(index.search(features, limit=self.candidate_limit), with_features)
+
+        return await storage.filter_by_tags(features, limit=self.candidate_limit, with_features=with_features)
+
+    def search_without_features(self, input_statement, deadline=None, with_features=False):
+        """
+        Return the statements to compare when no statement can be found by keywords,
+        the near duplicates of the input found by the lsh index, otherwise all statements.
+        Nothing is returned when the time is already up.
+
+        :param bool with_features: same as search_by_features
+        """
+        if self._is_expired(deadline):
+            return []
+
+        if self.lsh_index is not None:
+            return self._without_stored_features(
+                self.lsh_index.search(str(input_statement), limit=self.candidate_limit), with_features
+            )
+
+        return self.storage.all_statement_records(with_features=with_features)
+
+    async def asearch_without_features(self, input_statement, storage, deadline=None, with_features=False):
+        """
+        The asyncio version of search_without_features, the storage is queried through the AsyncSQLStorage.
+        """
+        if self._is_expired(deadline):
+            return []
+
+        if self.lsh_index is not None:
+            return self._without_stored_features(
+                self.lsh_index.search(str(input_statement), limit=self.candidate_limit), with_features
             )
-            sql = '''SELECT distinct s.* FROM {statement_table} s, {tag_table} t, {tag_association_statement_table} tas
-                   where s.id = tas.statement_id
-                   and t.id = tas.tag_id
-                   and t.name in ({condition});'''.format(
-                statement_table=statement_table_name,
-                tag_table=tag_table_name,
-                tag_association_statement_table=tag_association_statement_table_name,
-                condition=','.join(['"{}"'.format(f) for f in features])
+
+        return await storage.all_statement_records(with_features=with_features)
+
+    def _is_expired(self, deadline):
+        if deadline is None or not deadline.expired():
+            return False
+        deadline.truncated = True
+        self.logger.info('no time left for the full library comparison')
+        return True
+
+    @staticmethod
+    def _without_stored_features(statements, with_features):
+        if not with_features:
+            return statements
+        return [(statement, None) for statement in statements]
+
+    def most_similar(self, input_statement, questions, deadline=None, features=None):
+        """
+        Return the (index, similarity) of the questions that are the most similar to the input.
+        With a deadline, the questions are compared in batches and the comparison stops
+        when the time is up, the first batch is always compared.
+
+        :param list questions: list of str
+        :param Deadline deadline: the deadline of the request
+        :param list features: the StatementFeatureRecord of each question, passed to the comparator
+        """
+        if deadline is None:
+            return self.comparator.most_similar(
+                input_statement,
+                questions,
+                self.number_of_answers,
+                minimum_similarity=self.minimum_similarity_threshold,
+                maximum_similarity=self.maximum_similarity_threshold,
+                **self._features_kwargs(features)
             )
-            all_need_to_match_statements = self.storage.execute(sql)
+
+        all_most_similar = []
+        for start in range(0, len(questions), self.score_batch_size):
+            if start and deadline.expired():
+                deadline.truncated = True
+                self.logger.info('compared {} of {} statements before the time is up'.format(start, len(questions)))
+                break
+            for index, similarity in self.comparator.most_similar(
+                input_statement,
+                questions[start:start + self.score_batch_size],
+                self.number_of_answers,
+                minimum_similarity=self.minimum_similarity_threshold,
+                maximum_similarity=self.maximum_similarity_threshold,
+                **self._features_kwargs(features, start)
+            ):
+                if self.maximum_similarity_threshold is not None and similarity >= self.maximum_similarity_threshold:
+                    return [(start + index, similarity)]
+                all_most_similar.append((start + index, similarity))
+        all_most_similar.sort(key=lambda s: (-s[1], s[0]))
+        return all_most_similar[:self.number_of_answers]
+
+    @staticmethod
+    def _split_features(statements_with_features):
+        statements, features = [], []
+        for statement, feature in statements_with_features:
+            statements.append(statement)
+            features.append(feature)
+        return statements, features
+
+    def _features_kwargs(self, features, start=None):
+        """
+        The features keyword argument of the comparator, only comparators that use the features take it.
+        """
+        if features is None or not self.comparator.uses_features:
+            return {}
+        if start is not None:
+            features = features[start:start + self.score_batch_size]
+        return {'features': features}
+
+    def process(self, input_statement, **kwargs):
+        deadline = kwargs.get('deadline')
+        with_features = self.comparator.uses_features
+        all_need_to_match_statements = None
+        if self.use_full_text_search:
+            all_need_to_match_statements = self._without_stored_features(self.storage.search_questions(
+                str(input_statement), limit=self.candidate_limit
+            ), with_features)
+            self._log_full_text_search(all_need_to_match_statements)
+
+        if not all_need_to_match_statements:
+            features = self.get_analyzed_statement(input_statement, **kwargs).features
+            if features:
+                all_need_to_match_statements = self.search_by_features(
+                    features, kwargs.get('prefetched'), with_features
+                )
+                self._log_keyword_search(input_statement, features, all_need_to_match_statements)
 
             if not all_need_to_match_statements:
-                if self.using_full_library_scan:
-                    self.logger.info('unable to find database data using keywords, change to full library comparison')
-                    all_need_to_match_statements = self.storage.all(statement_table_name)
-                else:
-                    self.logger.info('unable to find database data using keywords')
+                if not self._can_compare_without_features(input_statement, features):
                     return []
-            else:
-                self.logger.info('use keywords to find "{}" pieces of data and use it for comparison'.format(
-                    len(all_need_to_match_statements))
+                all_need_to_match_statements = self.search_without_features(input_statement, deadline, with_features)
+
+        return self.rank(input_statement, all_need_to_match_statements, deadline)
+
+    async def aprocess(self, statement, executor=None, **kwargs):
+        """
+        The asyncio version of process, the storage is queried through an AsyncSQLStorage
+        and the segmentation and the comparison of the statements run on the executor.
+        """
+        loop = asyncio.get_running_loop()
+        storage = AsyncSQLStorage(storage=self.storage, executor=executor)
+        deadline = kwargs.get('deadline')
+        with_features = self.comparator.uses_features
+        all_need_to_match_statements = None
+        if self.use_full_text_search:
+            all_need_to_match_statements = self._without_stored_features(await storage.search_questions(
+                str(statement), limit=self.candidate_limit
+            ), with_features)
+            self._log_full_text_search(all_need_to_match_statements)
+
+        if not all_need_to_match_statements:
+            analyzed_statement = self.get_analyzed_statement(statement, **kwargs)
+            features = await loop.run_in_executor(executor, lambda: analyzed_statement.features)
+            if features:
+                all_need_to_match_statements = await self.asearch_by_features(
+                    features, storage, kwargs.get('prefetched'), with_features
                 )
-        else:
-            if self.using_full_library_scan:
-                self.logger.info('"{}" statement has no keywords, full library comparison'.format(input_statement))
-                all_need_to_match_statements = self.storage.all(statement_table_name)
+                self._log_keyword_search(statement, features, all_need_to_match_statements)
+
+            if not all_need_to_match_statements:
+                if not self._can_compare_without_features(statement, features):
+                    return []
+                all_need_to_match_statements = await self.asearch_without_features(
+                    statement, storage, deadline, with_features
+                )
+
+        return await loop.run_in_executor(
+            executor, functools.partial(self.rank, statement, all_need_to_match_statements, deadline)
+        )
+
+    def _log_full_text_search(self, all_need_to_match_statements):
+        self.logger.info('use full text search to find "{}" pieces of data'.format(
+            len(all_need_to_match_statements))
+        )
+
+    def _log_keyword_search(self, input_statement, features, all_need_to_match_statements):
+        self.logger.info('the keyword of the "{}" statement is "{}"'.format(
+            input_statement, ','.join(['{}'.format(f) for f in features]))
+        )
+        if all_need_to_match_statements:
+            self.logger.info('use keywords to find "{}" pieces of data and use it for comparison'.format(
+                len(all_need_to_match_statements))
+            )
+
+    def _can_compare_without_features(self, input_statement, features):
+        """
+        Whether the statements found without keywords are compared when the keywords find nothing.
+        """
+        if self.using_full_library_scan or self.lsh_index is not None:
+            if features:
+                self.logger.info('unable to find database data using keywords, change to full library comparison')
             else:
-                self.logger.info('"{}" statement has no keywords'.format(input_statement))
-                return []
+                self.logger.info('"{}" statement has no keywords, full library comparison'.format(input_statement))
+            return True
+
+        if features:
+            self.logger.info('unable to find database data using keywords')
+        else:
+            self.logger.info('"{}" statement has no keywords'.format(input_statement))
+        return False
+
+    def rank(self, input_statement, all_need_to_match_statements, deadline=None):
+        """
+        Compare the input with the statements and return the most similar ones as answers.
+
+        :param all_need_to_match_statements: list of statement, or of (statement, StatementFeatureRecord) tuple
+            when the comparator uses the features
+        :param Deadline deadline: the deadline of the request
+        :return list: list of Statement
+        """
+        # get the statements with the highest similarity
+        all_features = None
+        if self.comparator.uses_features:
+            all_need_to_match_statements, all_features = self._split_features(all_need_to_match_statements)
+        all_need_to_match_statements = list(all_need_to_match_statements)
+        all_most_similar = self.most_similar(
+            input_statement,
+            [statement.question for statement in all_need_to_match_statements],
+            deadline,
+            all_features
+        )
 
-        # get similarity to all data in the database
-        all_result = []
-        for statement in all_need_to_match_statements:
-            similarity = self.comparator(input_statement, statement.question)
+        res = []
+        for index, similarity in all_most_similar:
+            statement = all_need_to_match_statements[index]
             self.logger.debug(
                 'the similarity between the statement "{}" and the statement "{}" is {}'.format(
                     input_statement, statement.question, similarity
                 )
             )
-            if similarity >= self.minimum_similarity_threshold:
-                all_result.append(
-                    Statement(
-                        id=statement.id,
-                        question=input_statement,
-                        reference_question=statement.question,
-                        confidence=similarity,
-                        answer=statement.answer,
-                        category=statement.category,
-                        type=statement.type,
-                        parameters=statement.parameters,
-                        extractor=statement.extractor
-                    )
+            res.append(
+                Statement(
+                    id=statement.id,
+                    question=input_statement,
+                    reference_question=statement.question,
+                    confidence=similarity,
+                    answer=statement.answer,
+                    category=statement.category,
+                    type=statement.type,
+                    parameters=statement.parameters,
+                    extractor=statement.extractor
                 )
-
-            # if the similarity is greater than the maximum_similarity_threshold,
-            # the matching is stopped, which can reduce the matching time.
-            if similarity >= self.maximum_similarity_threshold:
-                return [all_result[-1]]
-
-        # get the statement with the highest similarity
-        res = []
-        if all_result:
-            all_result.sort(key=lambda s: s.confidence, reverse=True)
-            res = all_result[:self.number_of_answers]
-        # else:
-        #     res = [self.get_default_response(input_statement)]
+            )
 
         return res
 
@@ -218,6 +571,9 @@ class DomainManager(LogicAdapter):
     def can_process(self, statement, **kwargs):
         return kwargs.get('context', {}).get('domain')
 
+    async def acan_process(self, statement, executor=None, **kwargs):
+        return self.can_process(statement, **kwargs)
+
     def process(self, input_statement, **kwargs):
         context = kwargs.get('context', {})
         id_ = context.get('id')
@@ -233,7 +589,9 @@ class DomainManager(LogicAdapter):
 
         # initial extractor
         validate_class(extractor, Extractor)
-        extractor_obj = import_module(extractor)(input_statement)
+        extractor_obj = import_module(extractor)(
+            input_statement, analyzed_statement=self.get_analyzed_statement(input_statement, **kwargs)
+        )
 
         # extract parameter
         get_arg_val_fun = getattr(extractor_obj, 'extract_{}'.format(need_extract_parameter),
@@ -275,19 +633,18 @@ class WhatCanIDo(LogicAdapter):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # comparator
-        self.comparator = kwargs.get('comparator', levenshtein_distance)
+        self.comparator = get_comparator(kwargs.get('comparator', levenshtein_distance))
 
     def can_process(self, statement, **kwargs):
         if not kwargs.get('context', {}).get('domain'):
-            segment_text = segment.cut(statement, seg_only=True, remove_stop_word=True)
+            segment_text = self.get_analyzed_statement(statement, **kwargs).get_words(remove_stop_word=True)
             for keyword in ['功能', '能力']:
                 if keyword in segment_text:
                     return True
 
     def process(self, input_statement, **kwargs):
         questions = ['机器人功能', '机器人能力']
-        for question in questions:
-            similarity = self.comparator(input_statement, question)
+        for question, similarity in zip(questions, self.comparator.compare_many(input_statement, questions)):
             if similarity >= self.maximum_similarity_threshold:
                 answer = '我提供的服务如下:\n'
                 index = 0
@@ -0,0 +1,358 @@
+"""
+analysis resources shared by the tokenizer, the keyword extraction and the extractors
+
+jieba is imported and its dictionary is loaded the first time a statement is analyzed,
+call warmup to do it at a chosen point instead, eg: before a worker accepts requests.
+"""
+import os
+import codecs
+import threading
+from types import MappingProxyType
+from .constants import PROJECT_DIR_PATH
+from .utils import normalize_question, get_character_ngrams
+
+
+DEFAULT_STOP_WORD_FILE_PATH = os.path.join(PROJECT_DIR_PATH, 'data', 'stopwords.txt')
+DEFAULT_CUSTOM_DICTIONARY_FILE_PATH = os.path.join(PROJECT_DIR_PATH, 'data', 'dict.txt')
+
+# the directory where jieba keeps the cache of its prebuilt dictionary, defaults to the temporary directory
+JIEBA_CACHE_DIR_ENVIRONMENT_VARIABLE = 'CHATBOT_JIEBA_CACHE_DIR'
+
+
+def configure_jieba(cache_dir=None):
+    """
+    Set the directory where jieba keeps the cache of its prebuilt dictionary,
+    it only has an effect before jieba loads its dictionary.
+
+    :param str cache_dir: defaults to the CHATBOT_JIEBA_CACHE_DIR environment variable
+    """
+    cache_dir = cache_dir or os.environ.get(JIEBA_CACHE_DIR_ENVIRONMENT_VARIABLE)
+    if not cache_dir:
+        return
+
+    import jieba
+
+    os.makedirs(cache_dir, exist_ok=True)
+    jieba.dt.tmp_dir = cache_dir
+
+
+class AnalysisResources:
+    """
+    The stop words, the custom dictionary and the idf table used to analyze statements.
+
+    Each resource is loaded on first use and only once, then kept in an immutable structure
+    (frozenset or read-only mapping) so it can be shared by all threads.
+
+    :param str stop_word_file_path: stop word file, one word per line
+    :param str custom_dictionary_file_path: jieba user dictionary
+    :param str idf_file_path: idf table used by keyword extraction, defaults to the jieba idf table
+    """
+
+    def __init__(self, **kwargs):
+        self.stop_word_file_path = kwargs.get('stop_word_file_path', DEFAULT_STOP_WORD_FILE_PATH)
+        self.custom_dictionary_file_path = kwargs.get(
+            'custom_dictionary_file_path', DEFAULT_CUSTOM_DICTIONARY_FILE_PATH
+        )
+        self.idf_file_path = kwargs.get('idf_file_path', None)
+
+        self._lock = threading.RLock()
+        self._stop_words = None
+        self._keyword_stop_words = None
+        self._idf = None
+        self._median_idf = None
+        self._custom_dictionary_loaded = False
+        self._added_words = set()
+
+        # changed every time words are added to or deleted from jieba,
+        # segmentation results computed with an older version are out of date
+        self.dictionary_version = 0
+
+    @property
+    def stop_words(self):
+        """
+        The stop words removed by the tokenizer.
+        """
+        if self._stop_words is None:
+            with self._lock:
+                if self._stop_words is None:
+                    with codecs.open(self.stop_word_file_path, 'r', encoding='utf8') as f:
+                        self._stop_words = frozenset(line.strip() for line in f)
+        return self._stop_words
+
+    @property
+    def keyword_stop_words(self):
+        """
+        The stop words ignored by keyword extraction, built the same way as
+        ``jieba.analyse.set_stop_words`` does, so the keywords do not change.
+        """
+        if self._keyword_stop_words is None:
+            with self._lock:
+                if self._keyword_stop_words is None:
+                    from jieba.analyse.tfidf import KeywordExtractor
+
+                    with open(self.stop_word_file_path, 'rb') as f:
+                        lines = f.read().decode('utf-8').splitlines()
+                    self._keyword_stop_words = frozenset(KeywordExtractor.STOP_WORDS).union(lines)
+        return self._keyword_stop_words
+
+    def _load_idf(self):
+        with self._lock:
+            if self._idf is not None:
+                return
+            if self.idf_file_path:
+                from jieba.analyse.tfidf import IDFLoader
+
+                idf, median_idf = IDFLoader(self.idf_file_path).get_idf()
+            else:
+                # reuse the table jieba has already loaded instead of keeping a second copy
+                import jieba.analyse
+
+                idf, median_idf = jieba.analyse.default_tfidf.idf_freq, jieba.analyse.default_tfidf.median_idf
+            self._median_idf = median_idf
+            self._idf = MappingProxyType(idf)
+
+    @property
+    def idf(self):
+        if self._idf is None:
+            self._load_idf()
+        return self._idf
+
+    @property
+    def median_idf(self):
+        if self._idf is None:
+            self._load_idf()
+        return self._median_idf
+
+    def load_custom_dictionary(self):
+        """
+        Load the custom dictionary into jieba, it is only read the first time.
+        """
+        if not self._custom_dictionary_loaded:
+            with self._lock:
+                if not self._custom_dictionary_loaded:
+                    import jieba
+
+                    if not jieba.dt.initialized:
+                        configure_jieba()
+                    jieba.load_userdict(self.custom_dictionary_file_path)
+                    self._custom_dictionary_loaded = True
+                    self.dictionary_version += 1
+
+    def add_words(self, words):
+        """
+        Add the words to the jieba dictionary, words that were already added are skipped.
+
+        :return bool: whether the dictionary changed
+        """
+        new_words = [word for word in words if word not in self._added_words]
+        if not new_words:
+            return False
+
+        import jieba
+
+        self.load_custom_dictionary()
+        with self._lock:
+            for word in new_words:
+                jieba.add_word(word)
+                self._added_words.add(word)
+            self.dictionary_version += 1
+        return True
+
+    def remove_words(self, words):
+        """
+        Delete the words from the jieba dictionary.
+        """
+        import jieba
+
+        self.load_custom_dictionary()
+        with self._lock:
+            for word in words:
+                jieba.del_word(word)
+                self._added_words.discard(word)
+            self.dictionary_version += 1
+
+    def rank_keywords(self, words, top_k=None):
+        """
+        Rank the words by TF-IDF, the same way as ``jieba.analyse.extract_tags`` does.
+
+        :param words: the words of a statement
+        :param int top_k: the number of keywords to return, None for all
+        :return list: keywords, the most important first
+        """
+        stop_words = self.keyword_stop_words
+        idf = self.idf
+        median_idf = self.median_idf
+
+        frequency = {}
+        for word in words:
+            if len(word.strip()) < 2 or word.lower() in stop_words:
+                continue
+            frequency[word] = frequency.get(word, 0.0) + 1.0
+        total = sum(frequency.values())
+        for word in frequency:
+            frequency[word] *= idf.get(word, median_idf) / total
+
+        keywords = sorted(frequency, key=frequency.__getitem__, reverse=True)
+        if top_k:
+            return keywords[:top_k]
+        return keywords
+
+    def extract_keywords(self, content, top_k=None, allow_pos=()):
+        """
+        Extract keywords from the content with TF-IDF.
+
+        :param str content: statement
+        :param int top_k: the number of keywords to return, None for all
+        :param allow_pos: only words with these part of speech are kept, eg: ('ns', 'n', 'vn', 'v')
+        :return list: keywords, the most important first
+        """
+        import jieba
+        import jieba.posseg as pseg
+
+        self.load_custom_dictionary()
+        if allow_pos:
+            allow_pos = frozenset(allow_pos)
+            words = [word for word, flag in pseg.cut(content) if flag in allow_pos]
+        else:
+            words = jieba.cut(content)
+        return self.rank_keywords(words, top_k)
+
+    def warmup(self):
+        """
+        Import jieba and load every resource now instead of on first use.
+        """
+        import jieba.posseg
+
+        self.load_custom_dictionary()
+        self.stop_words
+        self.keyword_stop_words
+        self.idf
+        # the part of speech model is loaded by the first cut
+        list(jieba.posseg.cut('预热'))
+
+
+class AnalyzedStatement:
+    """
+    The segmentation, part of speech tags and keywords of a statement.
+
+    Each result is computed on first use and then reused, so a statement that is passed
+    to all adapters and extractors is only segmented by jieba once. Results are computed
+    again if words were added to the jieba dictionary in the meantime.
+
+    :param str text: statement
+    :param AnalysisResources resources: defaults to the shared resources
+    """
+
+    def __init__(self, text, resources=None):
+        self.text = text
+        self.resources = resources or get_analysis_resources()
+        self._words = None
+        self._words_version = None
+        self._words_and_tags = None
+        self._words_and_tags_version = None
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return '<AnalyzedStatement text:%s>' % self.text
+
+    @property
+    def words(self):
+        """
+        The words of the statement, eg: ['我', '爱', '北京', '天安门']
+        """
+        self.resources.load_custom_dictionary()
+        if self._words is None or self._words_version != self.resources.dictionary_version:
+            import jieba
+
+            self._words_version = self.resources.dictionary_version
+            self._words = list(jieba.cut(self.text))
+        return self._words
+
+    @property
+    def words_and_tags(self):
+        """
+        The words of the statement and their part of speech, eg: [('我', 'r'), ('爱', 'v')]
+        """
+        self.resources.load_custom_dictionary()
+        if self._words_and_tags is None or self._words_and_tags_version != self.resources.dictionary_version:
+            import jieba.posseg as pseg
+
+            self._words_and_tags_version = self.resources.dictionary_version
+            self._words_and_tags = [(word, tag) for word, tag in pseg.cut(self.text)]
+        return self._words_and_tags
+
+    def get_words(self, remove_stop_word=False):
+        if remove_stop_word:
+            stop_words = self.resources.stop_words
+            return [word for word in self.words if word not in stop_words]
+        return list(self.words)
+
+    def get_words_and_tags(self, remove_stop_word=False):
+        if remove_stop_word:
+            stop_words = self.resources.stop_words
+            return [(word, tag) for word, tag in self.words_and_tags if word not in stop_words]
+        return list(self.words_and_tags)
+
+    def get_keywords(self, top_k=None, allow_pos=()):
+        """
+        The keywords of the statement ranked by TF-IDF, see ``AnalysisResources.extract_keywords``.
+        """
+        if allow_pos:
+            allow_pos = frozenset(allow_pos)
+            words = [word for word, tag in self.words_and_tags if tag in allow_pos]
+        else:
+            words = self.words
+        return self.resources.rank_keywords(words, top_k)
+
+    @property
+    def features(self):
+        """
+        The keywords used as the tags of the statement, the same as ``utils.get_features``.
+        """
+        return self.get_keywords(top_k=max(3, int(len(self.text) / 6)))
+
+    @property
+    def match_features(self):
+        """
+        The data stored in the statement_feature table when the statement is learned.
+        """
+        normalized_question = normalize_question(self.text)
+        return {
+            'normalized_question': normalized_question,
+            'length': len(normalized_question),
+            'ngrams': ' '.join(get_character_ngrams(normalized_question)),
+            'tokens': ' '.join(word for word in self.words if word.strip()),
+        }
+
+
+_all_resources = {}
+_all_resources_lock = threading.Lock()
+
+
+def get_analysis_resources(stop_word_file_path=DEFAULT_STOP_WORD_FILE_PATH,
+                           custom_dictionary_file_path=DEFAULT_CUSTOM_DICTIONARY_FILE_PATH,
+                           idf_file_path=None):
+    """
+    Return the resources shared by everything that uses the same files.
+    """
+    key = (stop_word_file_path, custom_dictionary_file_path, idf_file_path)
+    with _all_resources_lock:
+        if key not in _all_resources:
+            _all_resources[key] = AnalysisResources(
+                stop_word_file_path=stop_word_file_path,
+                custom_dictionary_file_path=custom_dictionary_file_path,
+                idf_file_path=idf_file_path
+            )
+        return _all_resources[key]
+
+
+def warmup(jieba_cache_dir=None):
+    """
+    Load jieba and the shared analysis resources, so the first request does not pay for it.
+
+    :param str jieba_cache_dir: see configure_jieba
+    """
+    configure_jieba(jieba_cache_dir)
+    get_analysis_resources().warmup()
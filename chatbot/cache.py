@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    A bounded cache that evicts the least recently used entry when it is full,
+    entries older than the time to live are treated as missing.
+
+    :param int max_size: the maximum number of entries
+    :param float ttl: the number of seconds an entry stays valid, None means entries do not expire
+    :param timer: function returning the current time in seconds
+    """
+
+    def __init__(self, max_size=1024, ttl=None, timer=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expire_at = entry
+                if expire_at is None or expire_at > self.timer():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            expire_at = self.timer() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (value, expire_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
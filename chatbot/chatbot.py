@@ -1,20 +1,36 @@
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import itertools
+import json
+import time
 from .adapter import LogicAdapter
-from .utils import initialize_class, logger, validate_class, import_module, get_features, get_object_path
+from .utils import initialize_class, logger, validate_class, import_module, get_object_path, read_corpus
 from .constants import MAXIMUM_SIMILARITY_THRESHOLD, MINIMUM_SIMILARITY_THRESHOLD, \
     NUMBER_OF_ANSWERS, CONTEXT_PARAMETER_MAX_ERROR_COUNT
 from .exceptions import NotEnoughParameterError
-from .models import statement_table_name, tag_table_name, tag_association_statement_table_name, access_log_table_name
+from .models import statement_table_name, tag_table_name, tag_association_statement_table_name, access_log_table_name, \
+    statement_feature_table_name
 from .storage import SQLStorage
+from .index import StatementRecord
+from .analysis import AnalyzedStatement, warmup as warmup_analysis
+from .cache import ResponseCache
+from .access_log import AccessLogRecorder
+from .registry import answer_functions
+from .deadline import Deadline
 
 
 class ChatBot:
     def __init__(self, name, **kwargs):
         self.name = name
         # storage = kwargs.get('storage', 'chatbot.storage.SQLStorage')
-        storage = kwargs.get('storage', SQLStorage())
+        storage = kwargs.get('storage', None)
 
-        # initialize storage class
-        if isinstance(storage, str) or isinstance(storage, dict):
+        # initialize storage class, the default storage is only created when no storage is given
+        if storage is None:
+            self.storage = SQLStorage()
+        elif isinstance(storage, str) or isinstance(storage, dict):
             self.storage = initialize_class(storage)
         else:
             self.storage = storage
@@ -71,19 +87,400 @@ class ChatBot:
         for preprocessor in preprocessors:
             self.preprocessors.append(import_module(preprocessor))
 
+        # the access logs are written immediately by default,
+        # eg: {'import_path': 'chatbot.access_log.BufferedAccessLogRecorder', 'batch_size': 100}
+        access_log_recorder = kwargs.get('access_log_recorder', None)
+        if isinstance(access_log_recorder, str) or isinstance(access_log_recorder, dict):
+            self.access_log_recorder = initialize_class(access_log_recorder, storage=self.storage, logger=self.logger)
+        elif access_log_recorder is None:
+            self.access_log_recorder = AccessLogRecorder(self.storage, logger=self.logger)
+        else:
+            self.access_log_recorder = access_log_recorder
+
+        # cache of the responses to the same input in the same context, eg: {'max_size': 1024, 'ttl': 600}
+        response_cache = kwargs.get('response_cache', None)
+        if isinstance(response_cache, dict):
+            self.response_cache = ResponseCache(**response_cache)
+        elif response_cache is True:
+            self.response_cache = ResponseCache()
+        elif response_cache is False:
+            self.response_cache = None
+        else:
+            self.response_cache = response_cache
+
+        # the answers of dynamic statements (type=1) are computed on every request unless this is set
+        self.cache_dynamic_answers = kwargs.get('cache_dynamic_answers', False)
+
+        # the executor that runs the blocking work of aget_response, eg: a ThreadPoolExecutor,
+        # None is the default executor of the event loop
+        self.executor = kwargs.get('executor', None)
+
+        # run the logic adapters concurrently on this executor, the response is returned as soon as
+        # one adapter is confident enough, None runs them one after another,
+        # eg: {'import_path': 'concurrent.futures.ThreadPoolExecutor', 'max_workers': 4}
+        adapter_executor = kwargs.get('adapter_executor', None)
+        self._owns_adapter_executor = isinstance(adapter_executor, str) or isinstance(adapter_executor, dict)
+        if self._owns_adapter_executor:
+            self.adapter_executor = initialize_class(adapter_executor)
+        else:
+            self.adapter_executor = adapter_executor
+
+        # the default number of seconds a response may take, None for no limit, see get_response
+        self.timeout = kwargs.get('timeout', None)
+        # the answer functions of dynamic statements run on it when a response has a deadline
+        self._answer_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix='chatbot-answer')
+
         if kwargs.get('initialize', True):
             self.initialize()
 
     def initialize(self):
-        pass
+        for adapter in self.logic_adapters:
+            adapter.initialize()
+
+    def warmup(self, jieba_cache_dir=None):
+        """
+        Load jieba and the analysis resources now instead of during the first request.
 
-    def get_response(self, input_statement=None, **kwargs):
+        :param str jieba_cache_dir: where jieba keeps the cache of its prebuilt dictionary,
+            defaults to the CHATBOT_JIEBA_CACHE_DIR environment variable
+        """
+        warmup_analysis(jieba_cache_dir)
+
+    def close(self):
+        """
+        Write the buffered data to the storage, call it before the chatbot is discarded.
+        """
+        self.access_log_recorder.close()
+        self.storage.close()
+        if self._owns_adapter_executor:
+            self.adapter_executor.shutdown(wait=False)
+        self._answer_executor.shutdown(wait=False)
+
+    def get_response(self, input_statement=None, timeout=None, **kwargs):
         """
         Return the bot's response based on the input.
 
         :param str input_statement: string
+        :param float timeout: the number of seconds the response may take, defaults to the timeout of the chatbot.
+            The adapters and the answer function share it, when the time runs out the best answers found so far
+            are returned and the "truncated" item of the response is True.
         :returns str: a response to the input
         """
+        deadline = self._get_deadline(timeout)
+        input_statement, response, cache_key = self._start_response(input_statement, deadline=deadline, **kwargs)
+        cached_response = self._get_cached_response(input_statement, cache_key, deadline)
+        if cached_response is not None:
+            response, statement_id = cached_response
+            # record access log
+            if statement_id != -1:
+                self.access_log_recorder.record(statement_id)
+            return response
+
+        # the statement is segmented once and shared by all adapters
+        kwargs['analyzed_statement'] = AnalyzedStatement(input_statement)
+        kwargs['deadline'] = deadline
+        return self._respond(input_statement, response, cache_key, **kwargs)
+
+    def get_responses(self, inputs, contexts=None, chunk_size=1000):
+        """
+        Yield the responses of many inputs in order, eg: to replay the chat logs.
+
+        The inputs are processed chunk by chunk, each adapter loads the candidates
+        of all inputs of a chunk at once instead of querying the storage for every input.
+
+        :param inputs: list or iterator of input statement
+        :param contexts: list or iterator of the context of each input, None for no context
+        :param int chunk_size: the number of inputs processed together
+        :returns: iterator of response
+        """
+        all_input = iter(inputs)
+        all_context = iter(contexts) if contexts is not None else itertools.repeat(None)
+        while True:
+            chunk = list(itertools.islice(zip(all_input, all_context), chunk_size))
+            if not chunk:
+                return
+
+            all_response = []
+            all_pending = []
+            for input_statement, context in chunk:
+                kwargs = {} if context is None else {'context': context}
+                input_statement, response, cache_key = self._start_response(input_statement, **kwargs)
+                cached_response = self._get_cached_response(input_statement, cache_key)
+                if cached_response is not None:
+                    response, statement_id = cached_response
+                    # record access log
+                    if statement_id != -1:
+                        self.access_log_recorder.record(statement_id)
+                    all_response.append(response)
+                    continue
+
+                kwargs['analyzed_statement'] = AnalyzedStatement(input_statement)
+                all_pending.append((len(all_response), input_statement, response, cache_key, kwargs))
+                all_response.append(None)
+
+            all_prefetched = [
+                adapter.prefetch([(input_statement, kwargs) for _, input_statement, _, _, kwargs in all_pending])
+                for adapter in self.logic_adapters
+            ] if all_pending else []
+            for index, input_statement, response, cache_key, kwargs in all_pending:
+                all_response[index] = self._respond(
+                    input_statement, response, cache_key, all_prefetched=all_prefetched, **kwargs
+                )
+
+            for response in all_response:
+                yield response
+
+    def _respond(self, input_statement, response, cache_key, all_prefetched=None, **kwargs):
+        """
+        Match the statement with the adapters and return the response.
+
+        :param list all_prefetched: what the prefetch method of each adapter returned for the batch
+        """
+        if self.adapter_executor is None:
+            all_adapter_answers, answer = self._match(input_statement, all_prefetched, **kwargs)
+        else:
+            all_adapter_answers, answer = self._match_concurrently(input_statement, all_prefetched, **kwargs)
+        return self._respond_with_match(
+            input_statement, response, cache_key, all_adapter_answers, answer, kwargs.get('deadline')
+        )
+
+    def _respond_with_match(self, input_statement, response, cache_key, all_adapter_answers, answer, deadline=None):
+        if answer is not None:
+            return self._respond_with_answer(
+                input_statement, answer, response, cache_key, all_adapter_answers, deadline
+            )
+        return self._respond_with_suggestions(input_statement, all_adapter_answers, response, cache_key, deadline)
+
+    def _match(self, input_statement, all_prefetched=None, **kwargs):
+        """
+        Match the statement with each adapter in turn, stop at the first confident answer.
+
+        :returns: the answers of all adapters and the confident answer, None if there is no confident answer
+        """
+        all_answers = [[] for _ in self.logic_adapters]
+        for adapter_index, adapter_kwargs in self._adapters_to_match(all_prefetched, **kwargs):
+            answers = self._process_with_adapter(self.logic_adapters[adapter_index], input_statement, **adapter_kwargs)
+            answer = self._add_answers(all_answers, adapter_index, answers)
+            if answer is not None:
+                return self._merge_answers(all_answers), answer
+        return self._merge_answers(all_answers), None
+
+    async def _amatch(self, input_statement, **kwargs):
+        """
+        The asyncio version of _match, the adapters run with their acan_process and aprocess methods.
+        """
+        all_answers = [[] for _ in self.logic_adapters]
+        for adapter_index, adapter_kwargs in self._adapters_to_match(**kwargs):
+            answers = await self._aprocess_with_adapter(
+                self.logic_adapters[adapter_index], input_statement, **adapter_kwargs
+            )
+            answer = self._add_answers(all_answers, adapter_index, answers)
+            if answer is not None:
+                return self._merge_answers(all_answers), answer
+        return self._merge_answers(all_answers), None
+
+    def _adapters_to_match(self, all_prefetched=None, **kwargs):
+        """
+        Yield the index and the keyword arguments of each adapter to run one after another,
+        stop when the time is up.
+        """
+        for adapter_index, adapter in enumerate(self.logic_adapters):
+            if self._is_expired(kwargs.get('deadline'), adapter):
+                return
+            if all_prefetched is not None:
+                kwargs['prefetched'] = all_prefetched[adapter_index]
+            yield adapter_index, kwargs
+
+    def _match_concurrently(self, input_statement, all_prefetched=None, **kwargs):
+        """
+        Match the statement with all adapters at the same time on the adapter executor,
+        stop waiting as soon as an adapter returns a confident answer. If several adapters that finished together
+        are confident, the first one in the order of the adapters wins. The adapters that have not started are
+        cancelled, the running ones finish in the background and their answers are ignored.
+
+        :returns: the answers of all adapters and the confident answer, None if there is no confident answer
+        """
+        all_future = self._submit_adapters(input_statement, all_prefetched, **kwargs)
+        # the answers are merged in the order of the adapters, as if they ran one after another
+        all_answers = [[] for _ in self.logic_adapters]
+        not_done = set(all_future)
+        deadline = kwargs.get('deadline')
+        try:
+            while not_done:
+                done, not_done = concurrent.futures.wait(
+                    not_done,
+                    timeout=deadline.remaining() if deadline is not None else None,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                if not done:
+                    self._stop_waiting(deadline, not_done)
+                    break
+                answer = self._add_done_answers(all_answers, all_future, done)
+                if answer is not None:
+                    return self._merge_answers(all_answers), answer
+        finally:
+            for future in not_done:
+                future.cancel()
+        return self._merge_answers(all_answers), None
+
+    async def _amatch_concurrently(self, input_statement, **kwargs):
+        """
+        The asyncio version of _match_concurrently, the event loop waits for the adapters
+        that run on the adapter executor.
+        """
+        all_future = {
+            asyncio.wrap_future(future): adapter_index
+            for future, adapter_index in self._submit_adapters(input_statement, **kwargs).items()
+        }
+        all_answers = [[] for _ in self.logic_adapters]
+        not_done = set(all_future)
+        deadline = kwargs.get('deadline')
+        try:
+            while not_done:
+                done, not_done = await asyncio.wait(
+                    not_done,
+                    timeout=deadline.remaining() if deadline is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self._stop_waiting(deadline, not_done)
+                    break
+                answer = self._add_done_answers(all_answers, all_future, done)
+                if answer is not None:
+                    return self._merge_answers(all_answers), answer
+        finally:
+            for future in not_done:
+                future.cancel()
+        return self._merge_answers(all_answers), None
+
+    def _submit_adapters(self, input_statement, all_prefetched=None, **kwargs):
+        """
+        Submit each adapter to the adapter executor.
+
+        :returns: dict of future -> index of the adapter
+        """
+        all_future = {}
+        for adapter_index, adapter in enumerate(self.logic_adapters):
+            adapter_kwargs = dict(kwargs)
+            if all_prefetched is not None:
+                adapter_kwargs['prefetched'] = all_prefetched[adapter_index]
+            future = self.adapter_executor.submit(
+                self._process_with_adapter, adapter, input_statement, **adapter_kwargs
+            )
+            all_future[future] = adapter_index
+        return all_future
+
+    def _stop_waiting(self, deadline, not_done):
+        deadline.truncated = True
+        self.logger.info('stop waiting for {} adapters, the time is up'.format(len(not_done)))
+
+    def _add_done_answers(self, all_answers, all_future, done):
+        """
+        Add the answers of the adapters that are done in the order of the adapters,
+        return the first confident answer, None if there is none.
+        """
+        for future in sorted(done, key=all_future.get):
+            answer = self._add_answers(all_answers, all_future[future], future.result())
+            if answer is not None:
+                return answer
+        return None
+
+    def _add_answers(self, all_answers, adapter_index, answers):
+        """
+        Keep the answers of the adapter, return its confident answer, None if there is none.
+
+        :param list answers: None if the adapter can not process the statement
+        """
+        if answers is None:
+            return None
+        all_answers[adapter_index] = answers
+        return self._select_answer(self.logic_adapters[adapter_index], answers)
+
+    @staticmethod
+    def _merge_answers(all_answers):
+        return [answer for answers in all_answers for answer in answers]
+
+    def _is_expired(self, deadline, adapter):
+        """
+        Whether the time is up before the adapter starts, the response is then truncated.
+        """
+        if deadline is None or not deadline.expired():
+            return False
+        deadline.truncated = True
+        self.logger.info('not processing the statement using "{}", the time is up'.format(get_object_path(adapter)))
+        return True
+
+    def _process_with_adapter(self, adapter, input_statement, **kwargs):
+        """
+        Return the answers of the adapter, None if the adapter can not process the statement.
+        """
+        if not adapter.can_process(input_statement, **kwargs):
+            self.logger.info(
+                'not processing the statement using "{}"'.format(get_object_path(adapter))
+            )
+            return None
+        self.logger.info('"{}" adapter starts matching'.format(get_object_path(adapter)))
+        return adapter.process(input_statement, **kwargs)
+
+    async def _aprocess_with_adapter(self, adapter, input_statement, **kwargs):
+        """
+        The asyncio version of _process_with_adapter, the blocking work runs on the executor of the chatbot.
+        """
+        if not await adapter.acan_process(input_statement, executor=self.executor, **kwargs):
+            self.logger.info(
+                'not processing the statement using "{}"'.format(get_object_path(adapter))
+            )
+            return None
+        self.logger.info('"{}" adapter starts matching'.format(get_object_path(adapter)))
+        return await adapter.aprocess(input_statement, executor=self.executor, **kwargs)
+
+    async def aget_response(self, input_statement=None, timeout=None, **kwargs):
+        """
+        The asyncio version of get_response, the segmentation and the comparison done by the adapters,
+        the access logs and the answer functions run on the executor of the chatbot,
+        so the event loop is never blocked. With an adapter executor, the adapters run on it concurrently
+        as they do in get_response.
+
+        :param str input_statement: string
+        :param float timeout: the number of seconds the response may take, see get_response
+        :returns str: a response to the input
+        """
+        loop = asyncio.get_running_loop()
+        deadline = self._get_deadline(timeout)
+        input_statement, response, cache_key = self._start_response(input_statement, deadline=deadline, **kwargs)
+        cached_response = self._get_cached_response(input_statement, cache_key, deadline)
+        if cached_response is not None:
+            response, statement_id = cached_response
+            # record access log
+            if statement_id != -1:
+                await loop.run_in_executor(self.executor, self.access_log_recorder.record, statement_id)
+            return response
+
+        # the statement is segmented once and shared by all adapters
+        kwargs['analyzed_statement'] = AnalyzedStatement(input_statement)
+        kwargs['deadline'] = deadline
+        if self.adapter_executor is None:
+            all_adapter_answers, answer = await self._amatch(input_statement, **kwargs)
+        else:
+            all_adapter_answers, answer = await self._amatch_concurrently(input_statement, **kwargs)
+        return await loop.run_in_executor(self.executor, functools.partial(
+            self._respond_with_match, input_statement, response, cache_key, all_adapter_answers, answer, deadline
+        ))
+
+    def _get_deadline(self, timeout=None):
+        """
+        Return the deadline of a response, None if it has no time limit.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            return None
+        return Deadline(timeout)
+
+    def _start_response(self, input_statement, deadline=None, **kwargs):
+        """
+        Preprocess the input statement, then return it with the empty response and its cache key.
+        """
         self.logger.info('the processing the statement "{}"'.format(input_statement))
         # Preprocess the input statement
         for preprocessor in self.preprocessors:
@@ -96,58 +493,115 @@ class ChatBot:
             'text': '',
             'context': kwargs.get('context', {'domain': False}),
         }
-        # matching statements for each adapter
-        all_adapter_answers = []
-        for adapter in self.logic_adapters:
-            if adapter.can_process(input_statement, **kwargs):
-                self.logger.info('"{}" adapter starts matching'.format(get_object_path(adapter)))
-                answers = adapter.process(input_statement, **kwargs)
-                all_adapter_answers.extend(answers)
-                self.logger.info('"{}" adapter select "{}" answers'.format(get_object_path(adapter), len(answers)))
-                for answer in answers:
-                    self.logger.info(
-                        '"{}" adapter select the answer to the "{}" question as a reply, the confidence is {}'.format(
-                            get_object_path(adapter), answer.reference_question, answer.confidence
-                        )
-                    )
-                    # stop matching
-                    if answer.confidence >= self.maximum_similarity_threshold:
-                        self.logger.info(
-                            'the similarity is {} higher than the {} parameter, stop matching.'.format(
-                                answer.confidence, 'maximum_similarity_threshold'
-                            )
-                        )
-                        try:
-                            response['text'] = answer.get_answer()
-                            response['context'] = {'domain': False}
-                            # record access log
-                            if answer.id != -1:
-                                self.storage.create(model_name=access_log_table_name, statement_id=answer.id)
-                        except NotEnoughParameterError as e:
-                            if response['context'].get('need_extract_parameter') == e.parameter:
-                                error_count = response['context'].get('need_extract_parameter_count', 0) + 1
-                            else:
-                                error_count = 0
-
-                            if error_count >= CONTEXT_PARAMETER_MAX_ERROR_COUNT:
-                                response['text'] = '错误次数过多,该问题已被终止!'
-                                response['context']['domain'] = False
-                            else:
-                                response['text'] = e.message
-                                response['context'] = answer.serialize()
-                                response['context']['need_extract_parameter'] = e.parameter
-                                response['context']['need_extract_parameter_count'] = error_count
-                                response['context']['domain'] = True
-                        self.logger.info(
-                            'finally the response of the "{}" statement is "{}"'.format(input_statement, response)
-                        )
-                        return response
-            else:
+        if deadline is not None:
+            response['truncated'] = False
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self._get_cache_key(input_statement, response['context'])
+        return input_statement, response, cache_key
+
+    def _get_cached_response(self, input_statement, cache_key, deadline=None):
+        """
+        Return a copy of the cached response and the id of its statement, None if it is not cached.
+        Truncated responses are never cached.
+        """
+        if cache_key is None:
+            return None
+        cached_response = self.response_cache.get(cache_key)
+        if cached_response is None:
+            return None
+
+        response, statement_id = cached_response
+        self.logger.info('finally the response of the "{}" statement is "{}", from the cache'.format(
+            input_statement, response
+        ))
+        response = copy.deepcopy(response)
+        if deadline is not None:
+            response['truncated'] = False
+        return response, statement_id
+
+    def _select_answer(self, adapter, answers):
+        """
+        Return the first answer whose confidence reaches the maximum similarity threshold,
+        matching stops at this answer, None if there is no such answer.
+        """
+        self.logger.info('"{}" adapter select "{}" answers'.format(get_object_path(adapter), len(answers)))
+        for answer in answers:
+            self.logger.info(
+                '"{}" adapter select the answer to the "{}" question as a reply, the confidence is {}'.format(
+                    get_object_path(adapter), answer.reference_question, answer.confidence
+                )
+            )
+            # stop matching
+            if answer.confidence >= self.maximum_similarity_threshold:
                 self.logger.info(
-                    'not processing the statement using "{}"'.format(get_object_path(adapter))
+                    'the similarity is {} higher than the {} parameter, stop matching.'.format(
+                        answer.confidence, 'maximum_similarity_threshold'
+                    )
                 )
+                return answer
+        return None
+
+    def _respond_with_answer(self, input_statement, answer, response, cache_key, all_adapter_answers=None,
+                             deadline=None):
+        """
+        Return the response of the answer, or ask for the parameter that the answer function is missing.
+        When the answer function does not finish before the deadline, the questions of the best answers
+        are suggested instead.
+        """
+        try:
+            response['text'] = self._get_answer(answer, deadline)
+            response['context'] = {'domain': False}
+            # record access log
+            if answer.id != -1:
+                self.access_log_recorder.record(answer.id)
+        except NotEnoughParameterError as e:
+            if response['context'].get('need_extract_parameter') == e.parameter:
+                error_count = response['context'].get('need_extract_parameter_count', 0) + 1
+            else:
+                error_count = 0
+
+            if error_count >= CONTEXT_PARAMETER_MAX_ERROR_COUNT:
+                response['text'] = '错误次数过多,该问题已被终止!'
+                response['context']['domain'] = False
+            else:
+                response['text'] = e.message
+                response['context'] = answer.serialize()
+                response['context']['need_extract_parameter'] = e.parameter
+                response['context']['need_extract_parameter_count'] = error_count
+                response['context']['domain'] = True
+        except concurrent.futures.TimeoutError:
+            deadline.truncated = True
+            self.logger.info('the answer function "{}" did not finish in time'.format(answer.answer))
+            return self._respond_with_suggestions(
+                input_statement, all_adapter_answers or [answer], response, cache_key, deadline
+            )
+        if deadline is not None:
+            response['truncated'] = deadline.truncated
+        self.logger.info(
+            'finally the response of the "{}" statement is "{}"'.format(input_statement, response)
+        )
+        if cache_key is not None and (answer.type != 1 or self.cache_dynamic_answers) and \
+                not response.get('truncated'):
+            self.response_cache.set(cache_key, (copy.deepcopy(response), answer.id))
+        return response
 
-        all_adapter_answers.sort(key=lambda s: s.confidence, reverse=True)
+    def _get_answer(self, answer, deadline=None):
+        """
+        Return the answer, the answer function of a dynamic statement only gets the time that is left.
+
+        :raises concurrent.futures.TimeoutError: the answer function did not finish in time
+        """
+        if deadline is None or answer.type != 1:
+            return answer.get_answer()
+        return self._answer_executor.submit(answer.get_answer).result(timeout=deadline.remaining())
+
+    def _respond_with_suggestions(self, input_statement, all_adapter_answers, response, cache_key, deadline=None):
+        """
+        Return the response that suggests the questions of the best answers, when no answer is confident enough.
+        """
+        all_adapter_answers = sorted(all_adapter_answers, key=lambda s: s.confidence, reverse=True)
         all_adapter_answers = all_adapter_answers[:self.number_of_answers]
         if all_adapter_answers:
             response['text'] = '看看这些内容对您有帮助么？\n{}\n都不是？请用一句话完整描述您的问题'.format(
@@ -156,55 +610,234 @@ class ChatBot:
             )
         else:
             response['text'] = '很抱歉，没有理解您的意思，请用简短的话描述您的问题，比如"获取主机的磁盘空间使用率？"'
+        if deadline is not None:
+            response['truncated'] = deadline.truncated
 
         self.logger.info('finally the response of the "{}" statement is "{}"'.format(
             input_statement, response
         ))
 
+        if cache_key is not None and not response.get('truncated'):
+            self.response_cache.set(cache_key, (copy.deepcopy(response), -1))
         return response
 
+    @staticmethod
+    def _get_cache_key(input_statement, context):
+        try:
+            return input_statement, json.dumps(context, sort_keys=True, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _invalidate_answer_function(record):
+        """
+        The answer function of a dynamic statement that was learned or forgotten is resolved again on next use.
+        """
+        if record.type == 1:
+            answer_functions.invalidate(record.answer)
+
+    def clear_response_cache(self):
+        """
+        Drop all cached responses, called when the knowledge base changes.
+        """
+        if self.response_cache is not None:
+            self.response_cache.clear()
+
     def learn(self, question, answer, category='其他', type_=0, parameters=None, extractor=None):
         """
         Learn that the statement provided is a valid response.
         """
-        features = get_features(question)
+        analyzed_statement = AnalyzedStatement(question)
+        features = analyzed_statement.features
         if not features:
             self.logger.warning('because statement "{}" has no features, so skip learning'.format(question))
             return
 
-        # add data to statement table
+        # add data to statement table, statement_feature table, tag table and tag_association_statement table
+        # in one transaction
         try:
-            statement_id = self.storage.create(
-                model_name=statement_table_name,
-                question=question,
-                answer=answer,
-                category=category,
-                type=type_,
-                parameters=parameters,
-                extractor=extractor
-            )
+            with self.storage.unit_of_work():
+                statement_id = self.storage.create(
+                    model_name=statement_table_name,
+                    question=question,
+                    answer=answer,
+                    category=category,
+                    type=type_,
+                    parameters=parameters,
+                    extractor=extractor
+                )
+                self.storage.create(
+                    model_name=statement_feature_table_name,
+                    statement_id=statement_id,
+                    **analyzed_statement.match_features
+                )
+
+                for feature in features:
+                    tag = list(self.storage.filter(model_name=tag_table_name, name=feature))
+                    if len(tag) == 0:
+                        tag_id = self.storage.create(
+                            model_name=tag_table_name,
+                            name=feature
+                        )
+                    else:
+                        tag_id = tag[0].id
+
+                    self.storage.create(
+                        model_name=tag_association_statement_table_name,
+                        tag_id=tag_id,
+                        statement_id=statement_id
+                    )
         except Exception as e:
             self.logger.warning('Inserting data into the database failed, {}'.format(e))
             return
 
-        # add data to tag table and tag_association_statement table
-        for feature in features:
-            tag = list(self.storage.filter(model_name=tag_table_name, name=feature))
-            if len(tag) == 0:
-                tag_id = self.storage.create(
-                    model_name=tag_table_name,
-                    name=feature
-                )
-            else:
-                tag_id = tag[0].id
-
-            self.storage.create(
-                model_name=tag_association_statement_table_name,
-                tag_id=tag_id,
-                statement_id=statement_id
-            )
+        record = StatementRecord(
+            id=statement_id,
+            question=question,
+            answer=answer,
+            category=category,
+            type=type_,
+            parameters=parameters,
+            extractor=extractor
+        )
+        self._invalidate_answer_function(record)
+        for adapter in self.logic_adapters:
+            adapter.learned(record, features)
+        self.clear_response_cache()
 
         self.logger.info('add "{}" as the answer to "{}"'.format(
             answer,
             question
         ))
+
+    def learn_many(self, statements, chunk_size=1000, callback=None):
+        """
+        Learn a large number of statements, the statements are written to the storage
+        in one transaction per chunk, so only one chunk is held in memory at a time.
+
+        :param statements: an iterable of dict whose keys are the arguments of the ``learn`` method,
+                           or the path of a jsonl or csv corpus file
+        :param int chunk_size: the number of statements written per transaction
+        :param callback: called after each chunk with the number of learned statements,
+                         the number of skipped statements and the elapsed seconds
+        :return int: the number of learned statements
+        """
+        if isinstance(statements, str):
+            statements = read_corpus(statements)
+
+        start_time = time.time()
+        learned_count = 0
+        skipped_count = 0
+        statements = iter(statements)
+        while True:
+            chunk = list(itertools.islice(statements, chunk_size))
+            if not chunk:
+                break
+
+            all_statement_data = []
+            all_match_features = {}
+            for data in chunk:
+                question = data['question']
+                analyzed_statement = AnalyzedStatement(question)
+                features = analyzed_statement.features
+                if not features:
+                    self.logger.warning('because statement "{}" has no features, so skip learning'.format(question))
+                    skipped_count += 1
+                    continue
+
+                all_statement_data.append((
+                    {
+                        'question': question,
+                        'answer': data['answer'],
+                        'category': data.get('category') or '其他',
+                        'type': int(data.get('type_', data.get('type')) or 0),
+                        'parameters': data.get('parameters'),
+                        'extractor': data.get('extractor'),
+                    },
+                    features
+                ))
+                if question not in all_match_features:
+                    all_match_features[question] = analyzed_statement.match_features
+
+            try:
+                with self.storage.unit_of_work():
+                    all_new_statement = self.storage.create_statements(all_statement_data)
+                    self.storage.create_many(statement_feature_table_name, [
+                        dict(statement_id=statement_id, **all_match_features[statement_data['question']])
+                        for statement_id, statement_data, _ in all_new_statement
+                    ])
+            except Exception as e:
+                self.logger.warning('Inserting data into the database failed, {}'.format(e))
+                skipped_count += len(all_statement_data)
+                continue
+
+            for statement_id, statement_data, features in all_new_statement:
+                record = StatementRecord(id=statement_id, **statement_data)
+                self._invalidate_answer_function(record)
+                for adapter in self.logic_adapters:
+                    adapter.learned(record, features)
+
+            if all_new_statement:
+                self.clear_response_cache()
+
+            learned_count += len(all_new_statement)
+            skipped_count += len(all_statement_data) - len(all_new_statement)
+            elapsed_time = time.time() - start_time
+            self.logger.info('learned {} statements, skipped {} statements, {:.1f} statements per second'.format(
+                learned_count, skipped_count, learned_count / elapsed_time if elapsed_time else 0
+            ))
+            if callback:
+                callback(learned_count, skipped_count, elapsed_time)
+
+        return learned_count
+
+    def forget(self, question):
+        """
+        Remove the statement with the question from the storage.
+
+        :return bool: whether a statement was removed
+        """
+        statements = list(self.storage.filter(statement_table_name, question=question))
+        if not statements:
+            self.logger.warning('statement "{}" does not exist, so skip forgetting'.format(question))
+            return False
+
+        record = StatementRecord.from_object(statements[0])
+        with self.storage.unit_of_work():
+            self.storage.delete(tag_association_statement_table_name, statement_id=record.id)
+            self.storage.delete(access_log_table_name, statement_id=record.id)
+            self.storage.delete(statement_feature_table_name, statement_id=record.id)
+            self.storage.delete(statement_table_name, id=record.id)
+
+        self._invalidate_answer_function(record)
+        for adapter in self.logic_adapters:
+            adapter.forgot(record)
+        self.clear_response_cache()
+
+        self.logger.info('forget the statement "{}"'.format(question))
+        return True
+
+    def rebuild_statement_features(self, chunk_size=1000):
+        """
+        Compute the statement_feature rows of all statements again, used for a database
+        that was learned before the table existed or after the analysis changed.
+
+        :param int chunk_size: the number of rows written at a time
+        :return int: the number of statements
+        """
+        count = 0
+        with self.storage.unit_of_work():
+            self.storage.execute('DELETE FROM {}'.format(statement_feature_table_name))
+            statements = iter(self.storage.all(statement_table_name))
+            while True:
+                chunk = list(itertools.islice(statements, chunk_size))
+                if not chunk:
+                    break
+                self.storage.create_many(statement_feature_table_name, [
+                    dict(statement_id=statement.id, **AnalyzedStatement(statement.question).match_features)
+                    for statement in chunk
+                ])
+                count += len(chunk)
+
+        self.logger.info('rebuilt the features of {} statements'.format(count))
+        return count
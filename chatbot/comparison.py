@@ -1,8 +1,17 @@
+import heapq
+import math
+import threading
+from collections import Counter
 from .tokenizer import jieba_segment as segment
+from .models import statement_table_name
+from .utils import initialize_class
 from difflib import SequenceMatcher
 
 
 class Comparator:
+    # whether most_similar makes use of the stored features of the other statements
+    uses_features = False
+
     def __call__(self, statement_a, statement_b):
         return self.compare(statement_a, statement_b)
 
@@ -10,9 +19,119 @@ class Comparator:
     def _cut_statement(statement):
         return segment.cut(statement, seg_only=True)
 
+    def initialize(self, storage):
+        """
+        Called once at startup, comparators that keep a prebuilt model
+        of the stored questions build it here.
+        """
+        pass
+
+    def learned(self, question):
+        """
+        Called after a question has been added to the storage.
+        """
+        pass
+
+    def forgot(self, question):
+        """
+        Called after a question has been removed from the storage.
+        """
+        pass
+
     def compare(self, statement_a, statement_b):
         return 0
 
+    def compare_many(self, statement, other_statements):
+        """
+        Compare the statement with each of the other statements, comparators
+        that can score many statements at once override this method.
+
+        :param str statement: the input statement
+        :param list other_statements: list of str
+        :return list: the similarities in the same order as other_statements
+        """
+        return [self.compare(statement, other_statement) for other_statement in other_statements]
+
+    def most_similar(self, statement, other_statements, number, minimum_similarity=0, maximum_similarity=None,
+                     features=None):
+        """
+        Select the other statements that are the most similar to the statement.
+
+        :param str statement: the input statement
+        :param list other_statements: list of str
+        :param int number: the maximum number of statements to select
+        :param float minimum_similarity: statements below this similarity are not selected
+        :param float maximum_similarity: as soon as a statement reaches this similarity,
+                                         only that statement is selected
+        :param list features: the StatementFeatureRecord of each other statement, None for a statement
+                              without one, only passed to comparators whose uses_features is set
+        :return list: list of (index in other_statements, similarity) tuple, the most similar first,
+                      statements with the same similarity keep their order in other_statements
+        """
+        heap = []
+        for index, similarity in enumerate(self.compare_many(statement, other_statements)):
+            if similarity < minimum_similarity:
+                continue
+            if maximum_similarity is not None and similarity >= maximum_similarity:
+                return [(index, similarity)]
+            self._push_top(heap, number, index, similarity)
+
+        return self._sorted_top(heap)
+
+    @staticmethod
+    def _push_top(heap, number, index, similarity):
+        """
+        Keep the number most similar statements in a min heap of (similarity, -index),
+        so the root is the statement that is dropped first.
+        """
+        if len(heap) < number:
+            heapq.heappush(heap, (similarity, -index))
+        elif heap and similarity > heap[0][0]:
+            heapq.heapreplace(heap, (similarity, -index))
+
+    @staticmethod
+    def _can_change_top(heap, number, similarity, minimum_similarity, maximum_similarity):
+        """
+        Whether a statement with this similarity would be selected or would stop the selection.
+        """
+        if similarity < minimum_similarity:
+            return False
+        if maximum_similarity is not None and similarity >= maximum_similarity:
+            return True
+        if len(heap) < number:
+            return True
+        return bool(heap) and similarity > heap[0][0]
+
+    @staticmethod
+    def _sorted_top(heap):
+        return [(-negative_index, similarity) for similarity, negative_index in sorted(heap, reverse=True)]
+
+
+class FunctionComparator(Comparator):
+    """
+    A comparator that calls a plain function, eg: lambda statement_a, statement_b: 1.
+
+    :param function: returns the similarity of two statements
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def compare(self, statement_a, statement_b):
+        return self.function(statement_a, statement_b)
+
+
+def get_comparator(comparator):
+    """
+    Return the comparator, the import path of a comparator class or a dict of its import path
+    and keyword arguments creates it, a plain function is wrapped in a FunctionComparator.
+    """
+    if isinstance(comparator, str) or isinstance(comparator, dict):
+        comparator = initialize_class(comparator)
+    if isinstance(comparator, Comparator):
+        return comparator
+    return FunctionComparator(comparator)
+
 
 class LevenshteinDistance(Comparator):
     """
@@ -42,5 +161,284 @@ class LevenshteinDistance(Comparator):
 
         return percent
 
+    def most_similar(self, statement, other_statements, number, minimum_similarity=0, maximum_similarity=None,
+                     features=None):
+        """
+        The similarities are the same as those of ``compare``, but the full ratio is only
+        computed for statements whose cheap upper bounds (``real_quick_ratio`` from the lengths,
+        then ``quick_ratio`` from the characters) can still reach the selection.
+        The length bound is checked before the matcher indexes the other statement.
+        The stored features are not used, the lengths are as cheap to get from the statements.
+        """
+        heap = []
+        matcher = SequenceMatcher(None, statement)
+        for index, other_statement in enumerate(other_statements):
+            if not statement or not other_statement:
+                similarity = 0
+            else:
+                # rounding keeps the order, so a rounded upper bound that cannot
+                # change the selection means the rounded ratio cannot either
+                if not self._can_change_top(heap, number, self._length_ratio(len(statement), len(other_statement)),
+                                            minimum_similarity, maximum_similarity):
+                    continue
+                matcher.set_seq2(other_statement)
+                if not self._can_change_top(heap, number, round(matcher.quick_ratio(), 2),
+                                            minimum_similarity, maximum_similarity):
+                    continue
+                similarity = round(matcher.ratio(), 2)
+
+            if similarity < minimum_similarity:
+                continue
+            if maximum_similarity is not None and similarity >= maximum_similarity:
+                return [(index, similarity)]
+            self._push_top(heap, number, index, similarity)
+
+        return self._sorted_top(heap)
+
+    @staticmethod
+    def _length_ratio(length, other_length):
+        """
+        The rounded ``real_quick_ratio`` of two statements of these lengths.
+        """
+        return round(2.0 * min(length, other_length) / (length + other_length), 2)
+
+
+class TfidfSimilarity(Comparator):
+    """
+    Compare two statements based on the cosine similarity of the TF-IDF
+    vectors of their character n-grams.
+
+    The vectors of all stored questions are kept as a sparse matrix in posting lists
+    (n-gram -> {row: term frequency}), so one statement is scored against all stored
+    questions with a single sparse matrix-vector product, whose cost depends on the number
+    of shared n-grams rather than on the number of questions.
+
+    The idf is fitted on the stored questions and kept until refit_ratio of the rows have been
+    added or removed, so the norm of a row is computed once when it is added. The refit recomputes
+    the idf and all norms, its cost is spread over the refit_ratio * rows writes before it.
+
+    :param tuple ngram_range: the lower and upper boundary of the n-gram length
+    :param float refit_ratio: the share of the rows that is added or removed before the idf is fitted again
+    """
+
+    def __init__(self, ngram_range=(1, 2), refit_ratio=0.1):
+        self.ngram_range = ngram_range
+        self.refit_ratio = refit_ratio
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        # question -> row
+        self.rows = {}
+        # row -> question
+        self.questions = {}
+        # row -> Counter of n-gram
+        self.row_ngrams = {}
+        # n-gram -> {row: term frequency}
+        self.postings = {}
+        self._next_row = 0
+        # row -> norm of its weights under the fitted idf
+        self.norms = {}
+        # the number of rows and the document frequency of each n-gram when the idf was fitted
+        self._fitted_row_count = 0
+        self._fitted_document_frequencies = {}
+        # the number of rows added or removed since the idf was fitted
+        self._changes = 0
+        # (statement, weights, norm) of the last scored statement, a statement scored in batches is analysed once
+        self._last_statement_vector = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_ngrams(self, statement):
+        statement = statement.lower()
+        ngrams = Counter()
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            for index in range(len(statement) - n + 1):
+                ngrams[statement[index:index + n]] += 1
+        return ngrams
+
+    def idf(self, ngram):
+        """
+        Smoothed inverse document frequency of the n-gram, as it was when the idf was fitted.
+        """
+        return math.log(
+            (1 + self._fitted_row_count) / (1 + self._fitted_document_frequencies.get(ngram, 0))
+        ) + 1
+
+    def _weights(self, ngrams):
+        return {ngram: frequency * self.idf(ngram) for ngram, frequency in ngrams.items()}
+
+    def _norm(self, ngrams):
+        return math.sqrt(sum(weight * weight for weight in self._weights(ngrams).values()))
+
+    def refit(self):
+        """
+        Fit the idf on the stored questions again and recompute the norms of all rows.
+        """
+        with self._lock:
+            self._fitted_row_count = len(self.rows)
+            self._fitted_document_frequencies = {ngram: len(rows) for ngram, rows in self.postings.items()}
+            self.norms = {row: self._norm(ngrams) for row, ngrams in self.row_ngrams.items()}
+            self._changes = 0
+            self._last_statement_vector = None
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes > self.refit_ratio * len(self.rows):
+            self.refit()
+
+    def initialize(self, storage):
+        self.fit(statement.question for statement in storage.all(statement_table_name))
+
+    def learned(self, question):
+        self.add(question)
+
+    def forgot(self, question):
+        self.remove(question)
+
+    def fit(self, questions):
+        """
+        Rebuild the matrix from the questions.
+        """
+        with self._lock:
+            self._clear()
+            for question in questions:
+                self._add_row(question)
+            self.refit()
+
+    def _add_row(self, question):
+        if not question or question in self.rows:
+            return False
+        row = self._next_row
+        self._next_row += 1
+        ngrams = self.get_ngrams(question)
+        self.rows[question] = row
+        self.questions[row] = question
+        self.row_ngrams[row] = ngrams
+        for ngram, frequency in ngrams.items():
+            self.postings.setdefault(ngram, {})[row] = frequency
+        self.norms[row] = self._norm(ngrams)
+        return True
+
+    def add(self, question):
+        """
+        Add a row for the question, questions that are already known are ignored.
+        """
+        with self._lock:
+            if self._add_row(question):
+                self._changed()
+
+    def remove(self, question):
+        """
+        Remove the row of the question, unknown questions are ignored.
+        """
+        with self._lock:
+            row = self.rows.pop(question, None)
+            if row is None:
+                return
+            del self.questions[row]
+            del self.norms[row]
+            for ngram in self.row_ngrams.pop(row):
+                rows = self.postings[ngram]
+                del rows[row]
+                if not rows:
+                    del self.postings[ngram]
+            self._changed()
+
+    def similarities(self, statement, questions=None):
+        """
+        Score the statement against the stored questions at once.
+
+        :param questions: only score these questions, None for all stored questions,
+            the questions that are not stored are ignored
+        :return dict: question -> similarity, questions without any shared n-gram are omitted
+        """
+        if not statement:
+            return {}
+
+        with self._lock:
+            rows = None
+            if questions is not None:
+                rows = {self.rows[question] for question in questions if question in self.rows}
+            statement_weights, statement_norm = self._statement_vector(statement)
+            scores = self._scores(statement_weights, rows)
+
+            return {
+                self.questions[row]: round(score / (statement_norm * self.norms[row]), 2)
+                for row, score in scores.items() if self.norms[row]
+            }
+
+    def _statement_vector(self, statement):
+        """
+        Return the weights of the statement and their norm.
+        """
+        if self._last_statement_vector is None or self._last_statement_vector[0] != statement:
+            weights = self._weights(self.get_ngrams(statement))
+            norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+            self._last_statement_vector = (statement, weights, norm)
+        return self._last_statement_vector[1:]
+
+    def _scores(self, statement_weights, rows=None):
+        """
+        Return the dot product of the weights with each row that shares an n-gram with them.
+
+        :param set rows: only score these rows, None for all rows. For each n-gram the smaller of its posting list
+            and the rows is walked, so scoring a few candidates does not depend on the size of the corpus.
+        """
+        scores = {}
+        for ngram, weight in statement_weights.items():
+            postings = self.postings.get(ngram)
+            if not postings:
+                continue
+            weight *= self.idf(ngram)
+            if rows is None or len(postings) <= len(rows):
+                all_frequency = postings.items() if rows is None else (
+                    (row, frequency) for row, frequency in postings.items() if row in rows
+                )
+            else:
+                all_frequency = ((row, postings[row]) for row in rows if row in postings)
+            for row, frequency in all_frequency:
+                scores[row] = scores.get(row, 0) + weight * frequency
+        return scores
+
+    def compare_many(self, statement, other_statements):
+        """
+        Stored questions are scored together by a single ``similarities`` call restricted to them,
+        the others are compared one by one.
+        """
+        if not statement:
+            return [0] * len(other_statements)
+
+        similarities = self.similarities(statement, other_statements)
+        return [
+            similarities.get(other_statement, 0) if other_statement in self.rows
+            else self.compare(statement, other_statement)
+            for other_statement in other_statements
+        ]
+
+    def compare(self, statement, other_statement):
+        """
+        Compare the two input statements.
+
+        :return float: The cosine similarity between the TF-IDF vectors of the statements.
+        """
+
+        # Return 0 if either statement has a falsy text value
+        if not statement or not other_statement:
+            return 0
+
+        with self._lock:
+            weights = self._weights(self.get_ngrams(statement))
+            other_weights = self._weights(self.get_ngrams(other_statement))
+
+        dot = sum(weight * other_weights.get(ngram, 0) for ngram, weight in weights.items())
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        other_norm = math.sqrt(sum(weight * weight for weight in other_weights.values()))
+        if not norm or not other_norm:
+            return 0
+
+        return round(dot / (norm * other_norm), 2)
+
 
 levenshtein_distance = LevenshteinDistance()
@@ -1,4 +1,5 @@
-from .utils import import_module, get_function_arguments, logger, get_function_parameter_desc, get_object_path
+from .utils import logger
+from .registry import answer_functions
 from .exceptions import NotEnoughParameterError
 
 
@@ -64,8 +65,9 @@ class Statement(StatementMixin):
         # get parameter
         parameters = kwargs.get('parameters', {})
         if self.type == 1:
-            self.answer_fun = import_module(self.answer)
-            self.parameters = get_function_arguments(self.answer_fun)
+            self.answer_function = kwargs.get('answer_functions', answer_functions).get(self.answer)
+            self.answer_fun = self.answer_function.function
+            self.parameters = self.answer_function.new_arguments()
             if isinstance(parameters, str):
                 for parameter in parameters.split(';'):
                     if parameter.strip():
@@ -102,11 +104,11 @@ class Statement(StatementMixin):
         elif self.type == 1:
             for parameter, value in self.parameters.items():
                 if value is None:
-                    parameter_desc = get_function_parameter_desc(self.answer_fun).get(parameter, parameter)
+                    parameter_desc = self.answer_function.parameter_descriptions.get(parameter, parameter)
                     raise NotEnoughParameterError(parameter, parameter_desc)
             try:
                 self.logger.info('Call the function "{}" to get the answer, all the parameters of the '
-                                 'function are "{}"'.format(get_object_path(self.answer_fun), self.parameters))
+                                 'function are "{}"'.format(self.answer_function.object_path, self.parameters))
                 text = self.answer_fun(**self.parameters)
             except Exception as e:
                 text = str(e)
@@ -0,0 +1,28 @@
+import time
+
+
+class Deadline:
+    """
+    The time budget of one request, shared by the chatbot and its adapters.
+    The work that is stopped because the time ran out marks the deadline as truncated,
+    so the response can tell that it holds the best answers found so far.
+
+    :param float timeout: the number of seconds from now
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        self.truncated = False
+
+    def __repr__(self):
+        return '<Deadline remaining:%.3f truncated:%s>' % (self.remaining(), self.truncated)
+
+    def remaining(self):
+        """
+        Return the number of seconds left, 0 when the deadline has passed.
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
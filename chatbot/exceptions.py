@@ -58,6 +58,20 @@ class NotFoundExtractorMethod(ChatbotError):
         super().__init__(self.message)
 
 
+class CorpusFormatError(ChatbotError):
+    """
+    An exception to be raised when the format of a corpus file is not supported
+    """
+
+    def __init__(self, file_path):
+        """
+        Set the message for the exception.
+        """
+        self.message = 'the format of the corpus file "{}" is not supported, ' \
+                       'the supported formats are jsonl and csv'.format(file_path)
+        super().__init__(self.message)
+
+
 class StorageError(ChatbotError):
     """"""
 
@@ -104,3 +118,43 @@ class ExecuteSqlError(StorageError):
         """
         self.message = message
         super().__init__(message)
+
+
+class FullTextSearchNotSupportedError(StorageError):
+    def __init__(self, message='full text search needs a sqlite database with the fts5 extension'):
+        """
+        Set the message for the exception.
+        """
+        self.message = message
+        super().__init__(message)
+
+
+class DuplicateRowsError(StorageError):
+    """
+    An exception to be raised when a unique index cannot be created because the table has duplicate rows
+    """
+
+    def __init__(self, table_name, column_names, duplicate_count):
+        """
+        Set the message for the exception.
+        """
+        self.table_name = table_name
+        self.column_names = column_names
+        self.duplicate_count = duplicate_count
+        self.message = 'the "{}" table has {} duplicate rows of ({}), remove them or upgrade the database ' \
+                       'with delete_duplicates=True (the --delete-duplicates option of the upgrade-db command) ' \
+                       'to keep only the first row'.format(table_name, duplicate_count, ', '.join(column_names))
+        super().__init__(self.message)
+
+
+class SnapshotFormatError(ChatbotError):
+    """
+    An exception to be raised when a file is not a snapshot of a supported version
+    """
+
+    def __init__(self, message):
+        """
+        Set the message for the exception.
+        """
+        self.message = message
+        super().__init__(message)
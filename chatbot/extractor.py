@@ -1,7 +1,7 @@
 import re
 # import inspect
-import jieba
 from .tokenizer import jieba_segment as segment
+from .analysis import AnalyzedStatement
 from .exceptions import ExtractDataError
 from .utils import logger
 
@@ -9,6 +9,8 @@ from .utils import logger
 class Extractor:
     def __init__(self, text, **kwargs):
         self._text = text
+        # the segmentation of the text shared with the chatbot
+        self._analyzed_statement = kwargs.get('analyzed_statement')
         # logger
         self.logger = kwargs.get('logger', logger)
 
@@ -22,16 +24,21 @@ class Extractor:
     @text.setter
     def text(self, value):
         self._text = value
+        self._analyzed_statement = None
+
+    @property
+    def analyzed_statement(self):
+        if self._analyzed_statement is None or self._analyzed_statement.text != self.text:
+            self._analyzed_statement = AnalyzedStatement(self.text, segment.resources)
+        return self._analyzed_statement
 
     @staticmethod
     def _add_word_to_jieba(word_list):
-        for word in word_list:
-            jieba.add_word(word)
+        segment.resources.add_words(word_list)
 
     @staticmethod
     def _del_word_from_jieba(word_list):
-        for word in word_list:
-            jieba.del_word(word)
+        segment.resources.remove_words(word_list)
 
     def extract(self,
                 key,
@@ -56,7 +63,7 @@ class Extractor:
         self._add_word_to_jieba(key)
 
         # segment
-        segment_text = segment.cut(self.text, seg_only=False, remove_stop_word=True)
+        segment_text = self.analyzed_statement.get_words_and_tags(remove_stop_word=True)
         self.logger.debug('"{}" statement after the word segmentation is "{}"'.format(self.text, segment_text))
         key_index = -1
         for index, word_and_tag in enumerate(segment_text):
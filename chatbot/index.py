@@ -0,0 +1,417 @@
+import heapq
+import math
+import random
+import threading
+import zlib
+from collections import namedtuple
+from .utils import logger, normalize_question, get_character_ngrams
+from .models import statement_table_name, tag_table_name, tag_association_statement_table_name
+
+
+class StatementRecord(namedtuple('StatementRecord', [
+    'id',
+    'question',
+    'answer',
+    'category',
+    'type',
+    'parameters',
+    'extractor',
+])):
+    """
+    A compact, immutable copy of a row of the statement table.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_object(cls, object_):
+        """
+        Build a record from any object that has the statement columns as attributes,
+        eg: a model instance or a row returned by the database.
+        """
+        return cls(*[getattr(object_, field_name) for field_name in cls._fields])
+
+
+class StatementFeatureRecord(namedtuple('StatementFeatureRecord', [
+    'statement_id',
+    'normalized_question',
+    'length',
+    'ngrams',
+    'tokens',
+])):
+    """
+    An immutable copy of a row of the statement_feature table, the n-grams and tokens are tuples.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row):
+        return cls.from_values(row.statement_id, row.normalized_question, row.length, row.ngrams, row.tokens)
+
+    @classmethod
+    def from_values(cls, statement_id, normalized_question, length, ngrams, tokens):
+        """
+        :param str ngrams: the n-grams separated by spaces, as they are stored
+        :param str tokens: the tokens separated by spaces, as they are stored
+        """
+        return cls(
+            statement_id,
+            normalized_question,
+            length,
+            tuple(ngrams.split(' ')) if ngrams else (),
+            tuple(tokens.split(' ')) if tokens else ()
+        )
+
+
+class StatementIndex:
+    """
+    This is an abstract class that represents an in-process index over the statement table.
+
+    An index is built once from storage by calling ``build`` and is kept up to date
+    with ``add`` and ``remove``, so that reading it never has to hit the database.
+    """
+
+    def __init__(self, **kwargs):
+        # statement id -> StatementRecord
+        self.records = {}
+        self._lock = threading.RLock()
+
+        # logger
+        self.logger = kwargs.get('logger', logger)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, statement_id):
+        return statement_id in self.records
+
+    def get(self, statement_id):
+        return self.records.get(statement_id)
+
+    def clear(self):
+        with self._lock:
+            self.records = {}
+
+    def build(self, storage):
+        """
+        Populate the index with all statements in the storage.
+        """
+        with self._lock:
+            self.clear()
+            for statement in storage.all(statement_table_name):
+                self.records[statement.id] = StatementRecord.from_object(statement)
+        self.logger.info('"{}" loaded {} statements'.format(self.__class__.__name__, len(self)))
+
+    def add(self, record, features=()):
+        """
+        Add a statement to the index.
+
+        :param StatementRecord record: the statement that was learned
+        :param features: keywords of the statement question
+        """
+        with self._lock:
+            self.records[record.id] = record
+
+    def remove(self, statement_id):
+        """
+        Remove a statement from the index, unknown ids are ignored.
+        """
+        with self._lock:
+            self.records.pop(statement_id, None)
+
+
+class TagIndex(StatementIndex):
+    """
+    An inverted index that maps each tag name to the ids of the statements associated with it.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # tag name -> set of statement id
+        self.postings = {}
+        # statement id -> tuple of tag name
+        self.statement_tags = {}
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.postings = {}
+            self.statement_tags = {}
+
+    def build(self, storage):
+        with self._lock:
+            super().build(storage)
+            all_tag_name = {tag.id: tag.name for tag in storage.all(tag_table_name)}
+            all_statement_tag = {}
+            for association in storage.all(tag_association_statement_table_name):
+                tag_name = all_tag_name.get(association.tag_id)
+                if tag_name is None or association.statement_id not in self.records:
+                    continue
+                all_statement_tag.setdefault(association.statement_id, []).append(tag_name)
+
+            for statement_id, tag_names in all_statement_tag.items():
+                self._add_postings(statement_id, tag_names)
+        self.logger.info('"{}" loaded {} tags'.format(self.__class__.__name__, len(self.postings)))
+
+    def _add_postings(self, statement_id, tag_names):
+        tag_names = tuple(dict.fromkeys(tag_names))
+        for tag_name in tag_names:
+            self.postings.setdefault(tag_name, set()).add(statement_id)
+        self.statement_tags[statement_id] = tag_names
+
+    def add(self, record, features=()):
+        with self._lock:
+            if record.id in self.records:
+                self.remove(record.id)
+            super().add(record, features)
+            self._add_postings(record.id, features)
+
+    def remove(self, statement_id):
+        with self._lock:
+            super().remove(statement_id)
+            for tag_name in self.statement_tags.pop(statement_id, ()):
+                statement_ids = self.postings.get(tag_name)
+                if statement_ids is None:
+                    continue
+                statement_ids.discard(statement_id)
+                if not statement_ids:
+                    del self.postings[tag_name]
+
+    def search(self, features, limit=None):
+        """
+        Return the records of all statements associated with at least one of the features,
+        ordered by statement id.
+
+        :param features: keywords of the input statement
+        :param int limit: only return the limit statements associated with the most features,
+            ordered by the number of features and then by id, None for all statements
+        :return list: list of StatementRecord
+        """
+        with self._lock:
+            all_overlap = {}
+            for feature in dict.fromkeys(features):
+                for statement_id in self.postings.get(feature, ()):
+                    all_overlap[statement_id] = all_overlap.get(statement_id, 0) + 1
+            if limit is None:
+                all_statement_id = sorted(all_overlap)
+            else:
+                all_statement_id = sorted(all_overlap, key=lambda i: (-all_overlap[i], i))[:limit]
+            return [self.records[statement_id] for statement_id in all_statement_id]
+
+
+class BM25Index(TagIndex):
+    """
+    A tag index that ranks the statements by the BM25 score of their tags against the features,
+    so a rare tag weighs more than a frequent one and a statement with few tags more than one with many.
+    Only the best statements are returned, the comparator then re-ranks them.
+
+    Each tag appears once per statement, so the term frequency is always 1.
+
+    :param float k1: term frequency saturation
+    :param float b: how much the number of tags of a statement normalizes its score
+    :param int top_n: the number of statements returned when search is called without a limit
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.k1 = kwargs.get('k1', 1.2)
+        self.b = kwargs.get('b', 0.75)
+        self.top_n = kwargs.get('top_n', 100)
+        # the sum of the number of tags of all statements
+        self.total_length = 0
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.total_length = 0
+
+    def _add_postings(self, statement_id, tag_names):
+        super()._add_postings(statement_id, tag_names)
+        self.total_length += len(self.statement_tags[statement_id])
+
+    def remove(self, statement_id):
+        with self._lock:
+            self.total_length -= len(self.statement_tags.get(statement_id, ()))
+            super().remove(statement_id)
+
+    def idf(self, tag_name):
+        document_frequency = len(self.postings.get(tag_name, ()))
+        return math.log((len(self.statement_tags) - document_frequency + 0.5) / (document_frequency + 0.5) + 1)
+
+    def scores(self, features):
+        """
+        Return the BM25 score of every statement associated with at least one of the features.
+
+        :return dict: statement id -> score
+        """
+        with self._lock:
+            all_score = {}
+            if not self.statement_tags:
+                return all_score
+
+            average_length = self.total_length / len(self.statement_tags)
+            for feature in dict.fromkeys(features):
+                statement_ids = self.postings.get(feature)
+                if not statement_ids:
+                    continue
+                idf = self.idf(feature)
+                for statement_id in statement_ids:
+                    length = len(self.statement_tags[statement_id])
+                    weight = idf * (self.k1 + 1) / (1 + self.k1 * (1 - self.b + self.b * length / average_length))
+                    all_score[statement_id] = all_score.get(statement_id, 0) + weight
+            return all_score
+
+    def search(self, features, limit=None):
+        """
+        Return the records of the statements with the highest BM25 score,
+        ordered by score and then by id.
+
+        :param features: keywords of the input statement
+        :param int limit: the number of statements to return, defaults to top_n
+        :return list: list of StatementRecord
+        """
+        if limit is None:
+            limit = self.top_n
+        with self._lock:
+            all_score = self.scores(features)
+            all_statement_id = heapq.nsmallest(limit, all_score, key=lambda i: (-all_score[i], i))
+            return [self.records[statement_id] for statement_id in all_statement_id]
+
+
+class MinHashLSHIndex(StatementIndex):
+    """
+    A locality sensitive hashing index over the character shingles of the questions,
+    it finds the questions that are near duplicates of a statement without comparing it to all of them.
+
+    The MinHash signature of a question is split into bands, two questions are candidates
+    when all the values of at least one band are equal, questions whose shingles have a jaccard
+    similarity of about (1 / bands) ** (1 / rows) or more are very likely to be found.
+
+    :param int shingle_size: the number of characters of a shingle
+    :param int number_of_permutations: the length of a signature
+    :param int bands: the number of bands, it must divide number_of_permutations
+    :param int seed: seed of the hash functions, the same seed gives the same signatures
+    """
+
+    # a mersenne prime larger than any crc32 value
+    prime = (1 << 61) - 1
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.shingle_size = kwargs.get('shingle_size', 2)
+        self.number_of_permutations = kwargs.get('number_of_permutations', 64)
+        self.bands = kwargs.get('bands', 16)
+        if self.number_of_permutations % self.bands:
+            raise ValueError('the number of permutations must be a multiple of the number of bands')
+        self.rows = self.number_of_permutations // self.bands
+
+        # the universal hash functions (a * x + b) % prime
+        random_ = random.Random(kwargs.get('seed', 1))
+        self.permutations = [
+            (random_.randint(1, self.prime - 1), random_.randint(0, self.prime - 1))
+            for _ in range(self.number_of_permutations)
+        ]
+
+        # statement id -> signature
+        self.signatures = {}
+        # band -> set of statement id
+        self.buckets = {}
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.signatures = {}
+            self.buckets = {}
+
+    def shingles(self, text):
+        """
+        Return the hashes of the shingles of the text, a text shorter than a shingle is a shingle.
+        """
+        return self._hash_shingles(get_character_ngrams(normalize_question(text), self.shingle_size))
+
+    @staticmethod
+    def _hash_shingles(all_shingle):
+        return {zlib.crc32(shingle.encode('utf8')) for shingle in all_shingle}
+
+    def signature(self, text, all_shingle=None):
+        """
+        Return the MinHash signature of the text, None if the text has no shingles.
+
+        :param all_shingle: the hashes of the shingles of the text when they are already known
+        """
+        if all_shingle is None:
+            all_shingle = self.shingles(text)
+        if not all_shingle:
+            return None
+        prime = self.prime
+        return tuple(min((a * x + b) % prime for x in all_shingle) for a, b in self.permutations)
+
+    def _bands(self, signature):
+        rows = self.rows
+        return [(i, signature[i * rows:(i + 1) * rows]) for i in range(self.bands)]
+
+    def build(self, storage):
+        with self._lock:
+            super().build(storage)
+            # the bigrams stored when the statements were learned are the shingles of size 2
+            all_feature = {}
+            if self.shingle_size == 2 and hasattr(storage, 'filter_statement_features'):
+                all_feature = storage.filter_statement_features()
+            for record in list(self.records.values()):
+                feature = all_feature.get(record.id)
+                self._add_signature(record, self._hash_shingles(feature.ngrams) if feature is not None else None)
+
+    def _add_signature(self, record, all_shingle=None):
+        signature = self.signature(record.question, all_shingle)
+        if signature is None:
+            return
+        self.signatures[record.id] = signature
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, set()).add(record.id)
+
+    def add(self, record, features=()):
+        with self._lock:
+            if record.id in self.records:
+                self.remove(record.id)
+            super().add(record, features)
+            self._add_signature(record)
+
+    def remove(self, statement_id):
+        with self._lock:
+            super().remove(statement_id)
+            signature = self.signatures.pop(statement_id, None)
+            if signature is None:
+                return
+            for band in self._bands(signature):
+                statement_ids = self.buckets.get(band)
+                if statement_ids is None:
+                    continue
+                statement_ids.discard(statement_id)
+                if not statement_ids:
+                    del self.buckets[band]
+
+    def search(self, text, limit=None):
+        """
+        Return the records of the questions that are near duplicates of the text,
+        ordered by their estimated jaccard similarity and then by id.
+
+        :param str text: the input statement
+        :param int limit: the number of records to return, None for all candidates
+        :return list: list of StatementRecord
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return []
+
+        with self._lock:
+            all_statement_id = set()
+            for band in self._bands(signature):
+                all_statement_id.update(self.buckets.get(band, ()))
+
+            all_similarity = {
+                statement_id: sum(1 for x, y in zip(signature, self.signatures[statement_id]) if x == y)
+                for statement_id in all_statement_id
+            }
+            all_statement_id = sorted(all_similarity, key=lambda i: (-all_similarity[i], i))
+            if limit is not None:
+                all_statement_id = all_statement_id[:limit]
+            return [self.records[statement_id] for statement_id in all_statement_id]
@@ -0,0 +1,110 @@
+"""
+maintenance commands of the chatbot database
+
+Example:
+
+python -m chatbot.manage --database-uri sqlite:///db.sqlite3 upgrade-db
+python -m chatbot.manage --database-uri sqlite:///db.sqlite3 rebuild-features
+python -m chatbot.manage build-snapshot index.snapshot
+python -m chatbot.manage compare-snapshot index.snapshot
+"""
+import sys
+import argparse
+from .chatbot import ChatBot
+from .storage import SQLStorage
+from .snapshot import write_snapshot, compare_snapshot
+from .constants import DEFAULT_DATABASE_URI
+from .exceptions import DuplicateRowsError
+
+
+def upgrade_database(args):
+    storage = SQLStorage(database_uri=args.database_uri)
+    try:
+        storage.upgrade_database(delete_duplicates=args.delete_duplicates)
+    except DuplicateRowsError as e:
+        print(e.message)
+        return 1
+    finally:
+        storage.close()
+    print('the database is up to date')
+
+
+def rebuild_features(args):
+    chatbot = ChatBot(
+        'manage',
+        storage=SQLStorage(database_uri=args.database_uri),
+        logic_adapters=[],
+        initialize=False
+    )
+    try:
+        count = chatbot.rebuild_statement_features(chunk_size=args.chunk_size)
+    finally:
+        chatbot.close()
+    print('rebuilt the features of {} statements'.format(count))
+
+
+def build_snapshot(args):
+    storage = SQLStorage(database_uri=args.database_uri)
+    try:
+        count = write_snapshot(storage, args.snapshot_path)
+    finally:
+        storage.close()
+    print('wrote the snapshot "{}" of {} statements'.format(args.snapshot_path, count))
+
+
+def compare_snapshot_with_storage(args):
+    storage = SQLStorage(database_uri=args.database_uri)
+    try:
+        difference = compare_snapshot(storage, args.snapshot_path)
+    finally:
+        storage.close()
+
+    if not any(difference.values()):
+        print('the snapshot "{}" is up to date'.format(args.snapshot_path))
+        return 0
+    for name, statement_ids in difference.items():
+        if statement_ids:
+            print('{} statements: {}'.format(name, ','.join(str(statement_id) for statement_id in statement_ids)))
+    return 1
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m chatbot.manage', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', default=DEFAULT_DATABASE_URI, help='default: %(default)s')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    upgrade_database_parser = subparsers.add_parser(
+        'upgrade-db', help='add the indexes missing from a database created by an older version'
+    )
+    upgrade_database_parser.add_argument(
+        '--delete-duplicates', action='store_true', help='keep only the first of the rows that break a unique index'
+    )
+    upgrade_database_parser.set_defaults(function=upgrade_database)
+
+    rebuild_features_parser = subparsers.add_parser(
+        'rebuild-features', help='compute the statement_feature rows of all statements again'
+    )
+    rebuild_features_parser.add_argument('--chunk-size', type=int, default=1000)
+    rebuild_features_parser.set_defaults(function=rebuild_features)
+
+    build_snapshot_parser = subparsers.add_parser('build-snapshot', help='write the snapshot of the matching index')
+    build_snapshot_parser.add_argument('snapshot_path')
+    build_snapshot_parser.set_defaults(function=build_snapshot)
+
+    compare_snapshot_parser = subparsers.add_parser(
+        'compare-snapshot', help='compare the snapshot with the database, exit with 1 if they differ'
+    )
+    compare_snapshot_parser.add_argument('snapshot_path')
+    compare_snapshot_parser.set_defaults(function=compare_snapshot_with_storage)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    return args.function(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey  # Text, Table
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index  # Table
 # from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declared_attr, declarative_base
@@ -79,6 +79,12 @@ class Tag(Base):
 
 
 class TagAssociationStatement(Base):
+    __table_args__ = (
+        # looks up the statements of a tag and keeps each association unique
+        Index('ix_tag_association_statement_tag_id_statement_id', 'tag_id', 'statement_id', unique=True),
+        Index('ix_tag_association_statement_statement_id', 'statement_id'),
+    )
+
     tag_id = Column(
         Integer,
         ForeignKey('tag.id')
@@ -92,7 +98,8 @@ class TagAssociationStatement(Base):
 class AccessLog(Base):
     statement_id = Column(
         Integer,
-        ForeignKey('statement.id')
+        ForeignKey('statement.id'),
+        index=True
     )
     access_time = Column(
         DateTime(timezone=True),
@@ -100,7 +107,36 @@ class AccessLog(Base):
     )
 
 
+class StatementFeature(Base):
+    """
+    The data computed from the question of a statement when it is learned,
+    so it does not have to be computed again when the statement is compared.
+    """
+
+    statement_id = Column(
+        Integer,
+        ForeignKey('statement.id'),
+        index=True,
+        unique=True
+    )
+    normalized_question = Column(
+        String(length=1000)
+    )
+    length = Column(
+        Integer
+    )
+    # the distinct character bigrams of the normalized question, separated by spaces
+    ngrams = Column(
+        Text
+    )
+    # the words of the question, separated by spaces
+    tokens = Column(
+        Text
+    )
+
+
 statement_table_name = Statement.__tablename__
 tag_table_name = Tag.__tablename__
 tag_association_statement_table_name = TagAssociationStatement.__tablename__
 access_log_table_name = AccessLog.__tablename__
+statement_feature_table_name = StatementFeature.__tablename__
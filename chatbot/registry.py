@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from .utils import import_module, get_function_arguments, get_function_parameter_desc, get_object_path
+
+
+class AnswerFunction:
+    """
+    The function that computes the answer of a dynamic statement (type=1),
+    resolved from its dotted path together with its arguments and their descriptions.
+
+    :param str path: dotted path of the function, eg: 're.split'
+    """
+    __slots__ = ('path', 'function', 'arguments', 'parameter_descriptions', 'object_path')
+
+    def __init__(self, path):
+        self.path = path
+        self.function = import_module(path)
+        # argument name -> default value, None for the arguments without default value
+        self.arguments = get_function_arguments(self.function)
+        # argument name -> description from the ':param' lines of the docstring
+        self.parameter_descriptions = get_function_parameter_desc(self.function)
+        self.object_path = get_object_path(self.function)
+
+    def __repr__(self):
+        return '<AnswerFunction path:%s>' % self.path
+
+    def new_arguments(self):
+        """
+        Return a copy of the arguments and their default values that a statement can fill in.
+        """
+        return OrderedDict(self.arguments)
+
+
+class AnswerFunctionRegistry:
+    """
+    A process-wide cache of answer functions, each dotted path is imported and inspected once.
+    """
+
+    def __init__(self):
+        self._all_answer_function = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._all_answer_function)
+
+    def __contains__(self, path):
+        return path in self._all_answer_function
+
+    def get(self, path):
+        """
+        Return the AnswerFunction of the dotted path, it is resolved on first use.
+        """
+        answer_function = self._all_answer_function.get(path)
+        if answer_function is None:
+            answer_function = AnswerFunction(path)
+            with self._lock:
+                answer_function = self._all_answer_function.setdefault(path, answer_function)
+        return answer_function
+
+    def invalidate(self, path=None):
+        """
+        Forget the answer function of the dotted path, so it is resolved again on next use,
+        all answer functions are forgotten if no path is given.
+        """
+        with self._lock:
+            if path is None:
+                self._all_answer_function.clear()
+            else:
+                self._all_answer_function.pop(path, None)
+
+
+answer_functions = AnswerFunctionRegistry()
@@ -0,0 +1,423 @@
+"""
+a binary snapshot of the matching index, so worker processes can open it with mmap
+instead of loading the statements from the database
+
+The file starts with a header (magic, format version, number of sections) followed by
+the offset and length of each section, every section is aligned to 8 bytes:
+
+ids             int64, the statement ids in ascending order
+record_offsets  uint64, the position of each record in records, one more than the number of ids
+records         utf8 json of each statement and its precomputed features, decoded only when it is used
+tag_offsets     uint64, the position of each tag name in tags, one more than the number of tags
+tags            utf8 tag names sorted by their bytes, so a tag is found by binary search
+posting_offsets uint64, the position of the postings of each tag in postings
+postings        int64, the row numbers of the statements associated with each tag
+"""
+import os
+import mmap
+import json
+import struct
+import tempfile
+import threading
+from .utils import logger
+from .exceptions import SnapshotFormatError
+from .index import StatementRecord, StatementFeatureRecord, TagIndex
+from .models import statement_table_name, tag_table_name, tag_association_statement_table_name
+
+
+SNAPSHOT_MAGIC = b'CHATBOTS'
+SNAPSHOT_VERSION = 1
+
+HEADER = struct.Struct('<8sII')
+SECTION = struct.Struct('<QQ')
+SECTION_NAMES = ('ids', 'record_offsets', 'records', 'tag_offsets', 'tags', 'posting_offsets', 'postings')
+
+
+def load_index_data(storage):
+    """
+    Load the statements, their tags and their features from the storage.
+
+    :return tuple: (dict of statement id -> StatementRecord, dict of statement id -> tuple of tag name,
+                    dict of statement id -> StatementFeatureRecord)
+    """
+    all_record = {}
+    for statement in storage.all(statement_table_name):
+        all_record[statement.id] = StatementRecord.from_object(statement)
+
+    all_tag_name = {tag.id: tag.name for tag in storage.all(tag_table_name)}
+    all_statement_tag = {}
+    for association in storage.all(tag_association_statement_table_name):
+        tag_name = all_tag_name.get(association.tag_id)
+        if tag_name is None or association.statement_id not in all_record:
+            continue
+        all_statement_tag.setdefault(association.statement_id, []).append(tag_name)
+    all_statement_tag = {
+        statement_id: tuple(dict.fromkeys(tag_names)) for statement_id, tag_names in all_statement_tag.items()
+    }
+
+    all_feature = {}
+    if hasattr(storage, 'filter_statement_features'):
+        all_feature = storage.filter_statement_features()
+
+    return all_record, all_statement_tag, all_feature
+
+
+def _encode_record(record, feature):
+    data = list(record[1:])
+    if feature is not None:
+        data.append([feature.normalized_question, feature.length, ' '.join(feature.ngrams), ' '.join(feature.tokens)])
+    else:
+        data.append(None)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+
+def _pack_offsets(all_bytes):
+    offsets = [0]
+    for bytes_ in all_bytes:
+        offsets.append(offsets[-1] + len(bytes_))
+    return struct.pack('<{}Q'.format(len(offsets)), *offsets), b''.join(all_bytes)
+
+
+def write_snapshot(storage, snapshot_path):
+    """
+    Write the snapshot of the statements in the storage, the file is replaced atomically,
+    so the processes that have the old file open keep reading it.
+
+    :return int: the number of statements in the snapshot
+    """
+    all_record, all_statement_tag, all_feature = load_index_data(storage)
+
+    all_id = sorted(all_record)
+    all_row = {statement_id: row for row, statement_id in enumerate(all_id)}
+    record_offsets, records = _pack_offsets(
+        [_encode_record(all_record[statement_id], all_feature.get(statement_id)) for statement_id in all_id]
+    )
+
+    all_posting = {}
+    for statement_id in all_id:
+        for tag_name in all_statement_tag.get(statement_id, ()):
+            all_posting.setdefault(tag_name.encode('utf8'), []).append(all_row[statement_id])
+    all_tag = sorted(all_posting)
+    tag_offsets, tags = _pack_offsets(all_tag)
+    posting_offsets, postings = _pack_offsets(
+        [struct.pack('<{}q'.format(len(all_posting[tag])), *all_posting[tag]) for tag in all_tag]
+    )
+
+    sections = [
+        struct.pack('<{}q'.format(len(all_id)), *all_id),
+        record_offsets,
+        records,
+        tag_offsets,
+        tags,
+        posting_offsets,
+        postings,
+    ]
+
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            offset = HEADER.size + SECTION.size * len(sections)
+            offset += -offset % 8
+            all_section_info = []
+            for section in sections:
+                all_section_info.append((offset, len(section)))
+                offset += len(section)
+                offset += -offset % 8
+
+            f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sections)))
+            for section_info in all_section_info:
+                f.write(SECTION.pack(*section_info))
+            for (offset, _), section in zip(all_section_info, sections):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(section)
+        os.replace(temp_path, snapshot_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    logger.info('write the snapshot "{}" of {} statements and {} tags'.format(
+        snapshot_path, len(all_id), len(all_tag)
+    ))
+    return len(all_id)
+
+
+class Snapshot:
+    """
+    A read-only view of a snapshot file, the file is mapped into memory and nothing is
+    decoded until it is used, so the processes that open the same file share its pages.
+
+    :param str snapshot_path: the snapshot file written by write_snapshot
+    """
+
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        with open(snapshot_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, section_count = HEADER.unpack_from(self._mmap, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise SnapshotFormatError('"{}" is not a snapshot file'.format(snapshot_path))
+            if version != SNAPSHOT_VERSION or section_count != len(SECTION_NAMES):
+                raise SnapshotFormatError('the version of the snapshot "{}" is {}, {} is expected'.format(
+                    snapshot_path, version, SNAPSHOT_VERSION
+                ))
+
+            view = memoryview(self._mmap)
+            self._views = [view]
+            sections = {}
+            for index, name in enumerate(SECTION_NAMES):
+                offset, length = SECTION.unpack_from(self._mmap, HEADER.size + SECTION.size * index)
+                sections[name] = view[offset:offset + length]
+                self._views.append(sections[name])
+        except (SnapshotFormatError, struct.error, ValueError):
+            self.close()
+            raise
+
+        self.ids = self._cast(sections['ids'], 'q')
+        self.record_offsets = self._cast(sections['record_offsets'], 'Q')
+        self.records = sections['records']
+        self.tag_offsets = self._cast(sections['tag_offsets'], 'Q')
+        self.tags = sections['tags']
+        self.posting_offsets = self._cast(sections['posting_offsets'], 'Q')
+        self.postings = self._cast(sections['postings'], 'q')
+
+    def _cast(self, view, format_):
+        view = view.cast(format_)
+        self._views.append(view)
+        return view
+
+    def __len__(self):
+        return len(self.ids)
+
+    def close(self):
+        """
+        Unmap the file, the records and postings returned before are still valid.
+        """
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def find_row(self, statement_id):
+        """
+        Return the row number of the statement, None if it is not in the snapshot.
+        """
+        ids = self.ids
+        low, high = 0, len(ids)
+        while low < high:
+            middle = (low + high) // 2
+            if ids[middle] < statement_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(ids) and ids[low] == statement_id:
+            return low
+        return None
+
+    def _decode_record(self, row):
+        return json.loads(bytes(self.records[self.record_offsets[row]:self.record_offsets[row + 1]]).decode('utf8'))
+
+    def get_record(self, row):
+        data = self._decode_record(row)
+        return StatementRecord(self.ids[row], *data[:-1])
+
+    def get_feature(self, row):
+        feature = self._decode_record(row)[-1]
+        if feature is None:
+            return None
+        normalized_question, length, ngrams, tokens = feature
+        return StatementFeatureRecord(
+            self.ids[row],
+            normalized_question,
+            length,
+            tuple(ngrams.split(' ')) if ngrams else (),
+            tuple(tokens.split(' ')) if tokens else ()
+        )
+
+    def get_tag_name(self, index):
+        return bytes(self.tags[self.tag_offsets[index]:self.tag_offsets[index + 1]]).decode('utf8')
+
+    def tag_count(self):
+        return len(self.tag_offsets) - 1
+
+    def get_rows(self, tag_name):
+        """
+        Return the row numbers of the statements associated with the tag.
+        """
+        key = tag_name.encode('utf8')
+        tag_offsets, tags = self.tag_offsets, self.tags
+        low, high = 0, self.tag_count()
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(tags[tag_offsets[middle]:tag_offsets[middle + 1]]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.tag_count() or bytes(tags[tag_offsets[low]:tag_offsets[low + 1]]) != key:
+            return []
+        start, end = self.posting_offsets[low] // 8, self.posting_offsets[low + 1] // 8
+        return self.postings[start:end].tolist()
+
+    def get_statement_tags(self):
+        """
+        Return the tag names of every statement, used to compare the snapshot with the storage.
+
+        :return dict: statement id -> tuple of tag name
+        """
+        all_statement_tag = {}
+        for index in range(self.tag_count()):
+            tag_name = self.get_tag_name(index)
+            start, end = self.posting_offsets[index] // 8, self.posting_offsets[index + 1] // 8
+            for row in self.postings[start:end].tolist():
+                all_statement_tag.setdefault(self.ids[row], []).append(tag_name)
+        return {statement_id: tuple(sorted(tag_names)) for statement_id, tag_names in all_statement_tag.items()}
+
+
+def compare_snapshot(storage, snapshot_path):
+    """
+    Compare the snapshot with the statements in the storage.
+
+    :return dict: the ids of the statements that are 'missing' from the snapshot, the ids that are
+                  'extra' in the snapshot and the ids whose statement, tags or features 'changed'
+    """
+    all_record, all_statement_tag, all_feature = load_index_data(storage)
+    snapshot = Snapshot(snapshot_path)
+    try:
+        all_snapshot_id = set(snapshot.ids.tolist())
+        all_snapshot_statement_tag = snapshot.get_statement_tags()
+        changed = []
+        for statement_id in sorted(all_snapshot_id & set(all_record)):
+            row = snapshot.find_row(statement_id)
+            if snapshot.get_record(row) != all_record[statement_id] \
+                    or snapshot.get_feature(row) != all_feature.get(statement_id) \
+                    or all_snapshot_statement_tag.get(statement_id, ()) != \
+                    tuple(sorted(all_statement_tag.get(statement_id, ()))):
+                changed.append(statement_id)
+    finally:
+        snapshot.close()
+
+    return {
+        'missing': sorted(set(all_record) - all_snapshot_id),
+        'extra': sorted(all_snapshot_id - set(all_record)),
+        'changed': changed,
+    }
+
+
+class SnapshotIndex:
+    """
+    A tag index read from a snapshot file, it can be used as the tag_index of BestMatch, eg:
+    {'import_path': 'chatbot.snapshot.SnapshotIndex', 'snapshot_path': 'index.snapshot'}
+
+    The statements learned or forgotten after the snapshot was written are kept in memory on top of it.
+
+    :param str snapshot_path: the snapshot file
+    :param bool write_if_missing: write the snapshot from the storage when the file does not exist
+    """
+
+    def __init__(self, **kwargs):
+        self.snapshot_path = kwargs.get('snapshot_path', None)
+        if not self.snapshot_path:
+            raise ValueError('the snapshot_path of the snapshot index is required')
+        self.write_if_missing = kwargs.get('write_if_missing', True)
+        self.snapshot = None
+        # the statements learned after the snapshot was written
+        self.overlay = TagIndex()
+        # the ids of the statements of the snapshot that were forgotten or learned again
+        self.removed_ids = set()
+        self._lock = threading.RLock()
+
+        # logger
+        self.logger = kwargs.get('logger', logger)
+
+    def __len__(self):
+        snapshot_count = len(self.snapshot) if self.snapshot is not None else 0
+        return snapshot_count - len(self.removed_ids) + len(self.overlay)
+
+    def __contains__(self, statement_id):
+        return self.get(statement_id) is not None
+
+    def open(self, snapshot_path):
+        with self._lock:
+            self.close()
+            self.snapshot = Snapshot(snapshot_path)
+            self.snapshot_path = snapshot_path
+            self.overlay.clear()
+            self.removed_ids = set()
+        self.logger.info('open the snapshot "{}" of {} statements'.format(snapshot_path, len(self.snapshot)))
+
+    def close(self):
+        with self._lock:
+            if self.snapshot is not None:
+                self.snapshot.close()
+                self.snapshot = None
+
+    def build(self, storage):
+        """
+        Open the snapshot file, the storage is only read when the file has to be written.
+        """
+        if not os.path.isfile(self.snapshot_path) and self.write_if_missing:
+            write_snapshot(storage, self.snapshot_path)
+        self.open(self.snapshot_path)
+
+    def _snapshot_row(self, statement_id):
+        if self.snapshot is None or statement_id in self.removed_ids:
+            return None
+        return self.snapshot.find_row(statement_id)
+
+    def get(self, statement_id):
+        with self._lock:
+            record = self.overlay.get(statement_id)
+            if record is not None:
+                return record
+            row = self._snapshot_row(statement_id)
+            return self.snapshot.get_record(row) if row is not None else None
+
+    def get_feature(self, statement_id):
+        """
+        Return the precomputed features of a statement of the snapshot, None if they are unknown.
+        """
+        with self._lock:
+            row = self._snapshot_row(statement_id)
+            return self.snapshot.get_feature(row) if row is not None else None
+
+    def add(self, record, features=()):
+        with self._lock:
+            if self.snapshot is not None and self.snapshot.find_row(record.id) is not None:
+                self.removed_ids.add(record.id)
+            self.overlay.add(record, features)
+
+    def remove(self, statement_id):
+        with self._lock:
+            if self.snapshot is not None and self.snapshot.find_row(statement_id) is not None:
+                self.removed_ids.add(statement_id)
+            self.overlay.remove(statement_id)
+
+    def search(self, features, limit=None):
+        """
+        The same as ``TagIndex.search``.
+        """
+        with self._lock:
+            all_overlap = {}
+            all_snapshot_row = {}
+            for feature in dict.fromkeys(features):
+                if self.snapshot is not None:
+                    for row in self.snapshot.get_rows(feature):
+                        statement_id = self.snapshot.ids[row]
+                        if statement_id in self.removed_ids:
+                            continue
+                        all_snapshot_row[statement_id] = row
+                        all_overlap[statement_id] = all_overlap.get(statement_id, 0) + 1
+                for statement_id in self.overlay.postings.get(feature, ()):
+                    all_overlap[statement_id] = all_overlap.get(statement_id, 0) + 1
+
+            if limit is None:
+                all_statement_id = sorted(all_overlap)
+            else:
+                all_statement_id = sorted(all_overlap, key=lambda i: (-all_overlap[i], i))[:limit]
+            return [
+                self.snapshot.get_record(all_snapshot_row[statement_id]) if statement_id in all_snapshot_row
+                else self.overlay.get(statement_id)
+                for statement_id in all_statement_id
+            ]
@@ -1,13 +1,146 @@
+import asyncio
+import functools
+import heapq
 import logging
-from sqlalchemy import create_engine  # and_
-from sqlalchemy.orm import sessionmaker
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, select, bindparam, func, desc, text  # and_
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.engine import reflection
 # from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from .models import Base, Statement, Tag, TagAssociationStatement, AccessLog
-from .exceptions import DeleteDataWithoutConditionError, ModelNotExistError, ExecuteSqlError
+from .models import Base, Statement, Tag, TagAssociationStatement, AccessLog, StatementFeature
+from .index import StatementRecord, StatementFeatureRecord
+from .exceptions import DeleteDataWithoutConditionError, ModelNotExistError, ExecuteSqlError, \
+    FullTextSearchNotSupportedError, DuplicateRowsError
 from .constants import DEFAULT_DATABASE_URI
 
 
+def chunks(items, size):
+    """
+    Split the list into lists of at most size elements,
+    used to keep the number of bound parameters of an IN clause under the database limit.
+    """
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+statement_table = Statement.__table__
+tag_table = Tag.__table__
+tag_association_statement_table = TagAssociationStatement.__table__
+statement_feature_table = StatementFeature.__table__
+
+statement_columns = [statement_table.c[field_name] for field_name in StatementRecord._fields]
+# the statement_feature row of each statement, the columns are NULL for a statement without one
+statement_feature_columns = [statement_feature_table.c[field_name] for field_name in StatementFeatureRecord._fields]
+
+
+def outerjoin_statement_features(from_clause):
+    return from_clause.outerjoin(
+        statement_feature_table, statement_feature_table.c.statement_id == statement_table.c.id
+    )
+
+
+# the statements associated with at least one of the tags, the tag names are bound when it is executed
+statements_by_tags_condition = statement_table.c.id.in_(
+    select([tag_association_statement_table.c.statement_id]).where(
+        tag_association_statement_table.c.tag_id.in_(
+            select([tag_table.c.id]).where(tag_table.c.name.in_(bindparam('tag_names', expanding=True)))
+        )
+    )
+)
+statements_by_tags_query = select(statement_columns).where(
+    statements_by_tags_condition
+).order_by(statement_table.c.id)
+statements_with_features_by_tags_query = select(statement_columns + statement_feature_columns).select_from(
+    outerjoin_statement_features(statement_table)
+).where(statements_by_tags_condition).order_by(statement_table.c.id)
+
+# all statements, ordered by id
+all_statements_query = select(statement_columns).order_by(statement_table.c.id)
+all_statements_with_features_query = select(statement_columns + statement_feature_columns).select_from(
+    outerjoin_statement_features(statement_table)
+).order_by(statement_table.c.id)
+
+# the statements that share the most tags with the tag names, at most candidate_limit statements
+ranked_statement_ids = select([
+    tag_association_statement_table.c.statement_id,
+    func.count().label('overlap')
+]).select_from(
+    tag_association_statement_table.join(tag_table, tag_table.c.id == tag_association_statement_table.c.tag_id)
+).where(
+    tag_table.c.name.in_(bindparam('tag_names', expanding=True))
+).group_by(
+    tag_association_statement_table.c.statement_id
+).order_by(
+    desc('overlap'), tag_association_statement_table.c.statement_id
+).limit(bindparam('candidate_limit')).alias('ranked_statement_ids')
+ranked_statements = statement_table.join(
+    ranked_statement_ids, statement_table.c.id == ranked_statement_ids.c.statement_id
+)
+
+ranked_statements_by_tags_query = select(statement_columns).select_from(
+    ranked_statements
+).order_by(ranked_statement_ids.c.overlap.desc(), statement_table.c.id)
+ranked_statements_with_features_by_tags_query = select(statement_columns + statement_feature_columns).select_from(
+    outerjoin_statement_features(ranked_statements)
+).order_by(ranked_statement_ids.c.overlap.desc(), statement_table.c.id)
+
+# the statements associated with the tag names together with the name of each tag, ordered by statement id and tag id
+tagged_statements_by_tags_query = select(
+    [statement_table.c[field_name] for field_name in StatementRecord._fields] + [tag_table.c.name]
+).select_from(
+    statement_table.join(
+        tag_association_statement_table, tag_association_statement_table.c.statement_id == statement_table.c.id
+    ).join(tag_table, tag_table.c.id == tag_association_statement_table.c.tag_id)
+).where(
+    tag_table.c.name.in_(bindparam('tag_names', expanding=True))
+).order_by(statement_table.c.id, tag_table.c.id)
+
+# the id of the statements associated with the tag names together with the name of each tag,
+# ordered by statement id and tag id
+statement_tags_by_tags_query = select([
+    tag_association_statement_table.c.statement_id, tag_table.c.name
+]).select_from(
+    tag_association_statement_table.join(tag_table, tag_table.c.id == tag_association_statement_table.c.tag_id)
+).where(
+    tag_table.c.name.in_(bindparam('tag_names', expanding=True))
+).order_by(tag_association_statement_table.c.statement_id, tag_table.c.id)
+
+# the statements of the ids, ordered by id
+statements_by_ids_query = select(statement_columns).where(
+    statement_table.c.id.in_(bindparam('statement_ids', expanding=True))
+).order_by(statement_table.c.id)
+
+full_text_table_name = 'statement_fts'
+
+full_text_index_sqls = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+           question, content='{statement}', content_rowid='id', tokenize='trigram'
+       )''',
+    '''CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {statement} BEGIN
+           INSERT INTO {fts}(rowid, question) VALUES (new.id, new.question);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {statement} BEGIN
+           INSERT INTO {fts}({fts}, rowid, question) VALUES ('delete', old.id, old.question);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF question ON {statement} BEGIN
+           INSERT INTO {fts}({fts}, rowid, question) VALUES ('delete', old.id, old.question);
+           INSERT INTO {fts}(rowid, question) VALUES (new.id, new.question);
+       END''',
+]
+full_text_index_sqls = [
+    sql.format(fts=full_text_table_name, statement=statement_table.name) for sql in full_text_index_sqls
+]
+
+# the statements matching a fts5 query, ordered by bm25, a negative limit means no limit in sqlite
+search_questions_query = text('''SELECT {columns} FROM {fts} f JOIN {statement} s ON s.id = f.rowid
+    WHERE {fts} MATCH :match_query ORDER BY f.rank, s.id LIMIT :limit'''.format(
+    columns=', '.join('s.{}'.format(field_name) for field_name in StatementRecord._fields),
+    fts=full_text_table_name,
+    statement=statement_table.name
+))
+
+
 class SQLStorage:
     """
     The SQLStorageAdapter allows ChatterBot to store conversation
@@ -21,8 +154,22 @@ class SQLStorage:
     :keyword database_uri: eg: sqlite:///database_test.sqlite3',
         The database_uri can be specified to choose database driver.
     :type database_uri: str
+    :keyword pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping:
+        connection pool options passed to sqlalchemy.create_engine, only the options
+        that are given are passed, since the default sqlite pool does not accept them.
+    :keyword engine_options: other keyword arguments of sqlalchemy.create_engine
+    :type engine_options: dict
+    :keyword scoped_session: each thread reuses its own session instead of creating a new one per call.
+    :type scoped_session: bool
+    :keyword full_text_search: index the questions with a sqlite fts5 trigram table, see search_questions.
+    :type full_text_search: bool
+    :keyword upgrade: add the indexes missing from a database created by an older version, see upgrade_database.
+        Missing tables are always created.
+    :type upgrade: bool
     """
 
+    pool_option_names = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping')
+
     def __init__(self, **kwargs):
         self.logger = kwargs.get('logger', logging.getLogger(__name__))
         self.database_uri = kwargs.get('database_uri', None)
@@ -32,10 +179,93 @@ class SQLStorage:
             self.database_uri = DEFAULT_DATABASE_URI
 
         # connect db
-        self.engine = create_engine(self.database_uri, encoding='utf8', echo=False)
-        self.Session = sessionmaker(bind=self.engine, expire_on_commit=True)
-        if not self.engine.dialect.has_table(self.engine, 'statement'):
-            self.create_database()
+        engine_options = dict(kwargs.get('engine_options', {}))
+        for option_name in self.pool_option_names:
+            if option_name in kwargs:
+                engine_options[option_name] = kwargs[option_name]
+        self.engine = create_engine(self.database_uri, encoding='utf8', echo=False, **engine_options)
+        session_factory = sessionmaker(bind=self.engine, expire_on_commit=True)
+        if kwargs.get('scoped_session', False):
+            self.Session = scoped_session(session_factory)
+        else:
+            self.Session = session_factory
+
+        # the session of the unit of work of each thread
+        self._local = threading.local()
+
+        # the compiled form of the prebuilt queries, it belongs to the dialect of the engine
+        self._compiled_cache = {}
+
+        # only the missing tables are created, the existing tables are left alone
+        self.create_database()
+        if kwargs.get('upgrade', False):
+            self.upgrade_database()
+
+        self.full_text_search = kwargs.get('full_text_search', False)
+        if self.full_text_search:
+            self.create_full_text_index()
+
+    @contextmanager
+    def unit_of_work(self):
+        """
+        Group all operations of the current thread in the block into one transaction,
+        the transaction is committed when the block exits and rolled back if it raises.
+        A nested unit of work joins the outer one.
+
+        Example:
+
+        with storage.unit_of_work():
+            statement_id = storage.create('statement', question='q', answer='a')
+            storage.create('access_log', statement_id=statement_id)
+        """
+        session = getattr(self._local, 'session', None)
+        if session is not None:
+            yield session
+            return
+
+        session = self.Session()
+        self._local.session = session
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            self._local.session = None
+            session.close()
+
+    @contextmanager
+    def _session_scope(self, commit=True):
+        """
+        Yield the session of the current unit of work, or a session that
+        is committed and closed as soon as the operation is done.
+
+        :param bool commit: False for read only operations, so the loaded objects are not expired
+        """
+        session = getattr(self._local, 'session', None)
+        if session is not None:
+            yield session
+            return
+
+        session = self.Session()
+        try:
+            yield session
+            if commit:
+                session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def close(self):
+        """
+        Release the sessions and the connections of the pool.
+        """
+        if isinstance(self.Session, scoped_session):
+            self.Session.remove()
+        self.engine.dispose()
 
     def get_model(self, model_name):
         """
@@ -78,37 +308,227 @@ class SQLStorage:
         """
         return AccessLog
 
+    @staticmethod
+    def get_statement_feature_model():
+        """
+        Return the statement_feature model class
+        """
+        return StatementFeature
+
     def create_database(self):
         """
         Populate the database with the tables.
         """
         Base.metadata.create_all(self.engine)
 
+    def upgrade_database(self, delete_duplicates=False):
+        """
+        Add the indexes missing from a database created by an older version,
+        the tables and their data are kept.
+
+        :param bool delete_duplicates: keep only the first of the duplicate rows that prevent a unique index,
+            otherwise DuplicateRowsError is raised and nothing is deleted
+        :raises DuplicateRowsError: the table of a unique index has duplicate rows,
+            it is raised before the schema is changed
+        """
+        inspect = reflection.Inspector.from_engine(self.engine)
+        all_table_name = set(inspect.get_table_names())
+        all_missing_table = []
+        all_missing_index = []
+        for table in Base.metadata.sorted_tables:
+            if table.name not in all_table_name:
+                all_missing_table.append(table)
+                continue
+            all_index_name = {index_info['name'] for index_info in inspect.get_indexes(table.name)}
+            all_missing_index.extend(index for index in table.indexes if index.name not in all_index_name)
+
+        # the duplicate rows of all unique indexes are counted first, so a refused upgrade changes nothing
+        all_duplicate = []
+        for index in all_missing_index:
+            if not index.unique:
+                continue
+            column_names = [column.name for column in index.columns]
+            duplicate_count = self._count_duplicate_rows(index.table, column_names)
+            if duplicate_count and not delete_duplicates:
+                raise DuplicateRowsError(index.table.name, column_names, duplicate_count)
+            if duplicate_count:
+                all_duplicate.append((index.table, column_names))
+
+        for table in all_missing_table:
+            table.create(bind=self.engine)
+            self.logger.info('create the "{}" table'.format(table.name))
+        for table, column_names in all_duplicate:
+            self._delete_duplicate_rows(table, column_names)
+        for index in all_missing_index:
+            index.create(bind=self.engine)
+            self.logger.info('create the "{}" index on the "{}" table'.format(index.name, index.table.name))
+
+    def _count_duplicate_rows(self, table, column_names):
+        """
+        Return the number of rows that have the same values in the columns as an earlier row.
+        """
+        sql = 'SELECT (SELECT COUNT(*) FROM {table}) - (SELECT COUNT(*) FROM (SELECT 1 AS one FROM {table} ' \
+              'GROUP BY {columns}) AS distinct_rows)'.format(table=table.name, columns=', '.join(column_names))
+        return self.execute(sql)[0][0]
+
+    def _delete_duplicate_rows(self, table, column_names):
+        """
+        Keep only the first row of the rows that have the same values in the columns.
+        """
+        # the derived table is needed by mysql, which cannot select from the table it deletes from
+        sql = 'DELETE FROM {table} WHERE id NOT IN (SELECT id FROM (SELECT MIN(id) AS id FROM {table} ' \
+              'GROUP BY {columns}) AS keep_rows)'.format(table=table.name, columns=', '.join(column_names))
+        delete_count = self.execute(sql)
+        if delete_count:
+            self.logger.warning('delete {} duplicate rows from the "{}" table'.format(delete_count, table.name))
+
+    def create_full_text_index(self):
+        """
+        Create the fts5 table that indexes the statement questions by trigrams,
+        triggers keep it in sync with the statement table, so every way of writing statements updates it.
+        The existing statements are indexed when the table is created.
+        """
+        if self.engine.dialect.name != 'sqlite':
+            raise FullTextSearchNotSupportedError()
+
+        exist = self.engine.dialect.has_table(self.engine, full_text_table_name)
+        try:
+            with self._session_scope() as session:
+                for sql in full_text_index_sqls:
+                    session.execute(sql)
+                if not exist:
+                    session.execute(
+                        "INSERT INTO {table}({table}) VALUES ('rebuild')".format(table=full_text_table_name)
+                    )
+        except Exception as e:
+            raise FullTextSearchNotSupportedError('create the full text index failed, {}'.format(e))
+
+        if not exist:
+            self.logger.info('create the "{}" full text index'.format(full_text_table_name))
+
+    def search_questions(self, question, limit=None):
+        """
+        Return the statements whose question shares at least one trigram with the question,
+        the best matches by bm25 first, so a question with a wrong character is still found.
+        A question shorter than three characters has no trigram and finds nothing.
+
+        :param str question: the input statement
+        :param int limit: the number of statements to return, None for all
+        :return list: list of StatementRecord
+        """
+        question = ''.join(question.split())
+        all_trigram = dict.fromkeys(question[i:i + 3] for i in range(len(question) - 2))
+        if not all_trigram:
+            return []
+
+        # quoted as fts5 strings, so the query syntax of the input is not interpreted
+        match_query = ' OR '.join('"{}"'.format(trigram.replace('"', '""')) for trigram in all_trigram)
+        with self._session_scope(commit=False) as session:
+            result = session.execute(
+                search_questions_query, {'match_query': match_query, 'limit': -1 if limit is None else limit}
+            )
+            return [StatementRecord(*row) for row in result]
+
     def count(self, model_name):
         """
         Return the number of entries in the database.
         """
         model = self.get_model(model_name)
 
-        session = self.Session()
-        model_count = session.query(model).count()
-        session.close()
-        return model_count
+        with self._session_scope(commit=False) as session:
+            return session.query(model).count()
 
     def create(self, model_name, **kwargs):
         """
         add data to the database
         """
         model = self.get_model(model_name)
-        session = self.Session()
-        model_new_data = model(**kwargs)
-        session.add(model_new_data)
-        session.commit()
-        id_ = model_new_data.id
-        session.close()
-        return id_
+        with self._session_scope() as session:
+            model_new_data = model(**kwargs)
+            session.add(model_new_data)
+            session.flush()
+            return model_new_data.id
         # return list(self.filter(model_name, id=id))[0]
 
+    def create_many(self, model_name, all_data):
+        """
+        add many rows to the database in a single transaction
+
+        :param list all_data: list of dict, all the dict must have the same keys
+        :return int: the number of rows added
+        """
+        if not all_data:
+            return 0
+        model = self.get_model(model_name)
+        with self._session_scope() as session:
+            session.execute(model.__table__.insert(), all_data)
+        return len(all_data)
+
+    def create_statements(self, all_statement_data, in_clause_size=500):
+        """
+        add statements together with their tags to the database in a single transaction
+
+        :param list all_statement_data: list of (statement data, features) tuple, all the statement data
+                                        dict must have the same keys
+        :param int in_clause_size: the maximum number of values in the IN clause of a query
+        :return list: list of (statement id, statement data, features) tuple of the statements that were added,
+                      statements whose question already exists are skipped
+        """
+        with self._session_scope() as session:
+            # skip questions that already exist in the database or repeat in the batch
+            all_question = [statement_data['question'] for statement_data, _ in all_statement_data]
+            exist_questions = set()
+            for questions in chunks(all_question, in_clause_size):
+                query = session.query(Statement.question).filter(Statement.question.in_(questions))
+                exist_questions.update(question for question, in query)
+            all_new_statement_data = []
+            for statement_data, features in all_statement_data:
+                if statement_data['question'] in exist_questions:
+                    continue
+                exist_questions.add(statement_data['question'])
+                all_new_statement_data.append((statement_data, features))
+
+            if not all_new_statement_data:
+                return []
+
+            # add statements
+            session.execute(
+                Statement.__table__.insert(),
+                [statement_data for statement_data, _ in all_new_statement_data]
+            )
+            all_statement_id = {}
+            new_questions = [statement_data['question'] for statement_data, _ in all_new_statement_data]
+            for questions in chunks(new_questions, in_clause_size):
+                query = session.query(Statement.id, Statement.question).filter(Statement.question.in_(questions))
+                all_statement_id.update((question, id_) for id_, question in query)
+
+            # add tags that do not exist
+            all_tag_name = list({feature: None for _, features in all_new_statement_data for feature in features})
+            all_tag_id = {}
+            for tag_names in chunks(all_tag_name, in_clause_size):
+                query = session.query(Tag.id, Tag.name).filter(Tag.name.in_(tag_names))
+                all_tag_id.update((name, id_) for id_, name in query)
+            new_tag_names = [tag_name for tag_name in all_tag_name if tag_name not in all_tag_id]
+            if new_tag_names:
+                session.execute(Tag.__table__.insert(), [{'name': tag_name} for tag_name in new_tag_names])
+                for tag_names in chunks(new_tag_names, in_clause_size):
+                    query = session.query(Tag.id, Tag.name).filter(Tag.name.in_(tag_names))
+                    all_tag_id.update((name, id_) for id_, name in query)
+
+            # add the association between tags and statements
+            all_association = []
+            for statement_data, features in all_new_statement_data:
+                statement_id = all_statement_id[statement_data['question']]
+                for feature in dict.fromkeys(features):
+                    all_association.append({'tag_id': all_tag_id[feature], 'statement_id': statement_id})
+            if all_association:
+                session.execute(TagAssociationStatement.__table__.insert(), all_association)
+
+        return [
+            (all_statement_id[statement_data['question']], statement_data, features)
+            for statement_data, features in all_new_statement_data
+        ]
+
     def delete(self, model_name, **kwargs):
         """
         delete matching data from the database
@@ -117,32 +537,165 @@ class SQLStorage:
         if not kwargs:
             raise DeleteDataWithoutConditionError()
         model = self.get_model(model_name)
-        session = self.Session()
-        session.query(model).filter_by(**kwargs).delete()
-        session.commit()
-        session.close()
+        with self._session_scope() as session:
+            session.query(model).filter_by(**kwargs).delete()
 
     def filter(self, model_name, to_dict=False, **kwargs):
+        """
+        Yield the matching data, all rows are loaded when the iteration starts
+        and the session is released before the first row is yielded.
+        """
         model = self.get_model(model_name)
-        session = self.Session()
-        all_filter_object = session.query(model).filter_by(**kwargs)
-        if to_dict:
-            inspect = reflection.Inspector.from_engine(self.engine)
-            all_colum_name = [colum_info['name'] for colum_info in inspect.get_columns(model_name)]
-            for object_ in all_filter_object:
-                object_data = {}
-                for colum_name in all_colum_name:
-                    object_data[colum_name] = getattr(object_, colum_name)
-                yield object_data
-        else:
-            for object_ in all_filter_object:
-                yield object_
-
-        session.close()
+        with self._session_scope(commit=False) as session:
+            all_filter_object = session.query(model).filter_by(**kwargs).all()
+            if to_dict:
+                inspect = reflection.Inspector.from_engine(self.engine)
+                all_colum_name = [colum_info['name'] for colum_info in inspect.get_columns(model_name)]
+                all_filter_object = [
+                    {colum_name: getattr(object_, colum_name) for colum_name in all_colum_name}
+                    for object_ in all_filter_object
+                ]
+
+        for object_ in all_filter_object:
+            yield object_
 
     def all(self, model_name):
         return self.filter(model_name)
 
+    def all_statement_records(self, with_features=False):
+        """
+        Return all statements as StatementRecord instead of model instances, ordered by id.
+
+        :param bool with_features: also load the statement_feature row of each statement in the same query
+        :return list: list of StatementRecord, or of (StatementRecord, StatementFeatureRecord) tuple
+            with_features, the feature is None for a statement without one
+        """
+        with self._session_scope(commit=False) as session:
+            connection = session.connection().execution_options(compiled_cache=self._compiled_cache)
+            if with_features:
+                return self._to_records_with_features(connection.execute(all_statements_with_features_query))
+            return [StatementRecord(*row) for row in connection.execute(all_statements_query)]
+
+    @staticmethod
+    def _to_records_with_features(rows):
+        field_count = len(StatementRecord._fields)
+        return [
+            (
+                StatementRecord(*row[:field_count]),
+                StatementFeatureRecord.from_values(*row[field_count:]) if row[field_count] is not None else None
+            )
+            for row in rows
+        ]
+
+    def filter_statement_features(self, statement_ids=None, in_clause_size=500):
+        """
+        Load the rows of the statement_feature table in bulk.
+
+        :param statement_ids: the ids of the statements, None for all statements
+        :param int in_clause_size: the maximum number of values in the IN clause of a query
+        :return dict: statement id -> StatementFeatureRecord
+        """
+        table = StatementFeature.__table__
+        query = select([table.c[field_name] for field_name in StatementFeatureRecord._fields])
+        with self._session_scope(commit=False) as session:
+            if statement_ids is None:
+                all_row = session.execute(query).fetchall()
+            else:
+                all_row = []
+                for ids in chunks(list(statement_ids), in_clause_size):
+                    all_row.extend(session.execute(query.where(table.c.statement_id.in_(ids))).fetchall())
+        return {row.statement_id: StatementFeatureRecord.from_row(row) for row in all_row}
+
+    def filter_by_tags(self, tag_names, limit=None, with_features=False):
+        """
+        Return the statements associated with at least one of the tags, ordered by id.
+
+        The query is compiled once and the tag names are bound as parameters,
+        the rows are returned as StatementRecord instead of model instances.
+
+        :param tag_names: list of tag name
+        :param int limit: only return the limit statements associated with the most tags,
+            ordered by the number of tags and then by id, None for all statements
+        :param bool with_features: also load the statement_feature row of each statement in the same query
+        :return list: list of StatementRecord, or of (StatementRecord, StatementFeatureRecord) tuple
+            with_features, the feature is None for a statement without one
+        """
+        tag_names = list(tag_names)
+        if not tag_names:
+            return []
+
+        with self._session_scope(commit=False) as session:
+            connection = session.connection().execution_options(compiled_cache=self._compiled_cache)
+            if limit is None:
+                query = statements_with_features_by_tags_query if with_features else statements_by_tags_query
+                result = connection.execute(query, tag_names=tag_names)
+            else:
+                query = ranked_statements_with_features_by_tags_query if with_features \
+                    else ranked_statements_by_tags_query
+                result = connection.execute(query, tag_names=tag_names, candidate_limit=limit)
+            if with_features:
+                return self._to_records_with_features(result)
+            return [StatementRecord(*row) for row in result]
+
+    def filter_tagged_by_tags(self, tag_names, limit=None, all_group=None, in_clause_size=500):
+        """
+        Return the statements associated with at least one of the tags and which of the tags they are
+        associated with, so the candidates of many inputs can be loaded together.
+
+        :param tag_names: list of tag name
+        :param int limit: for each group of tag names, only load the limit statements associated with the most tags
+            of the group, ordered by the number of tags and then by id as filter_by_tags does, None for all statements.
+            The tags of the statements are queried first, so only the selected statements are loaded.
+        :param list all_group: list of list of tag name, eg: the keywords of each input, None for one group
+        :param int in_clause_size: the maximum number of values in the IN clause of a query
+        :return list: list of (StatementRecord, tuple of tag name) tuple, ordered by statement id
+        """
+        tag_names = list(dict.fromkeys(tag_names))
+        all_statement_tag = {}
+        all_record = {}
+        with self._session_scope(commit=False) as session:
+            connection = session.connection().execution_options(compiled_cache=self._compiled_cache)
+            if limit is None:
+                for names in chunks(tag_names, in_clause_size):
+                    for row in connection.execute(tagged_statements_by_tags_query, tag_names=names):
+                        record = StatementRecord(*row[:-1])
+                        all_record[record.id] = record
+                        all_statement_tag.setdefault(record.id, []).append(row[-1])
+            else:
+                for names in chunks(tag_names, in_clause_size):
+                    for statement_id, tag_name in connection.execute(statement_tags_by_tags_query, tag_names=names):
+                        all_statement_tag.setdefault(statement_id, []).append(tag_name)
+                statement_ids = self._top_statement_ids(
+                    all_statement_tag, [tag_names] if all_group is None else all_group, limit
+                )
+                for ids in chunks(sorted(statement_ids), in_clause_size):
+                    for row in connection.execute(statements_by_ids_query, statement_ids=ids):
+                        all_record[row[0]] = StatementRecord(*row)
+        return [
+            (all_record[statement_id], tuple(all_statement_tag[statement_id])) for statement_id in sorted(all_record)
+        ]
+
+    @staticmethod
+    def _top_statement_ids(all_statement_tag, all_group, limit):
+        """
+        Return the id of the limit statements associated with the most tags of each group.
+        """
+        postings = {}
+        for statement_id, statement_tag_names in all_statement_tag.items():
+            for tag_name in statement_tag_names:
+                postings.setdefault(tag_name, []).append(statement_id)
+
+        statement_ids = set()
+        for group in all_group:
+            all_overlap = {}
+            for tag_name in dict.fromkeys(group):
+                for statement_id in postings.get(tag_name, ()):
+                    all_overlap[statement_id] = all_overlap.get(statement_id, 0) + 1
+            statement_ids.update(
+                heapq.nsmallest(limit, all_overlap, key=lambda statement_id: (-all_overlap[statement_id], statement_id))
+            )
+        return statement_ids
+
     def execute(self, sql):
         """execute sql statement
 
@@ -152,22 +705,17 @@ class SQLStorage:
                        if it is a select statement, the second element returns the data,if it is not a  select
                        statement,the second element return null
         """
-        session = self.Session()
-
-        try:
-            execute_result = session.execute(sql)
-        except Exception as e:
-            raise ExecuteSqlError('execute sql "%s" failed, %s' % (sql, e))
-
-        # return the data if it is a select statement
-        if execute_result.returns_rows:
-            ret = execute_result.fetchall()
-        else:
-            ret = execute_result.rowcount
+        with self._session_scope() as session:
+            try:
+                execute_result = session.execute(sql)
+            except Exception as e:
+                raise ExecuteSqlError('execute sql "%s" failed, %s' % (sql, e))
 
-        session.commit()
-        session.close()
-        return ret
+            # return the data if it is a select statement
+            if execute_result.returns_rows:
+                return execute_result.fetchall()
+            else:
+                return execute_result.rowcount
 
 
 class StatementStorage:
@@ -198,3 +746,76 @@ class StatementStorage:
 
     def all(self):
         return self.db.filter(self.operating_model)
+
+
+class AsyncSQLStorage:
+    """
+    The asyncio facade of SQLStorage, every operation runs on the executor so the event loop is not blocked.
+
+    sqlalchemy 1.3 has no asyncio support, the operations are the ones of SQLStorage run on threads,
+    use scoped_session=True so each thread of the executor reuses its own session.
+
+    :keyword storage: the SQLStorage to wrap, other keyword arguments create a new SQLStorage when it is not given
+    :type storage: SQLStorage
+    :keyword executor: the executor of the operations, None is the default executor of the event loop
+    """
+
+    def __init__(self, **kwargs):
+        self.storage = kwargs.pop('storage', None)
+        self.executor = kwargs.pop('executor', None)
+        if self.storage is None:
+            self.storage = SQLStorage(**kwargs)
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def close(self):
+        return await self._run(self.storage.close)
+
+    async def count(self, model_name):
+        return await self._run(self.storage.count, model_name)
+
+    async def create(self, model_name, **kwargs):
+        return await self._run(self.storage.create, model_name, **kwargs)
+
+    async def create_many(self, model_name, all_data):
+        return await self._run(self.storage.create_many, model_name, all_data)
+
+    async def create_statements(self, all_statement_data, in_clause_size=500):
+        return await self._run(self.storage.create_statements, all_statement_data, in_clause_size=in_clause_size)
+
+    async def delete(self, model_name, **kwargs):
+        return await self._run(self.storage.delete, model_name, **kwargs)
+
+    async def filter(self, model_name, to_dict=False, **kwargs):
+        """
+        Return the matching data as a list, rows are loaded on the executor.
+        """
+        return await self._run(lambda: list(self.storage.filter(model_name, to_dict=to_dict, **kwargs)))
+
+    async def all(self, model_name):
+        return await self.filter(model_name)
+
+    async def all_statement_records(self, with_features=False):
+        return await self._run(self.storage.all_statement_records, with_features=with_features)
+
+    async def filter_statement_features(self, statement_ids=None, in_clause_size=500):
+        return await self._run(
+            self.storage.filter_statement_features, statement_ids=statement_ids, in_clause_size=in_clause_size
+        )
+
+    async def filter_by_tags(self, tag_names, limit=None, with_features=False):
+        return await self._run(self.storage.filter_by_tags, list(tag_names), limit=limit, with_features=with_features)
+
+    async def filter_tagged_by_tags(self, tag_names, limit=None, all_group=None, in_clause_size=500):
+        return await self._run(
+            self.storage.filter_tagged_by_tags, list(tag_names), limit=limit, all_group=all_group,
+            in_clause_size=in_clause_size
+        )
+
+    async def search_questions(self, question, limit=None):
+        return await self._run(self.storage.search_questions, question, limit=limit)
+
+    async def execute(self, sql):
+        return await self._run(self.storage.execute, sql)
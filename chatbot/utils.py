@@ -5,8 +5,10 @@ import sys
 import os
 import re
 import collections
-import jieba.analyse
-from .exceptions import InvalidTypeError
+import codecs
+import csv
+import json
+from .exceptions import InvalidTypeError, CorpusFormatError
 from .constants import PROJECT_DIR_PATH, LOG_FILE_NAME, LOG_LEVEL, APP_NAME
 
 
@@ -90,13 +92,54 @@ def get_function_arguments(fun):
     return all_argument_and_value
 
 
+def normalize_question(question):
+    """
+    Remove the whitespace of the question and lowercase it, eg: 'Hello World' -> 'helloworld'
+    """
+    return ''.join(question.split()).lower()
+
+
+def get_character_ngrams(text, n=2):
+    """
+    Return the distinct character n-grams of the text in order, a text shorter than n is its own n-gram.
+    """
+    if len(text) <= n:
+        return [text] if text else []
+    return list(dict.fromkeys(text[index:index + n] for index in range(len(text) - n + 1)))
+
+
 def get_features(
         content,
         allow_pos=()):
-    stop_word_file_path = os.path.join(PROJECT_DIR_PATH, 'data', 'stopwords.txt')
-    jieba.analyse.set_stop_words(stop_word_file_path)
+    from .analysis import get_analysis_resources
+
     # keyWord = jieba.analyse.textrank(content, topK=3, allowPOS=['ns', 'n', 'vn', 'v', 'nr'])
-    return jieba.analyse.extract_tags(content, topK=max(3, int(len(content) / 6)), allowPOS=allow_pos)
+    return get_analysis_resources().extract_keywords(content, top_k=max(3, int(len(content) / 6)), allow_pos=allow_pos)
+
+
+def read_corpus(file_path, encoding='utf8'):
+    """Read the statements in a corpus file one by one
+
+    jsonl file: one json object per line, eg: {"question": "...", "answer": "..."}
+    csv file: the first line is the header, eg: question,answer,category
+
+    :param str file_path: the path of the jsonl or csv file
+    :param str encoding: file encoding
+    :return(generator): dict of statement data
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        with codecs.open(file_path, 'r', encoding=encoding) as f:
+            for row in csv.DictReader(f):
+                yield row
+    elif extension in ('.jsonl', '.json'):
+        with codecs.open(file_path, 'r', encoding=encoding) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        raise CorpusFormatError(file_path)
 
 
 def get_logger(name,
@@ -119,10 +162,12 @@ def get_logger(name,
 
     # create handler
     screen_handler = logging.StreamHandler(stream=output_stream)
+    # the log file is only opened, and truncated, when the first record is written
     file_handler = logging.FileHandler(
         os.path.join(PROJECT_DIR_PATH, 'log', LOG_FILE_NAME),
         mode='w',
-        encoding='utf8'
+        encoding='utf8',
+        delay=True
     )
     # handler = logging.FileHandler(name, 'a', encoding='utf-8')
     screen_handler.setFormatter(logging.Formatter(log_format, datefmt='%Y-%m-%d %H:%M:%S'))
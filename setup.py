@@ -36,7 +36,7 @@ setup(
     long_description=DESCRIPTION,
     platforms=['any'],
     keywords=['chatbot'],
-    python_requires='>=3.4, <4',
+    python_requires='>=3.7, <4',
     install_requires=REQUIREMENTS,
 
     # packages=find_packages(exclude=['contrib', 'docs', 'test*']),
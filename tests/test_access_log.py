@@ -0,0 +1,99 @@
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from chatbot.access_log import AccessLogRecorder, BufferedAccessLogRecorder
+from chatbot.storage import SQLStorage
+from chatbot.models import access_log_table_name
+
+
+current_file_path = os.path.dirname((os.path.abspath(__file__)))
+
+
+class AccessLogRecorderTest(TestCase):
+    def setUp(self):
+        db_name = 'access_log_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        self.storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+
+    def test_record(self):
+        recorder = AccessLogRecorder(self.storage)
+        recorder.record(1)
+        self.assertEqual(self.storage.count(access_log_table_name), 1)
+
+    def test_buffered_record(self):
+        recorder = BufferedAccessLogRecorder(self.storage, batch_size=10, flush_interval=60, flush_at_exit=False)
+        for statement_id in range(5):
+            recorder.record(statement_id)
+        self.assertEqual(len(recorder), 5)
+        self.assertEqual(self.storage.count(access_log_table_name), 0)
+
+        recorder.flush()
+        self.assertEqual(len(recorder), 0)
+        self.assertEqual(self.storage.count(access_log_table_name), 5)
+
+        # the background thread writes a full batch
+        for statement_id in range(10):
+            recorder.record(statement_id)
+        for _ in range(100):
+            if self.storage.count(access_log_table_name) == 15:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.storage.count(access_log_table_name), 15)
+
+        recorder.record(1)
+        recorder.close()
+        self.assertEqual(self.storage.count(access_log_table_name), 16)
+
+        # after closing, access logs are written immediately
+        recorder.record(1)
+        self.assertEqual(self.storage.count(access_log_table_name), 17)
+
+    def test_drop_when_buffer_is_full(self):
+        recorder = BufferedAccessLogRecorder(
+            self.storage, batch_size=10, max_buffer_size=3, flush_interval=60, flush_at_exit=False
+        )
+        for statement_id in range(5):
+            recorder.record(statement_id)
+        self.assertEqual(recorder.dropped_count, 2)
+        recorder.close()
+        self.assertEqual(self.storage.count(access_log_table_name), 3)
+
+    def test_access_time_is_the_record_time(self):
+        recorder = BufferedAccessLogRecorder(self.storage, batch_size=10, flush_interval=60, flush_at_exit=False)
+        recorder.record(1)
+        time.sleep(0.1)
+        recorder.record(2)
+        time.sleep(0.1)
+        recorder.close()
+        first_log, second_log = self.storage.filter(access_log_table_name)
+        self.assertGreater(second_log.access_time, first_log.access_time)
+
+    def test_access_time_has_the_time_base_of_the_server_default(self):
+        timezone = os.environ.get('TZ')
+        os.environ['TZ'] = 'Asia/Shanghai'
+        time.tzset()
+        try:
+            self.storage.create(access_log_table_name, statement_id=0)
+            AccessLogRecorder(self.storage).record(1)
+            recorder = BufferedAccessLogRecorder(self.storage, flush_interval=60, flush_at_exit=False)
+            recorder.record(2)
+            recorder.close()
+        finally:
+            if timezone is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = timezone
+            time.tzset()
+        server_default_log, *recorder_logs = self.storage.filter(access_log_table_name)
+        for log in recorder_logs:
+            self.assertLess(abs((log.access_time - server_default_log.access_time).total_seconds()), 60)
+
+    def test_close_unregisters_the_exit_handler(self):
+        with patch('chatbot.access_log.atexit') as atexit:
+            recorder = BufferedAccessLogRecorder(self.storage, flush_interval=60)
+            atexit.register.assert_called_once_with(recorder.close)
+            recorder.close()
+            atexit.unregister.assert_called_once_with(recorder.close)
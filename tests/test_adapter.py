@@ -1,7 +1,12 @@
 import os
-from chatbot.adapter import LogicAdapter, BestMatch
+from chatbot.adapter import LogicAdapter, BestMatch, WhatCanIDo
+from chatbot.chatbot import ChatBot
+from chatbot.storage import SQLStorage
+from chatbot.deadline import Deadline
+from chatbot.comparison import TfidfSimilarity, LevenshteinDistance
 from chatbot.exceptions import MethodNotImplementedError
 from unittest import TestCase
+from unittest.mock import patch
 
 
 class LogicAdapterTest(TestCase):
@@ -64,3 +69,209 @@ class BestMatchTest(TestCase):
         self.assertEqual(response.answer, new_statement['answer'])
         self.assertEqual(response.confidence, 1)
         self.adapter.storage.delete(model_name, **new_statement)
+
+
+class BestMatchTagIndexTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        db_name = 'adapter_tag_index_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        cls.bot = ChatBot(
+            'test',
+            storage=storage,
+            logic_adapters=[
+                {
+                    'import_path': 'chatbot.adapter.BestMatch',
+                    'storage': storage,
+                    'tag_index': 'chatbot.index.TagIndex'
+                }
+            ]
+        )
+        cls.adapter = cls.bot.logic_adapters[0]
+
+    def test_learn_updates_index(self):
+        self.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        self.assertEqual(len(self.adapter.tag_index), 1)
+
+        # the database is not used on the read path
+        with patch.object(self.adapter.storage, 'filter_by_tags', side_effect=AssertionError), \
+                patch.object(self.adapter.storage, 'all_statement_records', side_effect=AssertionError):
+            response = self.adapter.process('早上吃鸡蛋对身体好吗')[0]
+        self.assertEqual(response.answer, '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        self.assertEqual(response.confidence, 1)
+
+
+class BestMatchLSHIndexTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        db_name = 'adapter_lsh_index_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        cls.bot = ChatBot(
+            'test',
+            storage=storage,
+            logic_adapters=[
+                {
+                    'import_path': 'chatbot.adapter.BestMatch',
+                    'storage': storage,
+                    'lsh_index': 'chatbot.index.MinHashLSHIndex'
+                }
+            ]
+        )
+        cls.adapter = cls.bot.logic_adapters[0]
+
+    def test_search_without_features(self):
+        self.bot.learn('你好', '你好，有什么可以帮你')
+        self.assertEqual(len(self.adapter.lsh_index), 1)
+
+        # the full library is not scanned
+        with patch.object(self.adapter.storage, 'all', side_effect=AssertionError), \
+                patch.object(self.adapter.storage, 'all_statement_records', side_effect=AssertionError):
+            self.assertEqual([s.question for s in self.adapter.search_without_features('你好啊')], ['你好'])
+            self.assertEqual(self.adapter.search_without_features('再见'), [])
+
+        self.bot.forget('你好')
+        self.assertEqual(len(self.adapter.lsh_index), 0)
+
+
+class BestMatchFullTextSearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        db_name = 'adapter_full_text_search_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name), full_text_search=True)
+        cls.bot = ChatBot(
+            'test',
+            storage=storage,
+            logic_adapters=[
+                {
+                    'import_path': 'chatbot.adapter.BestMatch',
+                    'storage': storage,
+                    'use_full_text_search': True
+                }
+            ]
+        )
+        cls.adapter = cls.bot.logic_adapters[0]
+
+    def test_process(self):
+        self.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+
+        # the tags are not used when the full text index finds the statement
+        with patch.object(self.adapter.storage, 'filter_by_tags', side_effect=AssertionError):
+            response = self.adapter.process('早上吃鸡旦对身体好吗')[0]
+        self.assertEqual(response.answer, '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+
+
+class BestMatchFunctionComparatorTest(TestCase):
+    def test_function_comparator(self):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        db_name = 'adapter_function_comparator_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        bot = ChatBot(
+            'test',
+            storage=SQLStorage(database_uri='sqlite:///{}'.format(db_name)),
+            logic_adapters=[{
+                'import_path': 'chatbot.adapter.BestMatch',
+                'storage': SQLStorage(database_uri='sqlite:///{}'.format(db_name)),
+                'comparator': lambda statement_a, statement_b: 1 if statement_a == statement_b else 0.5,
+            }]
+        )
+        bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        self.assertEqual(bot.get_response('早上吃鸡蛋对身体好吗')['text'], '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        bot.forget('早上吃鸡蛋对身体好吗')
+
+
+class ComparatorConfigTest(TestCase):
+    def test_comparator_from_config(self):
+        storage = SQLStorage(database_uri='sqlite://')
+        for adapter_class in [BestMatch, WhatCanIDo]:
+            import_path = 'chatbot.comparison.TfidfSimilarity'
+            for comparator in [import_path, {'import_path': import_path}]:
+                adapter = adapter_class(storage=storage, comparator=comparator)
+                self.assertIsInstance(adapter.comparator, TfidfSimilarity)
+
+
+class FeatureComparator(LevenshteinDistance):
+    """
+    Keep the features it is given.
+    """
+    uses_features = True
+
+    def most_similar(self, statement, other_statements, number, minimum_similarity=0, maximum_similarity=None,
+                     features=None):
+        self.features = features
+        return super().most_similar(statement, other_statements, number, minimum_similarity, maximum_similarity)
+
+
+class BestMatchStoredFeaturesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        db_name = 'adapter_stored_features_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        bot = ChatBot('test', storage=cls.storage, logic_adapters=[])
+        bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+
+    def test_default_comparator_does_not_load_features(self):
+        adapter = BestMatch(storage=self.storage)
+        with patch.object(self.storage, 'filter_by_tags', wraps=self.storage.filter_by_tags) as filter_by_tags:
+            self.assertEqual(adapter.process('早上吃鸡蛋对身体好吗')[0].confidence, 1)
+        self.assertFalse(filter_by_tags.call_args[1]['with_features'])
+
+    def test_comparator_using_features(self):
+        adapter = BestMatch(storage=self.storage, comparator=FeatureComparator())
+        self.assertEqual(adapter.process('早上吃鸡蛋对身体好吗')[0].confidence, 1)
+        self.assertEqual([feature.normalized_question for feature in adapter.comparator.features], ['早上吃鸡蛋对身体好吗'])
+
+
+class BestMatchDeadlineTest(TestCase):
+    def setUp(self):
+        self.adapter = BestMatch(score_batch_size=2, number_of_answers=3, maximum_similarity_threshold=1)
+        self.questions = ['早上吃什么', '晚上吃鸡蛋好吗', '吃鸡蛋好吗', '今天天气怎么样', '早上吃鸡蛋好不好']
+
+    def test_same_as_without_deadline(self):
+        self.assertEqual(
+            self.adapter.most_similar('早上吃鸡蛋好吗', self.questions, Deadline(60)),
+            self.adapter.most_similar('早上吃鸡蛋好吗', self.questions)
+        )
+        self.assertEqual(self.adapter.most_similar('吃鸡蛋好吗', self.questions, Deadline(60)), [(2, 1)])
+
+    def test_tfidf_batches(self):
+        comparator = TfidfSimilarity()
+        comparator.fit(self.questions)
+        adapter = BestMatch(score_batch_size=2, number_of_answers=3, comparator=comparator)
+
+        # each batch only scores its own rows
+        with patch.object(comparator, 'similarities', wraps=comparator.similarities) as similarities:
+            self.assertEqual(
+                adapter.most_similar('早上吃鸡蛋', self.questions, Deadline(60)),
+                adapter.most_similar('早上吃鸡蛋', self.questions)
+            )
+        self.assertEqual([len(call[0][1]) for call in similarities.call_args_list[:3]], [2, 2, 1])
+
+    def test_expired(self):
+        deadline = Deadline(0)
+        self.assertEqual(
+            self.adapter.most_similar('早上吃鸡蛋好吗', self.questions, deadline),
+            self.adapter.most_similar('早上吃鸡蛋好吗', self.questions[:2])
+        )
+        self.assertTrue(deadline.truncated)
+
+        deadline = Deadline(0)
+        self.assertEqual(self.adapter.search_without_features('早上吃鸡蛋好吗', deadline), [])
+        self.assertTrue(deadline.truncated)
@@ -0,0 +1,103 @@
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import sys
+import subprocess
+import tempfile
+import jieba
+from chatbot.analysis import AnalysisResources, AnalyzedStatement, get_analysis_resources, configure_jieba, \
+    JIEBA_CACHE_DIR_ENVIRONMENT_VARIABLE
+from chatbot.utils import get_features
+from chatbot.tokenizer import JiebaTokenizer
+
+
+class AnalysisResourcesTest(TestCase):
+    def test_get_analysis_resources(self):
+        self.assertIs(get_analysis_resources(), get_analysis_resources())
+
+    def test_stop_words(self):
+        resources = AnalysisResources()
+        self.assertIsInstance(resources.stop_words, frozenset)
+        self.assertIn('的', resources.stop_words)
+        self.assertIs(resources.stop_words, resources.stop_words)
+
+    def test_idf(self):
+        resources = AnalysisResources()
+        with self.assertRaises(TypeError):
+            resources.idf['鸡蛋'] = 0
+        self.assertGreater(resources.median_idf, 0)
+
+    def test_add_words(self):
+        resources = AnalysisResources()
+        self.assertTrue(resources.add_words(['磁盘空间使用率']))
+        self.assertFalse(resources.add_words(['磁盘空间使用率']))
+        resources.remove_words(['磁盘空间使用率'])
+        self.assertTrue(resources.add_words(['磁盘空间使用率']))
+        resources.remove_words(['磁盘空间使用率'])
+
+    def test_extract_keywords(self):
+        resources = get_analysis_resources()
+        self.assertEqual(resources.extract_keywords('早上吃鸡蛋对身体好吗', top_k=3), ['鸡蛋', '早上', '身体'])
+        self.assertEqual(resources.rank_keywords(['的', '鸡蛋', '鸡蛋', '早上']), ['鸡蛋', '早上'])
+
+
+class AnalyzedStatementTest(TestCase):
+    def test_same_as_tokenizer(self):
+        statement = '我爱北京天安门'
+        analyzed_statement = AnalyzedStatement(statement)
+        tokenizer = JiebaTokenizer()
+        for remove_stop_word in (True, False):
+            self.assertEqual(
+                analyzed_statement.get_words(remove_stop_word=remove_stop_word),
+                tokenizer.cut(statement, seg_only=True, remove_stop_word=remove_stop_word)
+            )
+            self.assertEqual(
+                analyzed_statement.get_words_and_tags(remove_stop_word=remove_stop_word),
+                tokenizer.cut(statement, seg_only=False, remove_stop_word=remove_stop_word)
+            )
+
+    def test_features(self):
+        for statement in ['早上吃鸡蛋对身体好吗', '获取ip地址为1.1.1.1的主机的磁盘空间使用率']:
+            self.assertEqual(AnalyzedStatement(statement).features, get_features(statement))
+            self.assertEqual(
+                AnalyzedStatement(statement).get_keywords(top_k=max(3, int(len(statement) / 6)), allow_pos=('n',)),
+                get_features(statement, allow_pos=('n',))
+            )
+
+    def test_segment_once(self):
+        analyzed_statement = AnalyzedStatement('早上吃鸡蛋对身体好吗')
+        with patch('jieba.cut', wraps=jieba.cut) as cut:
+            analyzed_statement.get_words(remove_stop_word=True)
+            analyzed_statement.features
+            analyzed_statement.get_keywords(top_k=1)
+            self.assertEqual(cut.call_count, 1)
+
+    def test_segment_again_after_dictionary_change(self):
+        resources = AnalysisResources()
+        analyzed_statement = AnalyzedStatement('获取磁盘空间使用率', resources)
+        self.assertNotIn('磁盘空间使用率', analyzed_statement.words)
+        resources.add_words(['磁盘空间使用率'])
+        self.assertIn('磁盘空间使用率', analyzed_statement.words)
+        resources.remove_words(['磁盘空间使用率'])
+
+
+class LazyImportTest(TestCase):
+    def test_import_does_not_load_jieba(self):
+        project_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, chatbot.chatbot; print("jieba" in sys.modules)'],
+            cwd=project_dir_path
+        )
+        self.assertEqual(output.strip(), b'False')
+
+    def test_configure_jieba(self):
+        tmp_dir = jieba.dt.tmp_dir
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                cache_dir = os.path.join(directory, 'jieba')
+                with patch.dict(os.environ, {JIEBA_CACHE_DIR_ENVIRONMENT_VARIABLE: cache_dir}):
+                    configure_jieba()
+                self.assertEqual(jieba.dt.tmp_dir, cache_dir)
+                self.assertTrue(os.path.isdir(cache_dir))
+        finally:
+            jieba.dt.tmp_dir = tmp_dir
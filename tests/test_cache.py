@@ -0,0 +1,41 @@
+from unittest import TestCase
+from chatbot.cache import ResponseCache
+
+
+class ResponseCacheTest(TestCase):
+    def test_get_and_set(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        now = [0]
+        cache = ResponseCache(ttl=10, timer=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 9
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_delete_and_clear(self):
+        cache = ResponseCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
@@ -1,6 +1,17 @@
 from chatbot.chatbot import ChatBot
-from chatbot.models import statement_table_name
+from chatbot.models import statement_table_name, tag_table_name, access_log_table_name, statement_feature_table_name
+from chatbot.storage import SQLStorage, AsyncSQLStorage
+from chatbot.index import MinHashLSHIndex
+from chatbot import manage
+from chatbot.adapter import LogicAdapter, BestMatch
+from chatbot.conversation import Statement
 from unittest import TestCase
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+import tempfile
+import json
 import os
 
 
@@ -55,6 +66,396 @@ class ChatBotTest(TestCase):
         print(ccc)
 
 
+class ChatBotLearnManyTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        db_name = 'learn_many_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.bot = ChatBot('test', storage={
+            'import_path': 'chatbot.storage.SQLStorage',
+            'database_uri': 'sqlite:///{}'.format(db_name)
+        })
+
+    def test_learn_many(self):
+        statements = [
+            {'question': '早上吃鸡蛋对身体好吗', 'answer': '早餐当中吃鸡蛋，的确是对身体有很大的益处'},
+            {'question': '鸡蛋怎么煮才好吃', 'answer': '水开后煮八分钟'},
+            {'question': '早上吃鸡蛋对身体好吗', 'answer': '重复的问题'},
+            {'question': 'test', 'answer': 're.split', 'type_': 1, 'parameters': 'pattern=:;string=1:2'},
+        ]
+        progress = []
+        learned_count = self.bot.learn_many(
+            iter(statements), chunk_size=2, callback=lambda *args: progress.append(args)
+        )
+        self.assertEqual(learned_count, 3)
+        self.assertEqual(len(progress), 2)
+        self.assertEqual(progress[-1][:2], (3, 1))
+        self.assertEqual(self.bot.storage.count(statement_table_name), 3)
+        self.assertEqual(len(list(self.bot.storage.filter(tag_table_name, name='鸡蛋'))), 1)
+
+        response = self.bot.get_response('鸡蛋怎么煮才好吃')
+        self.assertEqual(response['text'], '水开后煮八分钟')
+        response = self.bot.get_response('test')
+        self.assertEqual(response['text'], ['1', '2'])
+
+    def test_learn_many_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jsonl_file_path = os.path.join(directory, 'corpus.jsonl')
+            with open(jsonl_file_path, 'w', encoding='utf8') as f:
+                f.write(json.dumps({'question': '今天天气怎么样', 'answer': '晴天'}, ensure_ascii=False) + '\n')
+            self.assertEqual(self.bot.learn_many(jsonl_file_path), 1)
+
+            csv_file_path = os.path.join(directory, 'corpus.csv')
+            with open(csv_file_path, 'w', encoding='utf8') as f:
+                f.write('question,answer,category\n明天天气怎么样,下雨,天气\n')
+            self.assertEqual(self.bot.learn_many(csv_file_path), 1)
+
+        statement = list(self.bot.storage.filter(statement_table_name, question='明天天气怎么样'))[0]
+        self.assertEqual(statement.category, '天气')
+        self.assertEqual(statement.type, 0)
+
+
+class ChatBotResponseCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        db_name = 'response_cache_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        cls.bot = ChatBot(
+            'test',
+            storage=storage,
+            logic_adapters=[
+                {
+                    'import_path': 'chatbot.adapter.BestMatch',
+                    'storage': storage,
+                    'tag_index': 'chatbot.index.TagIndex'
+                }
+            ],
+            response_cache={'max_size': 10}
+        )
+        cls.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        cls.bot.learn('test', 're.split', type_=1, parameters='pattern=:;string=1:2')
+
+    def setUp(self):
+        self.bot.response_cache.clear()
+
+    def test_cache_static_answer(self):
+        adapter = self.bot.logic_adapters[0]
+        with patch.object(adapter, 'process', wraps=adapter.process) as process:
+            response = self.bot.get_response('早上吃鸡蛋对身体好吗')
+            response['text'] = 'changed by the caller'
+            response = self.bot.get_response('早上吃鸡蛋对身体好吗')
+            self.assertEqual(process.call_count, 1)
+        self.assertEqual(response['text'], '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        self.assertEqual(self.bot.storage.count(access_log_table_name), 2)
+
+    def test_not_cache_dynamic_answer(self):
+        self.bot.get_response('test')
+        self.assertEqual(len(self.bot.response_cache), 0)
+
+        self.bot.cache_dynamic_answers = True
+        self.bot.get_response('test')
+        self.bot.cache_dynamic_answers = False
+        self.assertEqual(len(self.bot.response_cache), 1)
+
+    def test_invalidate(self):
+        response = self.bot.get_response('早上吃水果对身体好吗')
+        self.assertRegex(response['text'], '早上吃鸡蛋对身体好吗')
+        self.assertEqual(len(self.bot.response_cache), 1)
+
+        self.bot.learn('早上吃水果对身体好吗', '早上吃水果对身体有好处')
+        self.assertEqual(len(self.bot.response_cache), 0)
+        response = self.bot.get_response('早上吃水果对身体好吗')
+        self.assertEqual(response['text'], '早上吃水果对身体有好处')
+
+        self.assertTrue(self.bot.forget('早上吃水果对身体好吗'))
+        self.assertEqual(len(self.bot.response_cache), 0)
+        self.assertFalse(self.bot.forget('早上吃水果对身体好吗'))
+        response = self.bot.get_response('早上吃水果对身体好吗')
+        self.assertRegex(response['text'], '早上吃鸡蛋对身体好吗')
+
+
+class ChatBotStatementFeatureTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        cls.db_name = 'statement_feature_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, cls.db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.bot = ChatBot('test', storage=SQLStorage(database_uri='sqlite:///{}'.format(cls.db_name)))
+        cls.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        cls.bot.learn_many([{'question': '今天 天气怎么样', 'answer': '晴天'}])
+
+    def test_learn(self):
+        all_feature = self.bot.storage.filter_statement_features()
+        self.assertEqual(len(all_feature), 2)
+        feature = list(all_feature.values())[1]
+        self.assertEqual(feature.normalized_question, '今天天气怎么样')
+        self.assertEqual(feature.length, 7)
+        self.assertEqual(feature.ngrams, ('今天', '天天', '天气', '气怎', '怎么', '么样'))
+        self.assertEqual(feature.tokens, ('今天', '天气', '怎么样'))
+
+    def test_forget(self):
+        self.bot.learn('你叫什么名字', '我是机器人')
+        self.assertEqual(self.bot.storage.count(statement_feature_table_name), 3)
+        self.bot.forget('你叫什么名字')
+        self.assertEqual(self.bot.storage.count(statement_feature_table_name), 2)
+
+    def test_manage_examples(self):
+        for line in manage.__doc__.splitlines():
+            if line.startswith('python -m chatbot.manage '):
+                self.assertTrue(manage.get_parser().parse_args(line.split()[3:]).command)
+
+    def test_rebuild(self):
+        expected_features = self.bot.storage.filter_statement_features()
+        self.bot.storage.execute('DELETE FROM {}'.format(statement_feature_table_name))
+        manage.main(['--database-uri', 'sqlite:///{}'.format(self.db_name), 'rebuild-features'])
+        all_feature = self.bot.storage.filter_statement_features()
+        self.assertEqual(
+            [feature[1:] for feature in all_feature.values()], [feature[1:] for feature in expected_features.values()]
+        )
+
+        # the stored bigrams are used as the shingles
+        index = MinHashLSHIndex()
+        with patch.object(MinHashLSHIndex, 'shingles', side_effect=AssertionError):
+            index.build(self.bot.storage)
+        self.assertEqual([r.question for r in index.search('今天的天气怎么样')], ['今天 天气怎么样'])
+
+
+class ChatBotAsyncTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        cls.db_name = 'async_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, cls.db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.executor = ThreadPoolExecutor(max_workers=4)
+        cls.bot = ChatBot(
+            'test',
+            storage=SQLStorage(database_uri='sqlite:///{}'.format(cls.db_name), scoped_session=True),
+            executor=cls.executor
+        )
+        cls.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        cls.bot.learn('今天天气怎么样', '晴天')
+        cls.bot.learn(question='split test', answer='re.split', type_=1, parameters='string=1:2:3;')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def test_aget_response(self):
+        for question in ['早上吃鸡蛋对身体好吗', '今天天气怎么样', '鸡蛋', 'test']:
+            self.assertEqual(asyncio.run(self.bot.aget_response(question)), self.bot.get_response(question))
+
+    def test_storage_is_awaited(self):
+        with patch.object(AsyncSQLStorage, 'filter_by_tags', autospec=True,
+                          side_effect=AsyncSQLStorage.filter_by_tags) as filter_by_tags, \
+                patch.object(self.bot.storage, 'filter_by_tags', wraps=self.bot.storage.filter_by_tags) as query:
+            response = asyncio.run(self.bot.aget_response('早上吃鸡蛋对身体好吗'))
+        self.assertEqual(response['text'], '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        self.assertEqual(filter_by_tags.await_count, 1)
+        self.assertEqual(query.call_count, 1)
+
+    def test_concurrent(self):
+        async def get_all_response():
+            return await asyncio.gather(*[
+                self.bot.aget_response(question) for question in ['早上吃鸡蛋对身体好吗', '今天天气怎么样'] * 5
+            ])
+
+        all_response = asyncio.run(get_all_response())
+        self.assertEqual([response['text'] for response in all_response], ['早餐当中吃鸡蛋，的确是对身体有很大的益处', '晴天'] * 5)
+
+    def test_domain(self):
+        response = asyncio.run(self.bot.aget_response('split test'))
+        self.assertTrue(response['context']['domain'])
+        response = asyncio.run(self.bot.aget_response(':', **response))
+        self.assertEqual(response['text'], ['1', '2', '3'])
+
+
+class ChatBotGetResponsesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        cls.db_name = 'get_responses_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, cls.db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.bot = ChatBot(
+            'test', storage=SQLStorage(database_uri='sqlite:///{}'.format(cls.db_name)), response_cache=None
+        )
+        cls.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        cls.bot.learn('晚上吃鸡蛋好吗', '晚上吃鸡蛋不好消化')
+        cls.bot.learn('今天天气怎么样', '晴天')
+        cls.bot.learn(question='split test', answer='re.split', type_=1, parameters='string=1:2:3;')
+
+    def test_get_responses(self):
+        inputs = ['早上吃鸡蛋对身体好吗', '鸡蛋', '今天天气怎么样', '你好', '晚上吃鸡蛋好不好', 'split test']
+        self.assertEqual(
+            list(self.bot.get_responses(inputs, chunk_size=4)),
+            [self.bot.get_response(input_statement) for input_statement in inputs]
+        )
+
+    def test_contexts(self):
+        context = self.bot.get_response('split test')['context']
+        all_response = list(self.bot.get_responses(iter(['split test', ':']), contexts=iter([None, context])))
+        self.assertTrue(all_response[0]['context']['domain'])
+        self.assertEqual(all_response[1]['text'], ['1', '2', '3'])
+
+    def test_one_query_per_chunk(self):
+        inputs = ['早上吃鸡蛋对身体好吗', '晚上吃鸡蛋好吗', '今天天气怎么样']
+        with patch.object(self.bot.storage, 'filter_by_tags', side_effect=AssertionError), \
+                patch.object(self.bot.storage, 'filter_tagged_by_tags',
+                             wraps=self.bot.storage.filter_tagged_by_tags) as filter_tagged_by_tags:
+            all_response = list(self.bot.get_responses(inputs))
+        self.assertEqual(filter_tagged_by_tags.call_count, 1)
+        self.assertEqual([response['text'] for response in all_response], ['早餐当中吃鸡蛋，的确是对身体有很大的益处', '晚上吃鸡蛋不好消化', '晴天'])
+
+    def test_get_responses_with_candidate_limit(self):
+        adapter = next(a for a in self.bot.logic_adapters if isinstance(a, BestMatch))
+        # shares more keywords with the batch than the statement of the weather, which must still be compared
+        self.bot.learn('早上吃鸡蛋怎么样', '好')
+        inputs = ['早上吃鸡蛋对身体好吗', '今天天气怎么样']
+        try:
+            with patch.object(adapter, 'candidate_limit', 1):
+                self.assertEqual(
+                    list(self.bot.get_responses(inputs)),
+                    [self.bot.get_response(input_statement) for input_statement in inputs]
+                )
+        finally:
+            self.bot.forget('早上吃鸡蛋怎么样')
+
+
+class SlowAdapter(LogicAdapter):
+    """
+    Answer with the given confidence after a delay.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = kwargs.get('delay', 0)
+        self.confidence = kwargs.get('confidence', 0)
+
+    def process(self, statement, **kwargs):
+        time.sleep(self.delay)
+        return [Statement(question=statement, reference_question='slow', answer='slow', confidence=self.confidence)]
+
+
+class ChatBotAdapterExecutorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        cls.db_name = 'adapter_executor_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, cls.db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.storage = SQLStorage(database_uri='sqlite:///{}'.format(cls.db_name))
+        bot = ChatBot('test', storage=cls.storage, logic_adapters=[])
+        bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        bot.learn('晚上吃鸡蛋好吗', '晚上吃鸡蛋不好消化')
+
+    def get_bot(self, delay, confidence, adapter_executor=None):
+        return ChatBot(
+            'test',
+            storage=self.storage,
+            response_cache=None,
+            adapter_executor=adapter_executor,
+            logic_adapters=[
+                {'import_path': 'test_chatbot.SlowAdapter', 'delay': delay, 'confidence': confidence},
+                {'import_path': 'chatbot.adapter.BestMatch', 'storage': self.storage},
+            ]
+        )
+
+    def test_stop_waiting(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            bot = self.get_bot(1, 0.5, adapter_executor=executor)
+            start = time.perf_counter()
+            response = bot.get_response('早上吃鸡蛋对身体好吗')
+            self.assertLess(time.perf_counter() - start, 0.8)
+            self.assertEqual(response['text'], '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        finally:
+            executor.shutdown()
+
+    def test_same_answers(self):
+        bot = self.get_bot(0.1, 0.5, adapter_executor={
+            'import_path': 'concurrent.futures.ThreadPoolExecutor', 'max_workers': 2
+        })
+        try:
+            for question in ['鸡蛋', '晚上吃什么', '你好']:
+                self.assertEqual(bot.get_response(question), self.get_bot(0.1, 0.5).get_response(question))
+        finally:
+            bot.adapter_executor.shutdown()
+
+    def test_aget_response(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            bot = self.get_bot(1, 0.5, adapter_executor=executor)
+            start = time.perf_counter()
+            response = asyncio.run(bot.aget_response('早上吃鸡蛋对身体好吗'))
+            self.assertLess(time.perf_counter() - start, 0.8)
+            self.assertEqual(response['text'], '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+            for question in ['鸡蛋', '晚上吃什么', '你好']:
+                self.assertEqual(asyncio.run(bot.aget_response(question)), self.get_bot(0, 0.5).get_response(question))
+        finally:
+            executor.shutdown()
+
+
+def slow_answer(seconds):
+    """
+    :param seconds: how long the answer takes
+    """
+    time.sleep(float(seconds))
+    return 'done'
+
+
+class ChatBotTimeoutTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        current_file_path = os.path.dirname((os.path.abspath(__file__)))
+        cls.db_name = 'timeout_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, cls.db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.bot = ChatBot('test', storage=SQLStorage(database_uri='sqlite:///{}'.format(cls.db_name)))
+        cls.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        cls.bot.learn(question='slow test', answer='test_chatbot.slow_answer', type_=1, parameters='seconds=1;')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.bot.close()
+
+    def test_not_truncated(self):
+        self.assertNotIn('truncated', self.bot.get_response('早上吃鸡蛋对身体好吗'))
+        response = self.bot.get_response('早上吃鸡蛋对身体好吗', timeout=60)
+        self.assertEqual(response['text'], '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        self.assertFalse(response['truncated'])
+
+    def test_slow_answer(self):
+        start = time.perf_counter()
+        response = self.bot.get_response('slow test', timeout=0.3)
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertTrue(response['truncated'])
+        self.assertIn('1.slow test', response['text'])
+
+        # truncated responses are not cached
+        response = self.bot.get_response('slow test', timeout=5)
+        self.assertEqual(response['text'], 'done')
+        self.assertFalse(response['truncated'])
+
+    def test_expired(self):
+        response = self.bot.get_response('早上吃鸡蛋对身体好吗', timeout=0)
+        self.assertTrue(response['truncated'])
+        self.assertEqual(asyncio.run(self.bot.aget_response('早上吃鸡蛋对身体好吗', timeout=0)), response)
+
+
 # class ChatBotTest111(TestCase):
 #     @classmethod
 #     def setUpClass(cls):
@@ -1,5 +1,8 @@
-from chatbot.comparison import LevenshteinDistance
+from chatbot.comparison import LevenshteinDistance, TfidfSimilarity
+from difflib import SequenceMatcher
 from unittest import TestCase
+from unittest.mock import patch
+import random
 
 
 class LevenshteinDistanceTest(TestCase):
@@ -36,3 +39,130 @@ class LevenshteinDistanceTest(TestCase):
         self.assertLess(value, 1)
         self.assertGreater(value, 0)
 
+    def test_compare_many(self):
+        statement = '早上吃鸡蛋对身体好吗?'
+        other_statements = ['早上吃鸡蛋对身体好吗?', '今天下暴雨', '']
+        self.assertEqual(self.compare.compare_many(statement, other_statements), [1, 0, 0])
+
+    def test_most_similar(self):
+        def most_similar(statement, other_statements, number, minimum_similarity, maximum_similarity):
+            all_result = []
+            for index, other_statement in enumerate(other_statements):
+                similarity = self.compare(statement, other_statement)
+                if similarity >= minimum_similarity:
+                    all_result.append((index, similarity))
+                    if similarity >= maximum_similarity:
+                        return [all_result[-1]]
+            all_result.sort(key=lambda s: s[1], reverse=True)
+            return all_result[:number]
+
+        class CountingSequenceMatcher(SequenceMatcher):
+            ratio_count = 0
+
+            def ratio(self):
+                CountingSequenceMatcher.ratio_count += 1
+                return super().ratio()
+
+        random_ = random.Random(0)
+        other_statements = [
+            ''.join(random_.choice('早上吃鸡蛋对身体好吗今天下暴雨') for _ in range(random_.randint(0, 12)))
+            for _ in range(300)
+        ]
+        with patch('chatbot.comparison.SequenceMatcher', CountingSequenceMatcher):
+            for statement in ['早上吃鸡蛋对身体好吗', '今天下暴雨', '吃', '']:
+                for number, minimum_similarity, maximum_similarity in [(5, 0.2, 0.85), (1, 0, 1.1), (3, 0.5, 2)]:
+                    self.assertEqual(
+                        self.compare.most_similar(
+                            statement, other_statements, number, minimum_similarity, maximum_similarity
+                        ),
+                        most_similar(statement, other_statements, number, minimum_similarity, maximum_similarity)
+                    )
+
+            CountingSequenceMatcher.ratio_count = 0
+            self.compare.most_similar('早上吃鸡蛋对身体好吗', other_statements, 5, 0.2, 2)
+            self.assertLess(CountingSequenceMatcher.ratio_count, len(other_statements) / 2)
+
+    def test_length_bound_before_indexing(self):
+        other_statements = ['早上吃鸡蛋对身体好吗', '吃', '早上吃鸡蛋', '早上吃鸡蛋好吗呢']
+        with patch.object(SequenceMatcher, 'set_seq2', autospec=True, side_effect=SequenceMatcher.set_seq2) as set_seq2:
+            self.assertEqual(self.compare.most_similar('早上吃鸡蛋好吗', other_statements, 5, 0.9, 2), [(3, 0.93)])
+        self.assertEqual([call[0][1] for call in set_seq2.call_args_list if call[0][1]], ['早上吃鸡蛋好吗呢'])
+
+
+class TfidfSimilarityTest(TestCase):
+    def setUp(self):
+        self.compare = TfidfSimilarity()
+        self.compare.fit(['早上吃鸡蛋对身体好吗?', '今天下暴雨', '早上不吃饭对胃不好'])
+
+    def test_compare_statement_false(self):
+        self.assertEqual(self.compare('', '测试'), 0)
+        self.assertEqual(self.compare('测试', ''), 0)
+
+    def test_compare_with_same_statement(self):
+        self.assertEqual(self.compare('早上吃鸡蛋对身体好吗?', '早上吃鸡蛋对身体好吗?'), 1)
+
+    def test_compare_with_different_statement(self):
+        self.assertEqual(self.compare('早上吃鸡蛋对身体好吗?', '今天下暴雨'), 0)
+        value = self.compare('早上吃鸡蛋对身体好吗?', '早上不吃饭对胃不好')
+        self.assertLess(value, 1)
+        self.assertGreater(value, 0)
+
+    def test_similarities(self):
+        similarities = self.compare.similarities('早上吃鸡蛋好吗')
+        self.assertEqual(set(similarities), {'早上吃鸡蛋对身体好吗?', '早上不吃饭对胃不好'})
+        for question, similarity in similarities.items():
+            self.assertEqual(similarity, self.compare('早上吃鸡蛋好吗', question))
+        self.assertGreater(similarities['早上吃鸡蛋对身体好吗?'], similarities['早上不吃饭对胃不好'])
+
+    def test_similarities_of_candidates(self):
+        compare = TfidfSimilarity()
+        compare.fit(['问题{}好吗'.format(index) for index in range(500)] + ['早上吃鸡蛋好吗'])
+        all_similarity = compare.similarities('早上吃鸡蛋好吗')
+        candidates = ['早上吃鸡蛋好吗', '问题7好吗', '不存在的问题']
+        self.assertEqual(
+            compare.similarities('早上吃鸡蛋好吗', candidates),
+            {question: all_similarity[question] for question in candidates[:2]}
+        )
+
+        # the posting list of a common n-gram is not walked for a few candidates
+        class Postings(dict):
+            def items(self):
+                raise AssertionError()
+
+        compare.postings['吗'] = Postings(compare.postings['吗'])
+        self.assertEqual(compare.compare_many('早上吃鸡蛋好吗', candidates[:2]), [1, all_similarity['问题7好吗']])
+
+    def test_add_and_remove(self):
+        self.compare.add('今天天气怎么样')
+        self.assertEqual(len(self.compare), 4)
+        self.assertEqual(self.compare.similarities('今天天气怎么样')['今天天气怎么样'], 1)
+
+        self.compare.remove('今天天气怎么样')
+        self.compare.remove('今天下暴雨')
+        self.assertEqual(len(self.compare), 2)
+        self.assertEqual(self.compare.similarities('今天天气怎么样'), {})
+
+    def test_incremental_norms(self):
+        compare = TfidfSimilarity(refit_ratio=0.5)
+        compare.fit(['早上吃鸡蛋对身体好吗?', '今天下暴雨', '早上不吃饭对胃不好', '晚上吃鸡蛋好吗'])
+
+        # only the norm of the new row is computed
+        with patch.object(TfidfSimilarity, 'refit', side_effect=AssertionError):
+            compare.add('今天天气怎么样')
+            compare.remove('今天下暴雨')
+        self.assertEqual(compare.similarities('今天天气怎么样')['今天天气怎么样'], 1)
+        self.assertEqual(set(compare.norms), set(compare.questions))
+
+        # the idf is fitted again once enough rows have changed
+        with patch.object(TfidfSimilarity, 'refit', wraps=compare.refit) as refit:
+            compare.add('明天下雨吗')
+        self.assertEqual(refit.call_count, 1)
+        self.assertEqual(compare.similarities('明天下雨吗')['明天下雨吗'], 1)
+
+    def test_compare_many(self):
+        other_statements = ['早上吃鸡蛋对身体好吗?', '今天天气怎么样', '早上不吃饭对胃不好']
+        self.assertEqual(
+            self.compare.compare_many('早上吃鸡蛋好吗', other_statements),
+            [self.compare('早上吃鸡蛋好吗', other_statement) for other_statement in other_statements]
+        )
+        self.assertEqual(self.compare.compare_many('', other_statements), [0, 0, 0])
@@ -0,0 +1,122 @@
+import os
+from unittest import TestCase
+from chatbot.index import StatementRecord, TagIndex, BM25Index, MinHashLSHIndex
+from chatbot.storage import SQLStorage
+from chatbot.models import statement_table_name, tag_table_name, tag_association_statement_table_name
+
+
+current_file_path = os.path.dirname((os.path.abspath(__file__)))
+
+
+def new_record(id_, question):
+    return StatementRecord(
+        id=id_,
+        question=question,
+        answer='answer of {}'.format(question),
+        category='其他',
+        type=0,
+        parameters='',
+        extractor=''
+    )
+
+
+class TagIndexTest(TestCase):
+    def setUp(self):
+        self.index = TagIndex()
+        self.index.add(new_record(1, '早上吃鸡蛋对身体好吗'), ['早上', '鸡蛋', '身体'])
+        self.index.add(new_record(2, '晚上吃鸡蛋好吗'), ['晚上', '鸡蛋'])
+
+    def test_search(self):
+        self.assertEqual([r.id for r in self.index.search(['鸡蛋'])], [1, 2])
+        self.assertEqual([r.id for r in self.index.search(['早上', '晚上'])], [1, 2])
+        self.assertEqual([r.id for r in self.index.search(['身体'])], [1])
+        self.assertEqual(self.index.search(['天气']), [])
+
+    def test_search_with_limit(self):
+        self.assertEqual([r.id for r in self.index.search(['晚上', '鸡蛋'], limit=1)], [2])
+        self.assertEqual([r.id for r in self.index.search(['晚上', '鸡蛋'], limit=5)], [2, 1])
+        self.assertEqual([r.id for r in self.index.search(['鸡蛋'], limit=1)], [1])
+
+    def test_remove(self):
+        self.index.remove(1)
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual([r.id for r in self.index.search(['鸡蛋', '早上'])], [2])
+        self.assertNotIn('早上', self.index.postings)
+
+        # unknown ids are ignored
+        self.index.remove(100)
+        self.assertEqual(len(self.index), 1)
+
+    def test_add_existing_statement(self):
+        self.index.add(new_record(1, '早上喝牛奶好吗'), ['早上', '牛奶'])
+        self.assertEqual(self.index.get(1).question, '早上喝牛奶好吗')
+        self.assertEqual([r.id for r in self.index.search(['身体'])], [])
+        self.assertEqual([r.id for r in self.index.search(['牛奶'])], [1])
+
+    def test_build(self):
+        db_name = 'index_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        statement_id = storage.create(statement_table_name, question='今天天气如何', answer='晴天')
+        tag_id = storage.create(tag_table_name, name='天气')
+        storage.create(tag_association_statement_table_name, tag_id=tag_id, statement_id=statement_id)
+
+        index = TagIndex()
+        index.build(storage)
+        self.assertEqual(len(index), 1)
+        record = index.search(['天气'])[0]
+        self.assertEqual(record.id, statement_id)
+        self.assertEqual(record.question, '今天天气如何')
+        self.assertEqual(record.answer, '晴天')
+
+
+class BM25IndexTest(TestCase):
+    def setUp(self):
+        self.index = BM25Index(top_n=2)
+        self.index.add(new_record(1, '吃鸡蛋好吗'), ['鸡蛋'])
+        self.index.add(new_record(2, '晚上喝牛奶吃鸡蛋对身体好吗'), ['晚上', '牛奶', '鸡蛋', '身体'])
+        self.index.add(new_record(3, '早上吃鸡蛋好吗'), ['早上', '鸡蛋'])
+
+    def test_search(self):
+        # the rare tag weighs more than the frequent one
+        self.assertEqual([r.id for r in self.index.search(['早上', '鸡蛋'])], [3, 1])
+        # a statement with few tags weighs more than one with many
+        self.assertEqual([r.id for r in self.index.search(['鸡蛋'], limit=3)], [1, 3, 2])
+        self.assertEqual(self.index.search(['天气']), [])
+
+    def test_remove(self):
+        self.index.remove(3)
+        self.assertEqual(self.index.total_length, 5)
+        self.assertEqual([r.id for r in self.index.search(['早上', '鸡蛋'])], [1, 2])
+
+        self.index.clear()
+        self.assertEqual(self.index.total_length, 0)
+        self.assertEqual(self.index.search(['鸡蛋']), [])
+
+
+class MinHashLSHIndexTest(TestCase):
+    def setUp(self):
+        self.index = MinHashLSHIndex()
+        for id_, question in enumerate(['早上吃鸡蛋对身体好吗', '晚上吃鸡蛋好吗', '今天天气怎么样', '你叫什么名字'], 1):
+            self.index.add(new_record(id_, question))
+
+    def test_search(self):
+        self.assertEqual([r.question for r in self.index.search('早上吃鸡蛋对身体好不好')], ['早上吃鸡蛋对身体好吗'])
+        self.assertEqual([r.question for r in self.index.search('今天的天气怎么样')], ['今天天气怎么样'])
+        self.assertEqual(self.index.search('火车票怎么买'), [])
+        self.assertEqual(self.index.search(''), [])
+
+    def test_signature_is_deterministic(self):
+        self.assertEqual(MinHashLSHIndex(seed=2).signature('今天天气怎么样'), MinHashLSHIndex(seed=2).signature('今天天气怎么样'))
+
+    def test_remove(self):
+        self.index.remove(1)
+        self.assertEqual(self.index.search('早上吃鸡蛋对身体好不好'), [])
+        self.assertNotIn(1, self.index.signatures)
+        self.assertTrue(all(1 not in statement_ids for statement_ids in self.index.buckets.values()))
+
+    def test_invalid_bands(self):
+        with self.assertRaises(ValueError):
+            MinHashLSHIndex(number_of_permutations=64, bands=10)
@@ -0,0 +1,61 @@
+import re
+from unittest import TestCase
+from unittest.mock import patch
+from chatbot.registry import AnswerFunctionRegistry
+from chatbot.utils import import_module
+from chatbot.conversation import Statement
+from chatbot.exceptions import NotEnoughParameterError
+
+
+def get_weather(city, date='今天'):
+    """
+    :param str city: 城市
+    :param str date: 日期
+    """
+    return '{}{}晴天'.format(city, date)
+
+
+class AnswerFunctionRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = AnswerFunctionRegistry()
+
+    def test_get(self):
+        answer_function = self.registry.get('re.split')
+        self.assertIs(answer_function.function, re.split)
+        self.assertEqual(list(answer_function.arguments.items()),
+                         [('pattern', None), ('string', None), ('maxsplit', 0), ('flags', 0)])
+        self.assertEqual(answer_function.object_path, 're.split')
+        self.assertIs(self.registry.get('re.split'), answer_function)
+
+        arguments = answer_function.new_arguments()
+        arguments['pattern'] = ':'
+        self.assertIsNone(answer_function.arguments['pattern'])
+
+    def test_parameter_descriptions(self):
+        answer_function = self.registry.get('test_registry.get_weather')
+        self.assertEqual(answer_function.parameter_descriptions, {'city': '城市', 'date': '日期'})
+
+    def test_invalidate(self):
+        answer_function = self.registry.get('re.split')
+        self.registry.invalidate('re.split')
+        self.assertNotIn('re.split', self.registry)
+        self.assertIsNot(self.registry.get('re.split'), answer_function)
+
+        self.registry.get('re.sub')
+        self.registry.invalidate()
+        self.assertEqual(len(self.registry), 0)
+
+    def test_statement_resolves_once(self):
+        with patch('chatbot.registry.import_module', wraps=import_module) as patched_import_module:
+            for _ in range(3):
+                statement = Statement('天气', 'test_registry.get_weather', type=1, parameters='date=明天',
+                                      answer_functions=self.registry)
+            self.assertEqual(patched_import_module.call_count, 1)
+
+        self.assertEqual(statement.parameters, {'city': None, 'date': '明天'})
+        with self.assertRaises(NotEnoughParameterError) as context:
+            statement.get_answer()
+        self.assertEqual(context.exception.message, '请提供城市')
+
+        statement.parameters['city'] = '北京'
+        self.assertEqual(statement.get_answer(), '北京明天晴天')
@@ -0,0 +1,94 @@
+import os
+import tempfile
+from unittest import TestCase
+from chatbot.chatbot import ChatBot
+from chatbot.storage import SQLStorage
+from chatbot.index import StatementRecord
+from chatbot.snapshot import write_snapshot, compare_snapshot, Snapshot, SnapshotIndex
+from chatbot.exceptions import SnapshotFormatError
+from chatbot import manage
+
+
+current_file_path = os.path.dirname((os.path.abspath(__file__)))
+
+
+class SnapshotTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db_name = 'snapshot_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, cls.db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.storage = SQLStorage(database_uri='sqlite:///{}'.format(cls.db_name))
+        cls.bot = ChatBot('test', storage=cls.storage, logic_adapters=[])
+        cls.bot.learn('早上吃鸡蛋对身体好吗', '早餐当中吃鸡蛋，的确是对身体有很大的益处')
+        cls.bot.learn('晚上吃鸡蛋好吗', '晚上吃鸡蛋不好消化')
+        cls.bot.learn('今天天气怎么样', '晴天')
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.directory.name, 'index.snapshot')
+        write_snapshot(self.storage, self.snapshot_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot(self):
+        snapshot = Snapshot(self.snapshot_path)
+        try:
+            self.assertEqual(len(snapshot), 3)
+            self.assertEqual(snapshot.ids.tolist(), [1, 2, 3])
+            self.assertEqual(
+                snapshot.get_record(2), StatementRecord.from_object(list(self.storage.filter('statement', id=3))[0])
+            )
+            self.assertEqual(snapshot.get_feature(2), self.storage.filter_statement_features()[3])
+            self.assertEqual(snapshot.get_rows('鸡蛋'), [0, 1])
+            self.assertEqual(snapshot.get_rows('火车'), [])
+            self.assertIsNone(snapshot.find_row(4))
+        finally:
+            snapshot.close()
+
+    def test_wrong_version(self):
+        with open(self.snapshot_path, 'r+b') as f:
+            f.seek(8)
+            f.write(b'\x02\x00\x00\x00')
+        with self.assertRaises(SnapshotFormatError):
+            Snapshot(self.snapshot_path)
+
+    def test_index_without_snapshot_path(self):
+        with self.assertRaises(ValueError):
+            SnapshotIndex()
+
+    def test_index(self):
+        index = SnapshotIndex(snapshot_path=self.snapshot_path)
+        index.build(None)
+        self.assertEqual(len(index), 3)
+        self.assertEqual([r.id for r in index.search(['鸡蛋', '早上'])], [1, 2])
+        self.assertEqual([r.id for r in index.search(['鸡蛋', '早上'], limit=1)], [1])
+
+        # learned and forgotten statements are kept on top of the snapshot
+        index.add(StatementRecord(4, '早上喝牛奶好吗', '好', '其他', 0, '', ''), ['早上', '牛奶'])
+        index.remove(1)
+        self.assertEqual(len(index), 3)
+        self.assertIsNone(index.get(1))
+        self.assertEqual([r.id for r in index.search(['鸡蛋', '早上'])], [2, 4])
+        index.close()
+
+    def test_compare(self):
+        self.assertEqual(
+            compare_snapshot(self.storage, self.snapshot_path), {'missing': [], 'extra': [], 'changed': []}
+        )
+
+        self.bot.learn('你叫什么名字', '我是机器人')
+        self.storage.execute("UPDATE statement SET answer = '多云' WHERE question = '今天天气怎么样'")
+        try:
+            self.assertEqual(
+                compare_snapshot(self.storage, self.snapshot_path), {'missing': [4], 'extra': [], 'changed': [3]}
+            )
+            database_uri = 'sqlite:///{}'.format(self.db_name)
+            self.assertEqual(manage.main(['--database-uri', database_uri, 'compare-snapshot', self.snapshot_path]), 1)
+            self.assertEqual(manage.main(['--database-uri', database_uri, 'build-snapshot', self.snapshot_path]), 0)
+            self.assertEqual(manage.main(['--database-uri', database_uri, 'compare-snapshot', self.snapshot_path]), 0)
+        finally:
+            self.bot.forget('你叫什么名字')
+            self.storage.execute("UPDATE statement SET answer = '晴天' WHERE question = '今天天气怎么样'")
@@ -1,8 +1,12 @@
 import os
+import asyncio
 from unittest import TestCase
-from chatbot.storage import SQLStorage, StatementStorage
+from chatbot.storage import SQLStorage, StatementStorage, AsyncSQLStorage
 from chatbot.models import Statement, Tag, TagAssociationStatement, AccessLog
-from chatbot.exceptions import ModelNotExistError, DeleteDataWithoutConditionError
+from chatbot.exceptions import ModelNotExistError, DeleteDataWithoutConditionError, DuplicateRowsError
+from chatbot import manage
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import reflection
 
 
 current_file_path = os.path.dirname((os.path.abspath(__file__)))
@@ -151,3 +155,272 @@ class StatementStorageTest(TestCase):
             self.assertEqual(statement.question[:-1], '早上吃鸡蛋对身体好吗')
             self.assertEqual(statement.answer, '早餐当中吃鸡蛋，的确是对身体有很大的益处')
         self.statement_storage.delete(**condition)
+
+
+class SQLStorageSessionTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db_name = 'sql_storage_session_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name), scoped_session=True)
+
+    def tearDown(self):
+        self.storage.execute('delete from statement')
+
+    def test_scoped_session(self):
+        self.assertIs(self.storage.Session(), self.storage.Session())
+        self.storage.create('statement', question='q1', answer='a1')
+        self.assertEqual([s.answer for s in self.storage.filter('statement', question='q1')], ['a1'])
+
+    def test_unit_of_work_commit(self):
+        with self.storage.unit_of_work():
+            statement_id = self.storage.create('statement', question='q1', answer='a1')
+            self.storage.create('statement', question='q2', answer='a2')
+            self.assertEqual(list(self.storage.filter('statement', question='q1'))[0].id, statement_id)
+        self.assertEqual(self.storage.count('statement'), 2)
+
+    def test_unit_of_work_rollback(self):
+        with self.assertRaises(ValueError):
+            with self.storage.unit_of_work():
+                self.storage.create('statement', question='q1', answer='a1')
+                with self.storage.unit_of_work():
+                    self.storage.create('statement', question='q2', answer='a2')
+                raise ValueError()
+        self.assertEqual(self.storage.count('statement'), 0)
+
+    def test_filter_releases_session(self):
+        self.storage.create('statement', question='q1', answer='a1')
+        self.storage.create('statement', question='q2', answer='a2')
+        for statement in self.storage.filter('statement'):
+            # the session is not held by the generator, so writing while iterating is safe
+            self.storage.create('statement', question=statement.question + '_copy', answer=statement.answer)
+            self.assertTrue(statement.answer)
+        self.assertEqual(self.storage.count('statement'), 4)
+
+    def test_pool_options(self):
+        storage = SQLStorage(
+            database_uri='sqlite:///sql_storage_pool_test.sqlite3',
+            engine_options={'poolclass': QueuePool},
+            pool_size=3,
+            max_overflow=0
+        )
+        self.assertEqual(storage.engine.pool.size(), 3)
+        storage.close()
+
+
+class SQLStorageUpgradeTest(TestCase):
+    def test_upgrade_database(self):
+        db_name = 'sql_storage_upgrade_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+
+        # the schema of a database created by an older version, without indexes
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        for index_name in ['ix_tag_association_statement_tag_id_statement_id',
+                           'ix_tag_association_statement_statement_id',
+                           'ix_access_log_statement_id']:
+            storage.execute('DROP INDEX {}'.format(index_name))
+        storage.execute('INSERT INTO tag_association_statement(tag_id, statement_id) VALUES (1, 1)')
+        storage.execute('INSERT INTO tag_association_statement(tag_id, statement_id) VALUES (1, 1)')
+        storage.execute('INSERT INTO tag_association_statement(tag_id, statement_id) VALUES (1, 2)')
+
+        # the schema is only upgraded on request
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        inspect = reflection.Inspector.from_engine(storage.engine)
+        self.assertEqual(inspect.get_indexes('tag_association_statement'), [])
+
+        # duplicate rows are reported, not deleted
+        with self.assertRaises(DuplicateRowsError) as context:
+            SQLStorage(database_uri='sqlite:///{}'.format(db_name), upgrade=True)
+        self.assertEqual(context.exception.duplicate_count, 1)
+        self.assertIn('--delete-duplicates', context.exception.message)
+        self.assertEqual(storage.count('tag_association_statement'), 3)
+        # the refused upgrade does not create any of the missing indexes
+        inspect = reflection.Inspector.from_engine(storage.engine)
+        self.assertEqual(inspect.get_indexes('tag_association_statement'), [])
+        self.assertEqual(inspect.get_indexes('access_log'), [])
+        self.assertEqual(manage.main(['--database-uri', 'sqlite:///{}'.format(db_name), 'upgrade-db']), 1)
+        self.assertEqual(storage.count('tag_association_statement'), 3)
+
+        self.assertEqual(
+            manage.main(['--database-uri', 'sqlite:///{}'.format(db_name), 'upgrade-db', '--delete-duplicates']), 0
+        )
+        inspect = reflection.Inspector.from_engine(storage.engine)
+        self.assertEqual(
+            {index_info['name'] for index_info in inspect.get_indexes('tag_association_statement')},
+            {'ix_tag_association_statement_tag_id_statement_id', 'ix_tag_association_statement_statement_id'}
+        )
+        self.assertEqual(
+            [index_info['name'] for index_info in inspect.get_indexes('access_log')], ['ix_access_log_statement_id']
+        )
+        self.assertEqual(storage.count('tag_association_statement'), 2)
+
+
+class SQLStorageFilterByTagsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db_name = 'sql_storage_filter_by_tags_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        cls.storage.create_statements([
+            ({'question': '早上吃鸡蛋对身体好吗', 'answer': '好'}, ['早上', '鸡蛋']),
+            ({'question': '晚上吃鸡蛋好吗', 'answer': '不好'}, ['晚上', '鸡蛋']),
+            ({'question': '"引号"是什么', 'answer': '标点符号'}, ['"引号"', "'单引号'"]),
+        ])
+        cls.storage.create(
+            'statement_feature', statement_id=2, normalized_question='晚上吃鸡蛋好吗', length=7,
+            ngrams='晚上 上吃 吃鸡 鸡蛋 蛋好 好吗', tokens='晚上 吃 鸡蛋 好 吗'
+        )
+
+    def test_filter_by_tags(self):
+        self.assertEqual([r.question for r in self.storage.filter_by_tags(['鸡蛋'])], ['早上吃鸡蛋对身体好吗', '晚上吃鸡蛋好吗'])
+        self.assertEqual([r.answer for r in self.storage.filter_by_tags(['晚上', '天气'])], ['不好'])
+        self.assertEqual(self.storage.filter_by_tags(['天气']), [])
+        self.assertEqual(self.storage.filter_by_tags([]), [])
+
+    def test_filter_by_tags_with_limit(self):
+        self.assertEqual(
+            [r.question for r in self.storage.filter_by_tags(['晚上', '鸡蛋'], limit=1)], ['晚上吃鸡蛋好吗']
+        )
+        self.assertEqual(
+            [r.question for r in self.storage.filter_by_tags(['晚上', '鸡蛋'], limit=5)],
+            ['晚上吃鸡蛋好吗', '早上吃鸡蛋对身体好吗']
+        )
+        self.assertEqual([r.question for r in self.storage.filter_by_tags(['鸡蛋'], limit=1)], ['早上吃鸡蛋对身体好吗'])
+
+    def test_all_statement_records(self):
+        all_record = self.storage.all_statement_records()
+        self.assertEqual([r.question for r in all_record], ['早上吃鸡蛋对身体好吗', '晚上吃鸡蛋好吗', '"引号"是什么'])
+        self.assertEqual(all_record[0].answer, '好')
+
+    def test_load_features_with_the_statements(self):
+        all_record = self.storage.all_statement_records(with_features=True)
+        self.assertEqual([(r.question, f) for r, f in all_record][::2], [('早上吃鸡蛋对身体好吗', None), ('"引号"是什么', None)])
+        record, feature = all_record[1]
+        self.assertEqual((record.question, feature.statement_id, feature.length), ('晚上吃鸡蛋好吗', record.id, 7))
+        self.assertEqual(feature.ngrams[:2], ('晚上', '上吃'))
+        self.assertEqual(feature.tokens, ('晚上', '吃', '鸡蛋', '好', '吗'))
+
+        self.assertEqual(
+            [(r.question, f.length if f else None) for r, f in self.storage.filter_by_tags(['鸡蛋'], with_features=True)],
+            [('早上吃鸡蛋对身体好吗', None), ('晚上吃鸡蛋好吗', 7)]
+        )
+        self.assertEqual(
+            [(r.question, f.length) for r, f in self.storage.filter_by_tags(['晚上', '鸡蛋'], 1, with_features=True)],
+            [('晚上吃鸡蛋好吗', 7)]
+        )
+
+    def test_filter_tagged_by_tags(self):
+        self.assertEqual(
+            [(r.question, tag_names) for r, tag_names in self.storage.filter_tagged_by_tags(['鸡蛋', '晚上'])],
+            [('早上吃鸡蛋对身体好吗', ('鸡蛋',)), ('晚上吃鸡蛋好吗', ('鸡蛋', '晚上'))]
+        )
+        self.assertEqual(len(self.storage.filter_tagged_by_tags(['早上', '晚上', '鸡蛋'], in_clause_size=1)), 2)
+        self.assertEqual(self.storage.filter_tagged_by_tags(['天气']), [])
+
+    def test_filter_tagged_by_tags_with_limit(self):
+        for in_clause_size in [500, 1]:
+            self.assertEqual(
+                [(r.question, tag_names) for r, tag_names in self.storage.filter_tagged_by_tags(
+                    ['鸡蛋', '晚上'], limit=1, in_clause_size=in_clause_size
+                )],
+                [('晚上吃鸡蛋好吗', ('鸡蛋', '晚上'))]
+            )
+            self.assertEqual(
+                [(r.question, tag_names) for r, tag_names in self.storage.filter_tagged_by_tags(
+                    ['早上', '晚上', '鸡蛋'], limit=1, in_clause_size=in_clause_size
+                )],
+                [('早上吃鸡蛋对身体好吗', ('早上', '鸡蛋'))]
+            )
+            self.assertEqual(
+                len(self.storage.filter_tagged_by_tags(['鸡蛋', '"引号"'], limit=5, in_clause_size=in_clause_size)), 3
+            )
+        self.assertEqual(self.storage.filter_tagged_by_tags(['天气'], limit=1), [])
+
+    def test_filter_tagged_by_tags_with_limit_per_group(self):
+        self.assertEqual(
+            [r.question for r, _ in self.storage.filter_tagged_by_tags(
+                ['鸡蛋', '晚上'], limit=1, all_group=[['鸡蛋'], ['鸡蛋', '晚上']]
+            )],
+            ['早上吃鸡蛋对身体好吗', '晚上吃鸡蛋好吗']
+        )
+        self.assertEqual(
+            [r.question for r, _ in self.storage.filter_tagged_by_tags(
+                ['鸡蛋', '晚上'], limit=1, all_group=[['鸡蛋'], ['鸡蛋']]
+            )],
+            ['早上吃鸡蛋对身体好吗']
+        )
+
+    def test_filter_by_quoted_tags(self):
+        self.assertEqual([r.answer for r in self.storage.filter_by_tags(['"引号"'])], ['标点符号'])
+        self.assertEqual([r.answer for r in self.storage.filter_by_tags(["'单引号'"])], ['标点符号'])
+
+    def test_compiled_query_is_reused(self):
+        self.storage._compiled_cache.clear()
+        self.storage.filter_by_tags(['早上'])
+        self.storage.filter_by_tags(['早上', '晚上', '鸡蛋'])
+        self.storage.filter_by_tags(['早上'], limit=1)
+        self.storage.filter_by_tags(['早上', '鸡蛋'], limit=2)
+        self.assertEqual(len(self.storage._compiled_cache), 2)
+
+
+class SQLStorageFullTextSearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db_name = 'sql_storage_full_text_search_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name))
+        storage.create('statement', question='今天天气怎么样', answer='晴天')
+
+        # the statements that already exist are indexed
+        cls.storage = SQLStorage(database_uri='sqlite:///{}'.format(db_name), full_text_search=True)
+
+    def test_search_questions(self):
+        self.assertEqual([r.answer for r in self.storage.search_questions('今天天汽怎么样')], ['晴天'])
+        self.assertEqual(self.storage.search_questions('你好'), [])
+        self.assertEqual(self.storage.search_questions('"今天" OR'), [])
+
+    def test_index_is_kept_in_sync(self):
+        self.storage.create('statement', question='明天天气怎么样', answer='下雨')
+        self.storage.create_statements([({'question': '后天天气怎么样', 'answer': '多云'}, ['天气'])])
+        self.assertEqual(
+            [r.answer for r in self.storage.search_questions('明天天气怎么样', limit=2)], ['下雨', '晴天']
+        )
+
+        self.storage.delete('statement', question='明天天气怎么样')
+        self.storage.delete('statement', question='后天天气怎么样')
+        self.assertEqual([r.answer for r in self.storage.search_questions('明天天气怎么样')], ['晴天'])
+
+
+class AsyncSQLStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        db_name = 'async_sql_storage_test.sqlite3'
+        db_file_path = os.path.join(current_file_path, db_name)
+        if os.path.isfile(db_file_path):
+            os.remove(db_file_path)
+        cls.storage = AsyncSQLStorage(database_uri='sqlite:///{}'.format(db_name), scoped_session=True)
+
+    def test_storage(self):
+        async def run():
+            await self.storage.create_statements([
+                ({'question': '早上吃鸡蛋对身体好吗', 'answer': '好'}, ['早上', '鸡蛋']),
+                ({'question': '晚上吃鸡蛋好吗', 'answer': '不好'}, ['晚上', '鸡蛋']),
+            ])
+            self.assertEqual(await self.storage.count('statement'), 2)
+            self.assertEqual(
+                [r.question for r in await self.storage.filter_by_tags(['鸡蛋'])], ['早上吃鸡蛋对身体好吗', '晚上吃鸡蛋好吗']
+            )
+            self.assertEqual([s.answer for s in await self.storage.filter('statement', question='晚上吃鸡蛋好吗')], ['不好'])
+            self.assertEqual(len(await self.storage.all_statement_records()), 2)
+            await self.storage.delete('statement', question='晚上吃鸡蛋好吗')
+            self.assertEqual(await self.storage.count('statement'), 1)
+
+        asyncio.run(run())